@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .coverage import _ITEMS, _mode_column, _per_lab_sql
+
+# Уровни, на которых потребность закрывается: та же аудитория, тот же адрес (корпус), любой адрес
+SCOPES = ("local", "building", "campus")
+
+_SEP = " | "
+
+
+def split_location(name: str) -> tuple[Optional[str], str]:
+    """'адрес | аудитория' -> (адрес, аудитория); без адреса (см. parser.mstuca) — (None, аудитория)."""
+    if _SEP in name:
+        address, room = name.split(_SEP, 1)
+        return address.strip(), room.strip()
+    return None, name.strip()
+
+
+def _match(supply: pd.DataFrame, demand: pd.DataFrame, by: list[str]) -> pd.DataFrame:
+    """
+    Жадное сопоставление остатков внутри групп by (одним проходом по всем группам сразу).
+    supply: by + (sid, qty), demand: by + (did, qty) -> (sid, did, qty).
+    В каждой группе сопоставляется min(есть, надо); остатки групп "выстраиваются" в одну ось
+    накопленных сумм, и пары (откуда, куда) — это пересечения отрезков supply и demand на ней.
+    """
+    empty = pd.DataFrame({"sid": np.zeros(0, np.int64), "did": np.zeros(0, np.int64), "qty": np.zeros(0, np.int64)})
+    supply = supply[supply["qty"] > 0]
+    demand = demand[demand["qty"] > 0]
+    if supply.empty or demand.empty:
+        return empty
+
+    totals = (
+        supply.groupby(by, sort=False)["qty"].sum().rename("s")
+        .to_frame().join(demand.groupby(by, sort=False)["qty"].sum().rename("d"), how="inner")
+    )
+    if totals.empty:
+        return empty
+    totals["m"] = np.minimum(totals["s"], totals["d"])
+    totals["offset"] = totals["m"].cumsum() - totals["m"]
+    order = totals.reset_index()[by].reset_index().rename(columns={"index": "g"})
+
+    def axis(frame: pd.DataFrame, id_col: str) -> tuple[np.ndarray, np.ndarray]:
+        f = frame.merge(order, on=by).sort_values(["g", id_col], kind="stable")
+        f = f.join(totals.reset_index(drop=True)[["m", "offset"]], on="g")
+        end = f.groupby("g")["qty"].cumsum().to_numpy()
+        m = f["m"].to_numpy()
+        # часть строки, попавшая в сопоставляемый объём группы
+        start = np.minimum(end - f["qty"].to_numpy(), m)
+        end = np.minimum(end, m)
+        keep = end > start
+        return (f["offset"].to_numpy() + end)[keep], f[id_col].to_numpy()[keep]
+
+    s_end, s_id = axis(supply, "sid")
+    d_end, d_id = axis(demand, "did")
+    points = np.union1d(s_end, d_end)
+    qty = np.diff(np.concatenate(([0], points)))
+    return pd.DataFrame({
+        "sid": s_id[np.searchsorted(s_end, points)],
+        "did": d_id[np.searchsorted(d_end, points)],
+        "qty": qty,
+    })
+
+
+def _load(db: Session, mode: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    col = _mode_column(mode)
+    conn = db.connection()
+    supply = pd.read_sql_query(text(f"""
+        SELECT {_ITEMS['inv_name']} AS name, l.id AS location_id, l.name AS location, SUM(v.qty_available)::bigint AS qty
+        FROM inventory v
+        JOIN items i ON i.id = v.item_id
+        JOIN locations l ON l.id = v.location_id
+        GROUP BY 1, 2, 3
+        HAVING SUM(v.qty_available) > 0
+    """), conn)
+    demand = pd.read_sql_query(text(f"""
+        SELECT lab, name, {col}::bigint AS qty
+        FROM ({_per_lab_sql(_ITEMS, peak=mode == 'peak')}) s
+        WHERE {col} > 0
+    """), conn)
+    places = pd.read_sql_query(text("SELECT lab, location FROM lab_locations"), conn)
+    locations = pd.read_sql_query(text("SELECT id, name FROM locations"), conn)
+
+    # адрес каждой локации
+    parts = [split_location(n) for n in locations["name"]]
+    locations["address"] = [a for a, _ in parts]
+    locations["room"] = [r for _, r in parts]
+    supply = supply.merge(locations[["id", "address"]], left_on="location_id", right_on="id").drop(columns="id")
+
+    # где лаборатория: точная локация, иначе адрес (корпус), иначе неизвестно (распределяется по всему вузу)
+    by_name = dict(zip(locations["name"], locations["id"]))
+    address_of = dict(zip(locations["id"], locations["address"]))
+    by_room = dict(zip(locations["room"], locations["id"]))
+    addresses = set(locations["address"].dropna())
+    places = dict(zip(places["lab"], places["location"]))
+
+    def place(lab) -> tuple[Optional[int], Optional[str]]:
+        if lab is None:
+            return None, None
+        where = places.get(lab, lab)
+        if where in by_name:
+            return by_name[where], address_of[by_name[where]]
+        address, room = split_location(where)
+        if address is None and room in addresses:
+            return None, room
+        if address is None and room in by_room:
+            return by_room[room], address_of[by_room[room]]
+        return None, address if address in addresses else None
+
+    labs = demand["lab"].drop_duplicates()
+    placed = pd.DataFrame([(lab, *place(lab)) for lab in labs], columns=["lab", "location_id", "address"])
+    demand = demand.merge(placed, on="lab", how="left")
+    demand["location_id"] = demand["location_id"].astype("Int64")
+    return supply, demand
+
+
+def allocate(db: Session, *, mode: str = "max_per_lab") -> dict:
+    """
+    Распределение инвентаря по лабораториям с учётом мест (транспортная задача).
+    Места образуют дерево: аудитория -> адрес (корпус) -> вуз; перевозка внутри корпуса дешевле,
+    чем между корпусами. На дереве минимальная по стоимости максимальная перевозка — это
+    сопоставление снизу вверх: сначала то, что уже стоит в аудитории лаборатории, затем остатки
+    внутри корпуса, затем по всему вузу. Каждый уровень — одно векторное сопоставление (_match)
+    по всем названиям сразу, без плотной матрицы "место × лаборатория".
+    """
+    supply, demand = _load(db, mode)
+    supply = supply.reset_index(drop=True)
+    supply["sid"] = supply.index
+    demand = demand.reset_index(drop=True)
+    demand["did"] = demand.index
+    required = demand["qty"].to_numpy().copy()
+
+    levels = (
+        ("local", ["name", "location_id"], demand["location_id"].notna()),
+        ("building", ["name", "address"], demand["address"].notna()),
+        ("campus", ["name"], pd.Series(True, index=demand.index)),
+    )
+    moves = []
+    covered = {}
+    for scope, by, placed in levels:
+        s = supply[supply["address"].notna()] if scope == "building" else supply
+        m = _match(s[by + ["sid", "qty"]], demand.loc[placed, by + ["did", "qty"]], by)
+        m["scope"] = scope
+        moves.append(m)
+        used = m.groupby("sid")["qty"].sum()
+        got = m.groupby("did")["qty"].sum()
+        supply["qty"] = supply["qty"] - used.reindex(supply["sid"], fill_value=0).to_numpy()
+        demand["qty"] = demand["qty"] - got.reindex(demand["did"], fill_value=0).to_numpy()
+        covered[scope] = got.reindex(demand["did"], fill_value=0).to_numpy()
+
+    demand["required"] = required
+    demand["deficit"] = demand["qty"]
+    for scope in SCOPES:
+        demand[scope] = covered[scope]
+
+    moves = pd.concat(moves, ignore_index=True)
+    transfers = moves[moves["scope"] != "local"]
+    transfers = (
+        transfers
+        .merge(supply[["sid", "name", "location"]], on="sid")
+        .merge(demand[["did", "lab"]], on="did")
+        .sort_values(["qty", "name", "location", "lab"], ascending=[False, True, True, True], kind="stable")
+    )
+
+    labs = (
+        demand.assign(lab=demand["lab"].fillna(""))
+        .groupby("lab", sort=True)[["required", *SCOPES, "deficit"]].sum()
+        .reset_index()
+    )
+    return {
+        "mode": mode,
+        "summary": {
+            "required": int(demand["required"].sum()),
+            **{scope: int(demand[scope].sum()) for scope in SCOPES},
+            "deficit": int(demand["deficit"].sum()),
+            "transfers": int(len(transfers)),
+        },
+        "labs": [
+            {"lab": r.lab or None, "required": int(r.required), "covered_local": int(r.local),
+             "transferred": int(r.building + r.campus), "deficit": int(r.deficit)}
+            for r in labs.itertuples(index=False)
+        ],
+        "deficits": [
+            {"lab": r.lab, "item_name": r.name, "qty_required": int(r.required), "deficit": int(r.deficit)}
+            for r in demand[demand["deficit"] > 0]
+            .sort_values(["deficit", "lab", "name"], ascending=[False, True, True], kind="stable")
+            .itertuples(index=False)
+        ],
+        "transfers": [
+            {"item_name": r.name, "from_location": r.location, "to_lab": r.lab, "qty": int(r.qty), "scope": r.scope}
+            for r in transfers.itertuples(index=False)
+        ],
+    }
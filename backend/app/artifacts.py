@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from . import coverage, reports
+from .cache import data_generation
+from .compression import ENCODINGS, SUFFIXES, StreamCompressor, compressible, variant_etag
+
+# Готовые файлы отчётов: objects/<sha256>.<формат> (одинаковое содержимое — один файл),
+# рядом сжатые варианты текстовых (.gz / .zst), и manifest-g<поколение>.json — какой файл
+# отвечает какому отчёту в этом поколении данных
+ARTIFACTS_DIR = Path(os.getenv("REPORT_ARTIFACTS_DIR", "/app/data/.report_cache"))
+# Сколько секунд файлы прошлого поколения живут после публикации следующего: запрос, получивший
+# путь из lookup() прямо перед публикацией, должен успеть открыть файл
+ARTIFACTS_GRACE_SEC = int(os.getenv("REPORT_ARTIFACTS_GRACE_SEC", "300"))
+
+_state_lock = threading.Lock()
+_manifest: tuple[int, dict] = (-1, {})
+_wake = threading.Event()
+_worker: Optional[threading.Thread] = None
+STATUS: dict = {"generation": None, "built_at": None, "elapsed_sec": None, "files": 0, "bytes": 0, "error": None}
+
+
+def artifact_key(kind: str, fmt: str, *, mode: str, only_deficit: bool) -> str:
+    return f"{kind}-{mode}-{'deficit' if only_deficit else 'all'}.{fmt}"
+
+
+def _manifest_path(generation: int) -> Path:
+    return ARTIFACTS_DIR / f"manifest-g{generation}.json"
+
+
+def _objects() -> Path:
+    return ARTIFACTS_DIR / "objects"
+
+
+def _store(chunks: Iterable[bytes], fmt: str, encodings: tuple[str, ...] = ()) -> dict:
+    """
+    Пишет поток во временный файл, считая sha256, и тем же проходом — сжатые варианты;
+    готовые файлы переименовываются в objects/<sha256>.<fmt>[.gz|.zst].
+    """
+    tmp = _objects() / f".tmp-{os.getpid()}-{threading.get_ident()}"
+    digest = hashlib.sha256()
+    size = 0
+    streams = {e: StreamCompressor(e) for e in encodings}
+    files = {e: open(tmp.with_name(tmp.name + SUFFIXES[e]), "wb") for e in encodings}
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+                for e, stream in streams.items():
+                    files[e].write(stream.compress(chunk))
+        for e, stream in streams.items():
+            files[e].write(stream.finish())
+    finally:
+        for file in files.values():
+            file.close()
+
+    name = f"{digest.hexdigest()}.{fmt}"
+    os.replace(tmp, _objects() / name)
+    variants = {}
+    for e in encodings:
+        variants[e] = name + SUFFIXES[e]
+        os.replace(tmp.with_name(tmp.name + SUFFIXES[e]), _objects() / variants[e])
+    return {"object": name, "size": size, "encodings": variants}
+
+
+def _evict(generation: int) -> None:
+    # манифесты прошлых поколений, сменённые следующим больше ARTIFACTS_GRACE_SEC назад,
+    # и файлы, на которые больше никто не ссылается
+    manifests = sorted((int(p.stem.removeprefix("manifest-g")), p) for p in ARTIFACTS_DIR.glob("manifest-g*.json"))
+    deadline = time.time() - ARTIFACTS_GRACE_SEC
+    keep = set()
+    for (g, path), (_, newer) in zip(manifests, manifests[1:] + [(None, None)]):
+        try:
+            if g < generation and newer is not None and newer.stat().st_mtime < deadline:
+                path.unlink(missing_ok=True)
+                continue
+            entries = json.loads(path.read_text())
+        except FileNotFoundError:  # убрал другой процесс
+            continue
+        for e in entries.values():
+            keep.update([e["object"], *e.get("encodings", {}).values()])
+    for path in _objects().iterdir():
+        if path.name not in keep and not path.name.startswith(".tmp-"):
+            path.unlink(missing_ok=True)
+
+
+def materialize() -> dict:
+    """
+    Все отчёты покрытия (вид × mode × only_deficit × формат) текущего поколения данных — в файлы.
+    Если пока считали, данные поменялись (импорт закоммитился), результат не публикуется:
+    следующий запуск соберёт уже новое поколение.
+    """
+    generation = data_generation()
+    if _manifest_path(generation).exists():
+        return {"generation": generation, "built": False}
+
+    started = time.time()
+    _objects().mkdir(parents=True, exist_ok=True)
+    entries = {}
+    for kind in reports.REPORTS:
+        for mode in coverage.MODES:
+            for only_deficit in (True, False):
+                for fmt, (body, media_type) in reports.FORMATS.items():
+                    # xlsx уже сжат (zip) — варианты только для текстовых
+                    encodings = ENCODINGS if compressible(media_type) else ()
+                    entries[artifact_key(kind, fmt, mode=mode, only_deficit=only_deficit)] = _store(
+                        body(kind, mode=mode, only_deficit=only_deficit), fmt, encodings,
+                    )
+
+    if data_generation() != generation:
+        return {"generation": generation, "built": False, "stale": True}
+
+    tmp = ARTIFACTS_DIR / f".manifest-{os.getpid()}.tmp"
+    tmp.write_text(json.dumps(entries, ensure_ascii=False, indent=1))
+    os.replace(tmp, _manifest_path(generation))
+    _evict(generation)
+    return {
+        "generation": generation,
+        "built": True,
+        "files": len(entries),
+        "bytes": sum(e["size"] for e in entries.values()),
+        "elapsed_sec": round(time.time() - started, 3),
+    }
+
+
+def lookup(
+    kind: str, fmt: str, *, mode: str, only_deficit: bool, encoding: Optional[str] = None,
+) -> Optional[tuple[Path, str, Optional[str]]]:
+    """
+    (файл, ETag, кодировка) готового отчёта для текущего поколения данных; None — ещё не собран.
+    encoding — что принимает клиент (compression.negotiate): если есть такой сжатый вариант, отдаётся он.
+    """
+    global _manifest
+    generation = data_generation()
+    with _state_lock:
+        if _manifest[0] != generation:
+            path = _manifest_path(generation)
+            if not path.exists():
+                return None
+            _manifest = (generation, json.loads(path.read_text()))
+        entry = _manifest[1].get(artifact_key(kind, fmt, mode=mode, only_deficit=only_deficit))
+    if entry is None:
+        return None
+    etag = f'"{entry["object"].split(".")[0]}"'
+    variant = entry.get("encodings", {}).get(encoding)
+    if variant is not None and (_objects() / variant).is_file():
+        return _objects() / variant, variant_etag(etag, encoding), encoding
+    path = _objects() / entry["object"]
+    if not path.is_file():
+        return None
+    return path, etag, None
+
+
+def _loop() -> None:
+    while True:
+        _wake.wait()
+        _wake.clear()
+        try:
+            stats = materialize()
+            if stats["built"]:
+                STATUS.update(stats, built_at=time.time(), error=None)
+        except Exception as e:
+            STATUS["error"] = str(e)
+
+
+def schedule() -> None:
+    """
+    Пересобрать отчёты в фоне (вызывается после коммита каждого импорта, см. cache.on_generation_change).
+    Один поток: импорты, пришедшие во время сборки, дают одну следующую пересборку.
+    """
+    global _worker
+    _wake.set()
+    with _state_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_loop, name="report-artifacts", daemon=True)
+            _worker.start()
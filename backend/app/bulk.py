@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import io
+import re
+
+import pandas as pd
+from sqlalchemy import Table, text
+from sqlalchemy.orm import Session
+
+
+# Сколько строк DataFrame сериализуем в один буфер для COPY
+COPY_BATCH = 100_000
+# Сколько ждём эксклюзивный лок на живую таблицу при подмене (дольше — импорт падает, читатели не ждут)
+SWAP_LOCK_TIMEOUT = "5s"
+
+
+def create_stage(db: Session, table: Table) -> None:
+    """
+    Пересоздаёт временную промежуточную таблицу в текущей транзакции
+    (таблицы объявлены с ON COMMIT DROP и после коммита исчезают сами).
+    """
+    db.execute(text(f"DROP TABLE IF EXISTS {table.name}"))
+    table.create(db.connection())
+
+
+def copy_dataframe(db: Session, table: Table, df: pd.DataFrame) -> None:
+    """
+    COPY FROM STDIN колонок df (по именам колонок таблицы) через copy_expert psycopg2,
+    в той же транзакции, что и сессия. Пустая строка в CSV превращается в NULL.
+    """
+    if df.empty:
+        return
+    columns = [c.name for c in table.columns]
+    sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+
+    cur = db.connection().connection.cursor()
+    try:
+        for start in range(0, len(df), COPY_BATCH):
+            buf = io.StringIO()
+            df.iloc[start:start + COPY_BATCH].to_csv(buf, columns=columns, index=False, header=False)
+            buf.seek(0)
+            cur.copy_expert(sql, buf)
+    finally:
+        cur.close()
+
+
+def shadow_name(table: str) -> str:
+    return f"{table}_shadow"
+
+
+def create_shadow(db: Session, table: str) -> str:
+    """
+    Пустая копия живой таблицы (колонки, умолчания, ограничения, индексы) для полной замены данных.
+    Живую таблицу не трогает — читатели работают как обычно, пока shadow наполняется.
+    """
+    shadow = shadow_name(table)
+    db.execute(text(f"DROP TABLE IF EXISTS {shadow}"))
+    db.execute(text(f"CREATE TABLE {shadow} (LIKE {table} INCLUDING ALL)"))
+    return shadow
+
+
+def _indexes(db: Session, table: str) -> dict[str, tuple[str, str | None]]:
+    # определение индекса без имени индекса и таблицы -> (имя индекса, имя ограничения)
+    rows = db.execute(text("""
+        SELECT i.relname, pg_get_indexdef(x.indexrelid), c.conname
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid AND c.conrelid = x.indrelid
+        WHERE x.indrelid = CAST(:t AS regclass)
+    """), {"t": table})
+    return {re.sub(r"INDEX \S+ ON \S+", "INDEX ON", d): (name, con) for name, d, con in rows}
+
+
+def swap_shadow(db: Session, table: str) -> None:
+    """
+    Атомарная подмена живой таблицы заполненной shadow: последовательность id переходит к shadow,
+    старая таблица удаляется (вместе со всеми мёртвыми строками), shadow переименовывается,
+    индексам и ограничениям возвращаются прежние имена. Эксклюзивный лок берётся только здесь
+    и держится до коммита — поэтому подмена должна быть последним шагом импорта
+    (агрегаты считать из shadow до неё).
+    """
+    shadow = shadow_name(table)
+    db.execute(text(f"ANALYZE {shadow}"))
+    old = _indexes(db, table)
+
+    db.execute(text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'"))
+    db.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+    seq = db.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": table}).scalar()
+    if seq:
+        db.execute(text(f"ALTER SEQUENCE {seq} OWNED BY {shadow}.id"))
+    db.execute(text(f"DROP TABLE {table}"))
+    db.execute(text(f"ALTER TABLE {shadow} RENAME TO {table}"))
+
+    for key, (name, con) in _indexes(db, table).items():
+        if key not in old:
+            continue
+        old_name, old_con = old[key]
+        if con and old_con:
+            db.execute(text(f'ALTER TABLE {table} RENAME CONSTRAINT "{con}" TO "{old_con}"'))
+        elif name != old_name:
+            db.execute(text(f'ALTER INDEX "{name}" RENAME TO "{old_name}"'))
+    db.execute(text("SET LOCAL lock_timeout = DEFAULT"))
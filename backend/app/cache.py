@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+from urllib.parse import parse_qsl, urlencode
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .compression import COMPRESS_MIN_BYTES, ENCODINGS, compress, compressible, encoded_headers, negotiate, variant_etag
+from .db import engine
+
+# Ключ app_state: номер поколения данных, растёт с каждым импортом
+GENERATION_KEY = "data_generation"
+
+# Сколько ответов держим в памяти и какой самый большой кладём в кэш
+CACHE_ENTRIES = 256
+CACHE_MAX_BODY = 8 * 1024 * 1024
+
+
+_generation_listeners: list[Callable[[], None]] = []
+
+
+def on_generation_change(fn: Callable[[], None]) -> None:
+    """fn() вызывается после коммита каждой транзакции, увеличившей поколение данных."""
+    if fn not in _generation_listeners:
+        _generation_listeners.append(fn)
+
+
+def bump_generation(db: Session) -> None:
+    """
+    +1 к поколению данных в транзакции импорта. Вызывать в самом конце импорта:
+    строка app_state блокируется до коммита, и параллельные импорты ждут друг друга только здесь.
+    Повторный вызов в той же транзакции ничего не делает.
+    """
+    if db.info.get("generation_bumped"):
+        return
+    db.execute(text("""
+        INSERT INTO app_state (key, value) VALUES (:key, '1')
+        ON CONFLICT (key) DO UPDATE SET value = (app_state.value::bigint + 1)::text
+    """), {"key": GENERATION_KEY})
+    db.info["generation_bumped"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _generation_committed(session: Session) -> None:
+    if session.info.pop("generation_bumped", False):
+        for fn in _generation_listeners:
+            fn()
+
+
+@event.listens_for(Session, "after_rollback")
+def _generation_rolled_back(session: Session) -> None:
+    session.info.pop("generation_bumped", None)
+
+
+def data_generation() -> int:
+    with engine.connect() as conn:
+        value = conn.execute(text("SELECT value FROM app_state WHERE key = :key"), {"key": GENERATION_KEY}).scalar()
+    return int(value or 0)
+
+
+def _variants(headers: list, body: bytes) -> dict[str, bytes]:
+    # сжатые варианты считаются один раз при записи в кэш, а не на каждый запрос
+    content_type = next((v.decode("latin-1") for k, v in headers if k.lower() == b"content-type"), None)
+    if len(body) < COMPRESS_MIN_BYTES or not compressible(content_type):
+        return {}
+    return {encoding: compress(body, encoding) for encoding in ENCODINGS}
+
+
+class ResponseCache:
+    """
+    Сериализованные ответы текущего поколения данных:
+    (поколение, путь, параметры) -> (заголовки, тело, сжатые варианты тела по кодировке).
+    """
+
+    def __init__(self, max_entries: int = CACHE_ENTRIES, max_body: int = CACHE_MAX_BODY):
+        self.max_entries = max_entries
+        self.max_body = max_body
+        self._entries: "OrderedDict[tuple, tuple[list, bytes, dict]]" = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def use_generation(self, generation: int) -> None:
+        # данные поменялись — всё, что посчитано раньше, больше не нужно
+        if generation != self.generation:
+            self._entries.clear()
+            self.generation = generation
+
+    def get(self, key: tuple) -> Optional[tuple[list, bytes, dict]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, headers: list, body: bytes, variants: Optional[dict] = None) -> None:
+        if len(body) > self.max_body:
+            return
+        self._entries[key] = (headers, body, variants or {})
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "entries": len(self._entries),
+            "bytes": sum(
+                len(body) + sum(map(len, variants.values())) for _, body, variants in self._entries.values()
+            ),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+class ResponseCacheMiddleware:
+    """
+    ETag и кэш GET-ответов "тяжёлых" эндпоинтов чтения в памяти процесса.
+    Данные меняются только импортом, поэтому ключ — (поколение данных, путь, параметры):
+    ETag строится из него же, If-None-Match с тем же ETag получает 304 без пересчёта,
+    повторный запрос — уже сериализованные байты (сжатые заранее, если клиент принимает gzip / zstd).
+    """
+
+    def __init__(self, app, paths: Iterable[str], cache: ResponseCache = RESPONSE_CACHE):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.cache = cache
+
+    @staticmethod
+    def _etag(generation: int, path: str, query: str) -> str:
+        digest = hashlib.sha1(f"{path}?{query}".encode()).hexdigest()[:16]
+        return f'"g{generation}-{digest}"'
+
+    @staticmethod
+    def _header(scope, name: bytes) -> Optional[str]:
+        for k, v in scope["headers"]:
+            if k == name:
+                return v.decode("latin-1")
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        cache = self.cache
+        generation = await run_in_threadpool(data_generation)
+        cache.use_generation(generation)
+
+        # параметры в каноническом порядке: ?a=1&b=2 и ?b=2&a=1 — один и тот же ответ
+        query = urlencode(sorted(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)))
+        key = (generation, scope["path"], query)
+        etag = self._etag(generation, scope["path"], query)
+        cache_headers = [(b"etag", etag.encode()), (b"cache-control", b"no-cache")]
+
+        encoding = negotiate(self._header(scope, b"accept-encoding"))
+
+        if_none_match = self._header(scope, b"if-none-match")
+        if if_none_match:
+            # у клиента может быть и несжатое, и сжатое представление — оба текущего поколения
+            tags = [t.strip() for t in if_none_match.split(",")]
+            matched = next((t for t in (etag, variant_etag(etag, encoding)) if t in tags), None)
+            if matched is not None:
+                cache.not_modified += 1
+                await send({
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": [(b"etag", matched.encode()), (b"cache-control", b"no-cache")],
+                })
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        entry = cache.get(key)
+        if entry is not None:
+            cache.hits += 1
+            headers, body, variants = entry
+            if encoding in variants:
+                body = variants[encoding]
+                headers = encoded_headers(headers, encoding, len(body))
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        cache.misses += 1
+        headers: list = []
+        chunks: list[bytes] = []
+        size = 0
+        ok = False
+
+        async def capture(message):
+            nonlocal headers, ok, size
+            if message["type"] == "http.response.start":
+                # ответ со своим ETag (готовый файл отчёта с диска) не кэшируем и не подписываем
+                ok = message["status"] == 200 and not any(k.lower() == b"etag" for k, _ in message.get("headers", []))
+                if ok:
+                    headers = [*message.get("headers", []), *cache_headers]
+                    message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body" and ok:
+                chunks.append(message.get("body", b""))
+                size += len(chunks[-1])
+                if size > cache.max_body:
+                    # потоковый ответ больше лимита кэша — не копим его в памяти
+                    ok = False
+                    chunks.clear()
+                elif not message.get("more_body", False):
+                    await send(message)
+                    body = b"".join(chunks)
+                    cache.put(key, headers, body, await run_in_threadpool(_variants, headers, body))
+                    return
+            await send(message)
+
+        await self.app(scope, receive, capture)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from typing import Callable, Optional
+
+import pandas as pd
+from sqlalchemy import Column, MetaData, String, Table, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import coverage
+from .bulk import copy_dataframe, create_stage
+from .cache import bump_generation
+from .db import lock_tables
+from .models import AppState
+from .normalize_items import canonical_map, load_synonyms, ruleset_version
+
+# Ключ app_state, под которым лежит версия правил, с которой посчитаны canonical_name
+VERSION_KEY = "canon_version"
+
+# Что канонизируем: таблица -> колонка с исходным названием
+TARGETS = {
+    "items": "name",
+    "requirements": "item_name",
+    "offers": "search_query",
+}
+
+# Пары (название, канон) для пересчёта — до конца транзакции
+_canon_stage = Table(
+    "_canon_stage",
+    MetaData(),
+    Column("name", String, nullable=False),
+    Column("canonical_name", String),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+def stored_version(db: Session) -> Optional[str]:
+    return db.execute(select(AppState.value).where(AppState.key == VERSION_KEY)).scalar()
+
+
+def _pending(db: Session) -> dict[str, int]:
+    # строки без канона: импортированы до появления колонки
+    return {
+        table: int(db.execute(text(f"SELECT COUNT(*) FROM {table} WHERE canonical_name IS NULL")).scalar() or 0)
+        for table in TARGETS
+    }
+
+
+def status(db: Session) -> dict:
+    current = ruleset_version()
+    stored = stored_version(db)
+    pending = _pending(db)
+    return {
+        "current_version": current,
+        "stored_version": stored,
+        "pending": pending,
+        "stale": stored != current or any(pending.values()),
+    }
+
+
+def recanonicalize(db: Session, *, force: bool = False, on_rows: Optional[Callable[[int], None]] = None) -> dict:
+    """
+    Пересчёт canonical_name в items, requirements и offers.
+    Если версия правил (RULES_VERSION + хэш synonyms.csv) не менялась — досчитываются только строки
+    без канона; иначе (или force=True) канон пересчитывается для всех уникальных названий,
+    но записываются только строки, у которых он действительно изменился.
+    """
+    lock_tables(db, TARGETS)
+
+    version = ruleset_version()
+    full = force or stored_version(db) != version
+    syn = load_synonyms()
+
+    stats: dict = {"version": version, "full": full}
+    coverage.begin_keys(db)
+    for table, column in TARGETS.items():
+        where = "" if full else "WHERE canonical_name IS NULL"
+        names = db.execute(text(f"SELECT DISTINCT {column} FROM {table} {where}")).scalars().all()
+        canon = canonical_map(names, syn)
+
+        create_stage(db, _canon_stage)
+        copy_dataframe(db, _canon_stage, pd.DataFrame({"name": list(canon), "canonical_name": list(canon.values())}))
+        # в агрегатах покрытия меняются и прежний, и новый канон переписываемых строк
+        changed = f"""
+            FROM {table} t JOIN _canon_stage s ON t.{column} = s.name
+            WHERE t.canonical_name IS DISTINCT FROM s.canonical_name
+        """
+        coverage.add_keys(db, f"SELECT COALESCE(t.canonical_name, t.{column}) {changed}")
+        coverage.add_keys(db, f"SELECT s.canonical_name {changed}")
+        updated = db.execute(text(f"""
+            UPDATE {table} t SET canonical_name = s.canonical_name
+            FROM _canon_stage s
+            WHERE t.{column} = s.name AND t.canonical_name IS DISTINCT FROM s.canonical_name
+        """)).rowcount
+
+        stats[f"{table}_checked"] = len(names)
+        stats[f"{table}_updated"] = int(updated)
+        if on_rows:
+            on_rows(len(names))
+
+    coverage.refresh(db, "items")
+    if any(stats[f"{table}_updated"] for table in TARGETS):
+        bump_generation(db)
+    db.execute(
+        pg_insert(AppState)
+        .values(key=VERSION_KEY, value=version)
+        .on_conflict_do_update(index_elements=[AppState.key], set_={"value": version})
+    )
+    return stats
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import os
+import zlib
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import zstandard
+except ImportError:  # без zstandard отдаём только gzip
+    zstandard = None
+
+# Ответы меньше порога не сжимаем: выигрыш меньше заголовков и задержки
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+
+# Кодировки в порядке предпочтения сервера (при равном q у клиента)
+ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+# Суффиксы файлов предсжатых вариантов (artifacts)
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+_COMPRESSIBLE = ("text/", "application/json", "application/javascript", "application/xml")
+
+
+def compressible(content_type: Optional[str]) -> bool:
+    # xlsx, parquet и т.п. уже сжаты — второй раз только тратим CPU
+    return bool(content_type) and content_type.startswith(_COMPRESSIBLE)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Кодировка по Accept-Encoding: наибольший q, при равенстве — порядок ENCODINGS; None — без сжатия."""
+    if not accept_encoding:
+        return None
+    weights: dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip()] = q
+    star = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = weights.get(encoding, star)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 — формат gzip
+    return c.compress(body) + c.flush()
+
+
+class StreamCompressor:
+    """Сжатие потока кусками: flush() отдаёт всё сжатое на данный момент (клиент может распаковывать сразу)."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._c = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            self._c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.compress(data)
+
+    def flush(self) -> bytes:
+        if self.encoding == "zstd":
+            return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._c.flush()
+
+
+def variant_etag(etag: str, encoding: Optional[str]) -> str:
+    """ETag сжатого варианта: у каждого представления свой ("g3-ab12" -> "g3-ab12-gzip")."""
+    if encoding is None or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def encoded_headers(raw_headers: list, encoding: str, length: Optional[int]) -> list:
+    """Заголовки ответа для сжатого тела: Content-Encoding, Vary, ETag варианта, новая длина (None — поток)."""
+    headers = MutableHeaders(raw=list(raw_headers))
+    headers["content-encoding"] = encoding
+    if "etag" in headers:
+        headers["etag"] = variant_etag(headers["etag"], encoding)
+    headers.add_vary_header("Accept-Encoding")
+    if length is None:
+        del headers["content-length"]
+    else:
+        headers["content-length"] = str(length)
+    return headers.raw
+
+
+class CompressionMiddleware:
+    """
+    gzip / zstd по Accept-Encoding для текстовых ответов (JSON, CSV) больше COMPRESS_MIN_BYTES.
+    Ответ, у которого уже есть Content-Encoding (предсжатый вариант из кэша или с диска), не трогаем;
+    потоковые ответы сжимаются кусками с flush после каждого — первые байты уходят сразу.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[dict] = None
+        stream: Optional[StreamCompressor] = None
+        passthrough = False
+
+        async def wrapped(message):
+            nonlocal start, stream, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message.get("headers", []))
+                passthrough = (
+                    message["status"] != 200
+                    or "content-encoding" in headers
+                    or not compressible(headers.get("content-type"))
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    start = message  # заголовки — когда станет понятно, сжимаем ли и какой длины тело
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if stream is None:
+                if not more:
+                    # тело целиком в одном сообщении
+                    if len(body) < self.minimum_size:
+                        await send(start)
+                        await send(message)
+                        return
+                    data = await run_in_threadpool(compress, body, encoding)
+                    await send({**start, "headers": encoded_headers(start["headers"], encoding, len(data))})
+                    await send({"type": "http.response.body", "body": data})
+                    return
+                stream = StreamCompressor(encoding)
+                await send({**start, "headers": encoded_headers(start["headers"], encoding, None)})
+
+            data = stream.compress(body) + (stream.flush() if more else stream.finish())
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, wrapped)
+
+
+def benchmark(base_url: str, paths: list[str]) -> list[dict]:
+    """Сколько байт экономит сжатие на ответах работающего API (тело берётся несжатым и сжимается тут же)."""
+    import time
+
+    import httpx
+
+    rows = []
+    with httpx.Client(base_url=base_url, timeout=300, headers={"Accept-Encoding": "identity"}) as client:
+        for path in paths:
+            body = client.get(path).content
+            row = {"path": path, "identity": len(body)}
+            for encoding in ENCODINGS:
+                t = time.perf_counter()
+                size = len(compress(body, encoding))
+                row[encoding] = size
+                row[f"{encoding}_ms"] = round((time.perf_counter() - t) * 1000, 1)
+                row[f"{encoding}_saved_pct"] = round(100.0 * (1 - size / len(body)), 1) if body else 0.0
+            rows.append(row)
+    return rows
+
+
+# Что меряем по умолчанию: самые большие текстовые ответы
+BENCHMARK_PATHS = [
+    "/inventory/summary",
+    "/requirements/summary?by=discipline",
+    "/calc/coverage?only_deficit=false&mode=max_per_lab",
+    "/calc/software-coverage?only_deficit=false&mode=max_per_lab",
+    "/reports/procurement.csv?only_deficit=false",
+]
+
+
+if __name__ == "__main__":
+    # python -m app.compression [base_url] [path ...] — экономия на данных запущенного API
+    import sys
+
+    args = sys.argv[1:]
+    base = args[0] if args else "http://localhost:8000"
+    for r in benchmark(base, args[1:] or BENCHMARK_PATHS):
+        print(r)
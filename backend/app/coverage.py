@@ -0,0 +1,481 @@
+from __future__ import annotations
+
+import base64
+import json
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import Connection, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from .cache import bump_generation
+from .db import lock_tables
+from .models import AppState
+from .paging import filters_tag
+
+MODES = ("sum", "max_per_lab", "peak")
+
+# Ключ app_state: агрегаты coverage_* построены и поддерживаются импортами.
+# Значение — версия их состава: новая колонка агрегатов (qty_peak) = новая версия = пересборка при старте
+READY_KEY = "coverage_aggregates"
+AGGREGATES_VERSION = "2"
+
+# Ключи, затронутые текущим импортом (до конца транзакции), — см. begin_keys/add_keys
+_KEYS = "SELECT name FROM _coverage_keys"
+
+# Откуда берутся "есть" и "надо" для оборудования и для ПО.
+# name — каноническое название (по нему сводим), raw — исходное название требования
+# (для max_per_lab максимум берётся по (lab, raw), как и раньше), keys — имена полей ответа,
+# *_match — условие "строка относится к затронутым ключам" (так, чтобы работали индексы).
+_ITEMS = {
+    "kind": "items",
+    "inv_from": "inventory v JOIN items i ON i.id = v.item_id",
+    "inv_name": "COALESCE(i.canonical_name, i.name)",
+    "inv_qty": "v.qty_available",
+    "inv_match": f"(i.canonical_name IN ({_KEYS}) OR (i.canonical_name IS NULL AND i.name IN ({_KEYS})))",
+    "req_from": "requirements r",
+    "req_name": "COALESCE(r.canonical_name, r.item_name)",
+    "req_raw": "r.item_name",
+    "req_qty": "r.qty_required",
+    "req_match": f"(r.canonical_name IN ({_KEYS}) OR (r.canonical_name IS NULL AND r.item_name IN ({_KEYS})))",
+    "keys": ("item_name", "qty_required", "qty_available"),
+}
+_SOFTWARE = {
+    # software_name канонизируется при импорте (canonicalize_software)
+    "kind": "software",
+    "inv_from": "software_inventory v",
+    "inv_name": "v.software_name",
+    "inv_qty": "v.seats_available",
+    "inv_match": f"v.software_name IN ({_KEYS})",
+    "req_from": "software_requirements r",
+    "req_name": "r.software_name",
+    "req_raw": "r.software_name",
+    "req_qty": "r.seats_required",
+    "req_match": f"r.software_name IN ({_KEYS})",
+    "keys": ("software_name", "seats_required", "seats_available"),
+}
+SPECS = {"items": _ITEMS, "software": _SOFTWARE}
+
+# колонка агрегата для режима расчёта
+_MODE_COLUMN = {"sum": "qty_sum", "max_per_lab": "qty_max_per_lab", "peak": "qty_peak"}
+
+
+def _mode_column(mode: str) -> str:
+    if mode not in _MODE_COLUMN:
+        raise ValueError("mode must be 'sum', 'max_per_lab' or 'peak'")
+    return _MODE_COLUMN[mode]
+
+
+def _inventory_sql(spec: dict, where: str = "") -> str:
+    return f"""
+        SELECT {spec['inv_name']} AS name, SUM({spec['inv_qty']}) AS qty
+        FROM {spec['inv_from']}
+        {where}
+        GROUP BY 1
+    """
+
+
+def _peak_sql(spec: dict, where: str = "", *, by_lab: bool) -> str:
+    """
+    Пик одновременной потребности (mode=peak). Строки требований, у (discipline, lab) которых есть
+    занятия в timetable, превращаются в события: +qty в начале занятия, -qty в конце; пик — максимум
+    нарастающей суммы по времени недели (sweep line: одна сортировка событий, O(n log n)).
+    В одну минуту концы идут раньше начал — занятия встык не пересекаются.
+    Требования без расписания заняты всегда и считаются как в max_per_lab.
+    by_lab — пик внутри каждой лаборатории, иначе — по всему вузу.
+    """
+    part = "lab, name" if by_lab else "name"
+    return f"""
+        WITH req AS (
+            SELECT r.discipline, r.lab, {spec['req_raw']} AS raw, {spec['req_name']} AS name, {spec['req_qty']} AS qty
+            FROM {spec['req_from']}
+            {where}
+        ),
+        timed AS (
+            SELECT req.lab, req.name, req.qty,
+                   t.weekday * 1440 + EXTRACT(EPOCH FROM t.starts_at)::int / 60 AS t0,
+                   t.weekday * 1440 + EXTRACT(EPOCH FROM t.ends_at)::int / 60 AS t1
+            FROM req
+            JOIN timetable t ON t.discipline = req.discipline AND t.lab = req.lab
+        ),
+        events AS (
+            SELECT lab, name, t0 AS t, qty AS delta FROM timed
+            UNION ALL
+            SELECT lab, name, t1 AS t, -qty AS delta FROM timed
+        ),
+        swept AS (
+            SELECT {part}, MAX(level) AS qty
+            FROM (
+                SELECT {part},
+                       SUM(delta) OVER (PARTITION BY {part} ORDER BY t, delta ROWS UNBOUNDED PRECEDING) AS level
+                FROM events
+            ) s
+            GROUP BY {part}
+        ),
+        untimed AS (
+            SELECT {part}, SUM(qty) AS qty
+            FROM (
+                SELECT lab, raw, name, MAX(qty) AS qty
+                FROM req
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM timetable t WHERE t.discipline = req.discipline AND t.lab = req.lab
+                )
+                GROUP BY lab, raw, name
+            ) m
+            GROUP BY {part}
+        )
+        SELECT {part}, SUM(qty) AS qty_peak
+        FROM (SELECT {part}, qty FROM swept UNION ALL SELECT {part}, qty FROM untimed) p
+        GROUP BY {part}
+    """
+
+
+def _per_lab_sql(spec: dict, where: str = "", *, peak: bool = False) -> str:
+    # сразу оба режима: sum — сумма в (lab, канон); max_per_lab — MAX по (lab, исходное название),
+    # затем сумма внутри (lab, канон); peak=True — ещё и пик по расписанию внутри лаборатории
+    sql = f"""
+        SELECT lab, name, SUM(qty_sum) AS qty_sum, SUM(qty_max) AS qty_max_per_lab
+        FROM (
+            SELECT r.lab, {spec['req_raw']} AS raw, {spec['req_name']} AS name,
+                   SUM({spec['req_qty']}) AS qty_sum, MAX({spec['req_qty']}) AS qty_max
+            FROM {spec['req_from']}
+            {where}
+            GROUP BY 1, 2, 3
+        ) m
+        GROUP BY lab, name
+    """
+    if not peak:
+        return sql
+    return f"""
+        SELECT b.lab, b.name, b.qty_sum, b.qty_max_per_lab, COALESCE(p.qty_peak, 0) AS qty_peak
+        FROM ({sql}) b
+        LEFT JOIN ({_peak_sql(spec, where, by_lab=True)}) p ON p.lab IS NOT DISTINCT FROM b.lab AND p.name = b.name
+    """
+
+
+def _rows(db: Session, spec: dict, sql: str, params: dict, by_lab: bool) -> list[dict]:
+    name_key, required_key, available_key = spec["keys"]
+    rows = []
+    for r in db.execute(text(sql), params):
+        row = {
+            name_key: r.name,
+            required_key: int(r.required),
+            available_key: int(r.available),
+            "deficit": int(r.deficit),
+        }
+        if by_lab:
+            row["labs"] = [{"lab": x["lab"], required_key: int(x["qty"])} for x in r.labs]
+        rows.append(row)
+    return rows
+
+
+def _direct_sql(spec: dict, mode: str, only_deficit: bool, by_lab: bool) -> tuple[str, dict]:
+    """Один запрос по исходным таблицам (пока агрегаты не построены)."""
+    col = _mode_column(mode)
+    peak = mode == "peak"
+    labs = (
+        f""", json_agg(json_build_object('lab', l.lab, 'qty', l.{col}) ORDER BY l.lab COLLATE "C" NULLS LAST) AS labs"""
+        if by_lab else ""
+    )
+    # разные lab → разные комплекты: суммируем по лабораториям; peak — пик по всему вузу сразу
+    qty, peak_join = ("MAX(p.qty_peak)", "JOIN peak p ON p.name = l.name") if peak else (f"SUM(l.{col})", "")
+    sql = f"""
+        WITH inv AS ({_inventory_sql(spec)}),
+        per_lab AS ({_per_lab_sql(spec, peak=peak and by_lab)}),
+        {f"peak AS ({_peak_sql(spec, by_lab=False)})," if peak else ""}
+        req AS (
+            SELECT l.name, {qty} AS qty{labs}
+            FROM per_lab l
+            {peak_join}
+            GROUP BY l.name
+        )
+        SELECT req.name,
+               req.qty::bigint AS required,
+               COALESCE(inv.qty, 0)::bigint AS available,
+               GREATEST(req.qty - COALESCE(inv.qty, 0), 0)::bigint AS deficit
+               {", req.labs" if by_lab else ""}
+        FROM req
+        LEFT JOIN inv ON inv.name = req.name
+        {"WHERE req.qty > COALESCE(inv.qty, 0)" if only_deficit else ""}
+    """
+    return sql, {}
+
+
+def _aggregated_sql(spec: dict, mode: str, only_deficit: bool, by_lab: bool) -> tuple[str, dict]:
+    """Чтение из coverage_* — объём работы по числу названий, а не строк inventory/requirements."""
+    col = _mode_column(mode)
+    labs = (
+        f""",
+               (SELECT json_agg(json_build_object('lab', l.lab, 'qty', l.{col}) ORDER BY l.lab COLLATE "C" NULLS LAST)
+                FROM coverage_required_lab l
+                WHERE l.kind = r.kind AND l.name = r.name) AS labs"""
+        if by_lab else ""
+    )
+    sql = f"""
+        SELECT r.name,
+               r.{col} AS required,
+               COALESCE(a.qty, 0) AS available,
+               GREATEST(r.{col} - COALESCE(a.qty, 0), 0) AS deficit{labs}
+        FROM coverage_required r
+        LEFT JOIN coverage_available a ON a.kind = r.kind AND a.name = r.name
+        WHERE r.kind = :kind
+        {f"AND r.{col} > COALESCE(a.qty, 0)" if only_deficit else ""}
+    """
+    return sql, {"kind": spec["kind"]}
+
+
+# Сортировки ответа: по убыванию поля (при равенстве — по названию) или просто по названию
+SORTS = ("deficit", "required", "name")
+
+
+def _order(sort: str) -> tuple[str, str]:
+    """ORDER BY и условие "строго после курсора" (keyset) для сортировки sort."""
+    # COLLATE "C" — порядок по кодовым точкам, как у сортировки строк в Python
+    if sort == "name":
+        return 'c.name COLLATE "C"', 'c.name COLLATE "C" > :after_name'
+    if sort not in SORTS:
+        raise ValueError(f"sort must be one of: {', '.join(SORTS)}")
+    return (
+        f'c.{sort} DESC, c.name COLLATE "C"',
+        f'(c.{sort} < :after_key OR (c.{sort} = :after_key AND c.name COLLATE "C" > :after_name))',
+    )
+
+
+def encode_cursor(sort: str, row: dict, spec: dict, filters: str = "") -> str:
+    """Непрозрачный курсор страницы: сортировка + ключ последней строки + хэш фильтров (paging.filters_tag)."""
+    name_key, required_key, _ = spec["keys"]
+    key = {"deficit": row["deficit"], "required": row[required_key], "name": None}[sort]
+    raw = json.dumps([sort, key, row[name_key], filters], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, filters: str = "") -> tuple[Optional[int], str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key, name, tag = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("bad cursor")
+    if cursor_sort != sort or not isinstance(name, str) or (sort != "name" and not isinstance(key, int)):
+        raise ValueError("cursor does not match sort")
+    if tag != filters:
+        raise ValueError("cursor does not match filters")
+    return key, name
+
+
+def coverage_query(
+    db: Session | Connection,
+    kind: str,
+    *,
+    mode: str,
+    only_deficit: bool = True,
+    by_lab: bool = False,
+    sort: str = "deficit",
+    q: Optional[str] = None,
+    limit: Optional[int] = None,
+    after: Optional[tuple[Optional[int], str]] = None,
+) -> tuple[str, dict]:
+    """
+    SQL покрытия (name, required, available, deficit[, labs]) с фильтрами, сортировкой и страницей —
+    для тех, кто читает результат сам (например, потоково: reports).
+    """
+    spec = SPECS[kind]
+    build = _aggregated_sql if aggregates_ready(db) else _direct_sql
+    sql, params = build(spec, mode, only_deficit, by_lab)
+    order_by, after_where = _order(sort)
+
+    where = []
+    if q:
+        # фильтр по подстроке названия (без учёта регистра)
+        where.append("c.name ILIKE :q")
+        params["q"] = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    if after is not None:
+        where.append(after_where)
+        params["after_key"], params["after_name"] = after
+    if limit is not None:
+        params["limit"] = limit
+    sql = f"""
+        SELECT * FROM ({sql}) c
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {order_by}
+        {"LIMIT :limit" if limit is not None else ""}
+    """
+    return sql, params
+
+
+def _coverage(db: Session, spec: dict, mode: str, only_deficit: bool, by_lab: bool, **page) -> list[dict]:
+    sql, params = coverage_query(db, spec["kind"], mode=mode, only_deficit=only_deficit, by_lab=by_lab, **page)
+    return _rows(db, spec, sql, params, by_lab)
+
+
+def aggregates_ready(db: Session | Connection) -> bool:
+    return db.execute(select(AppState.value).where(AppState.key == READY_KEY)).scalar() == AGGREGATES_VERSION
+
+
+def item_coverage(
+    db: Session,
+    *,
+    mode: str = "sum",
+    only_deficit: bool = True,
+    by_lab: bool = False,
+    sort: str = "deficit",
+    q: Optional[str] = None,
+    top: Optional[int] = None,
+) -> list[dict]:
+    """
+    Покрытие оборудования: требования и наличие сведены по каноническим названиям,
+    дефицит, фильтры (only_deficit, q — подстрока названия), сортировка (sort) и top — в БД, одним запросом.
+    Читается из агрегатов coverage_*, а пока они не построены — прямо из inventory/requirements.
+    by_lab=True — у каждой строки ещё labs: сколько требует каждая лаборатория.
+    """
+    return _coverage(db, _ITEMS, mode, only_deficit, by_lab, sort=sort, q=q, limit=top)
+
+
+def software_coverage(
+    db: Session,
+    *,
+    mode: str = "max_per_lab",
+    only_deficit: bool = True,
+    by_lab: bool = False,
+    sort: str = "deficit",
+    q: Optional[str] = None,
+    top: Optional[int] = None,
+) -> list[dict]:
+    """То же для ПО (software_inventory / software_requirements)."""
+    return _coverage(db, _SOFTWARE, mode, only_deficit, by_lab, sort=sort, q=q, limit=top)
+
+
+def coverage_page(
+    db: Session,
+    kind: str,
+    *,
+    mode: str,
+    only_deficit: bool = True,
+    by_lab: bool = False,
+    sort: str = "deficit",
+    q: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+) -> dict:
+    """
+    Страница покрытия (keyset): строки строго после курсора в порядке sort, не больше limit.
+    next_cursor — курсор следующей страницы (None — это последняя); годится только с теми же
+    mode / only_deficit / q, иначе ValueError.
+    """
+    spec = SPECS[kind]
+    filters = filters_tag(kind, mode, only_deficit, q or "")
+    after = decode_cursor(cursor, sort, filters) if cursor else None
+    rows = _coverage(db, spec, mode, only_deficit, by_lab, sort=sort, q=q, limit=limit + 1, after=after)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {"rows": rows, "next_cursor": encode_cursor(sort, rows[-1], spec, filters) if more else None}
+
+
+# -------------------- поддержка агрегатов --------------------
+
+def begin_keys(db: Session) -> None:
+    """Пустой набор затронутых канонических названий на время транзакции импорта."""
+    db.execute(text("DROP TABLE IF EXISTS _coverage_keys"))
+    db.execute(text("CREATE TEMPORARY TABLE _coverage_keys (name varchar PRIMARY KEY) ON COMMIT DROP"))
+
+
+def add_keys(db: Session, select_sql: str, params: Optional[dict] = None) -> None:
+    """Добавляет затронутые названия: select_sql — запрос из одной колонки (канон)."""
+    db.execute(text(f"""
+        INSERT INTO _coverage_keys (name)
+        SELECT DISTINCT k FROM ({select_sql}) s (k) WHERE k IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """), params or {})
+
+
+def add_names(db: Session, names: Iterable[str]) -> None:
+    add_keys(db, "SELECT unnest(CAST(:names AS varchar[]))", {"names": list(names)})
+
+
+def item_keys_sql(ids_sql: str) -> str:
+    """Канонические названия items с id из ids_sql (брать до удаления самих items)."""
+    return f"SELECT COALESCE(i.canonical_name, i.name) FROM items i WHERE i.id IN ({ids_sql})"
+
+
+def refresh(
+    db: Session, kind: str, *, available: bool = True, required: bool = True, full: bool = False,
+    required_from: Optional[str] = None,
+) -> None:
+    """
+    Пересчитывает агрегаты kind для названий из _coverage_keys (full=True — для всех):
+    строки агрегатов по этим названиям удаляются и собираются заново только из строк
+    исходных таблиц с этими названиями (по индексам), поэтому импорт платит за то,
+    что затронул, а не за размер таблиц. Пока агрегаты не построены — ничего не делает.
+    required_from — таблица, из которой читать требования (shadow до bulk.swap_shadow).
+    """
+    if aggregates_ready(db):
+        _refresh(db, kind, available=available, required=required, full=full, required_from=required_from)
+
+
+def _refresh(
+    db: Session, kind: str, *, available: bool, required: bool, full: bool, required_from: Optional[str] = None,
+) -> None:
+    spec = SPECS[kind]
+    if required_from:
+        spec = {**spec, "req_from": f"{required_from} r"}
+    params = {"kind": kind}
+    only_keys = "" if full else f"AND name IN ({_KEYS})"
+
+    if available:
+        db.execute(text(f"DELETE FROM coverage_available WHERE kind = :kind {only_keys}"), params)
+        db.execute(text(f"""
+            INSERT INTO coverage_available (kind, name, qty)
+            SELECT :kind, name, qty
+            FROM ({_inventory_sql(spec, '' if full else 'WHERE ' + spec['inv_match'])}) s
+        """), params)
+
+    if required:
+        where = "" if full else "WHERE " + spec["req_match"]
+        db.execute(text(f"DELETE FROM coverage_required_lab WHERE kind = :kind {only_keys}"), params)
+        db.execute(text(f"""
+            INSERT INTO coverage_required_lab (kind, lab, name, qty_sum, qty_max_per_lab, qty_peak)
+            SELECT :kind, lab, name, qty_sum, qty_max_per_lab, qty_peak
+            FROM ({_per_lab_sql(spec, where, peak=True)}) s
+        """), params)
+        db.execute(text(f"DELETE FROM coverage_required WHERE kind = :kind {only_keys}"), params)
+        # sum / max_per_lab — суммы по лабораториям, peak — свой пик по всему вузу
+        db.execute(text(f"""
+            INSERT INTO coverage_required (kind, name, qty_sum, qty_max_per_lab, qty_peak)
+            SELECT :kind, s.name, s.qty_sum, s.qty_max_per_lab, COALESCE(p.qty_peak, 0)
+            FROM (
+                SELECT name, SUM(qty_sum) AS qty_sum, SUM(qty_max_per_lab) AS qty_max_per_lab
+                FROM coverage_required_lab
+                WHERE kind = :kind {only_keys}
+                GROUP BY name
+            ) s
+            LEFT JOIN ({_peak_sql(spec, where, by_lab=False)}) p ON p.name = s.name
+        """), params)
+
+
+def rebuild(db: Session, *, on_rows: Optional[Callable[[int], None]] = None) -> dict:
+    """Полная пересборка всех агрегатов (восстановление / первый запуск)."""
+    # ждём импорты, пишущие в исходные таблицы
+    lock_tables(db, ("items", "inventory", "requirements", "software_inventory", "software_requirements", "timetable"))
+    for kind in SPECS:
+        _refresh(db, kind, available=True, required=True, full=True)
+    db.execute(
+        pg_insert(AppState)
+        .values(key=READY_KEY, value=AGGREGATES_VERSION)
+        .on_conflict_do_update(index_elements=[AppState.key], set_={"value": AGGREGATES_VERSION})
+    )
+    bump_generation(db)
+    stats = {
+        table: int(db.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar() or 0)
+        for table in ("coverage_available", "coverage_required", "coverage_required_lab")
+    }
+    if on_rows:
+        on_rows(sum(stats.values()))
+    return stats
+
+
+if __name__ == "__main__":
+    # python -m app.coverage — пересобрать агрегаты покрытия
+    from .db import SessionLocal
+
+    with SessionLocal() as session:
+        print(rebuild(session))
+        session.commit()
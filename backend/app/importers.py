@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+from typing import Callable, Iterable, Iterator, Optional
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from . import ingest, ingest_requirements
+from .cache import bump_generation
+from .db import lock_tables
+from .readers import Source, file_format, file_sha256, iter_chunks, read_frame
+
+OnRows = Optional[Callable[[int], None]]
+
+# Какие таблицы пишет каждый вид импорта: импорты с пересечением выполняются по очереди.
+# Каждый импорт, который что-то записал, увеличивает поколение данных (cache.bump_generation).
+TABLES = {
+    "inventory": ("items", "locations", "inventory", "import_manifests"),
+    "requirements": ("requirements",),
+    "software_inventory": ("software_inventory",),
+    "software_requirements": ("software_requirements",),
+    "lab_locations": ("lab_locations",),
+    # расписание пересобирает агрегаты требований целиком — по очереди со всеми, кто их пишет
+    "timetable": ("timetable", "requirements", "software_requirements"),
+    "offers": ("offers",),
+}
+
+
+def _counted(chunks: Iterable[pd.DataFrame], on_rows: OnRows) -> Iterator[pd.DataFrame]:
+    # сообщаем о прогрессе после того, как кусок записан (когда просят следующий)
+    for chunk in chunks:
+        yield chunk
+        if on_rows:
+            on_rows(len(chunk))
+
+
+def _read(
+    source: Source, fmt: Optional[str], on_rows: OnRows, columns: Optional[set[str]] = None, sep: str = ",",
+) -> pd.DataFrame:
+    df = read_frame(source, fmt or file_format(source), columns=columns, sep=sep)
+    if on_rows:
+        on_rows(len(df))
+    return df
+
+
+def import_inventory(
+    db: Session,
+    source: Source,
+    *,
+    fmt: Optional[str] = None,
+    chunksize: Optional[int] = None,
+    delta: bool = False,
+    source_key: Optional[str] = None,
+    mode: str = "upsert",
+    on_rows: OnRows = None,
+) -> dict:
+    """
+    fmt — csv | parquet | arrow (по умолчанию по расширению source).
+    delta=True — инкрементальный импорт: если файл (source_key, по умолчанию путь)
+    не изменился с прошлого раза, ничего не читаем; иначе пишем только разницу.
+    mode="sync" — в локациях из файла удаляются позиции, которых в файле нет.
+    """
+    lock_tables(db, TABLES["inventory"])
+
+    manifest = None
+    if delta:
+        key = f"inventory:{source_key or source}"
+        file_hash = file_sha256(source)
+        prev = ingest.manifest_state(db, key)
+        if prev and prev[0] == file_hash:
+            return {
+                "inserted": 0, "updated": 0, "skipped": 0, "rows": prev[1],
+                "added": 0, "changed": 0, "removed": 0, "unchanged": prev[1],
+                "unchanged_file": True,
+            }
+        manifest = (key, file_hash)
+
+    fmt = fmt or file_format(source)
+    if chunksize:
+        chunks = iter_chunks(source, fmt, chunksize, columns=ingest.REQUIRED_COLS, dtype=ingest.CSV_DTYPES)
+        stats = ingest.ingest_inventory_chunks(db, _counted(chunks, on_rows), manifest=manifest, mode=mode)
+    else:
+        df = _read(source, fmt, on_rows, ingest.REQUIRED_COLS)
+        stats = ingest.ingest_inventory_df(db, df, manifest=manifest, mode=mode)
+    bump_generation(db)
+    return stats
+
+
+def import_requirements(
+    db: Session,
+    source: Source,
+    *,
+    fmt: Optional[str] = None,
+    replace: bool = False,
+    chunksize: Optional[int] = None,
+    on_rows: OnRows = None,
+) -> dict:
+    lock_tables(db, TABLES["requirements"])
+    fmt = fmt or file_format(source)
+    columns = ingest_requirements.REQUIRED_COLS | ingest_requirements.OPTIONAL_COLS
+    if chunksize:
+        chunks = iter_chunks(source, fmt, chunksize, columns=columns, dtype=ingest_requirements.CSV_DTYPES)
+        stats = ingest_requirements.ingest_requirements_chunks(db, _counted(chunks, on_rows), replace=replace)
+    else:
+        df = _read(source, fmt, on_rows, columns)
+        stats = ingest_requirements.ingest_requirements_df(db, df, replace=replace)
+    bump_generation(db)
+    return stats
+
+
+def import_software_inventory(db: Session, source: Source, *, fmt: Optional[str] = None, on_rows: OnRows = None) -> dict:
+    lock_tables(db, TABLES["software_inventory"])
+    stats = ingest.ingest_software_inventory_df(db, _read(source, fmt, on_rows))
+    bump_generation(db)
+    return stats
+
+
+def import_software_requirements(
+    db: Session,
+    source: Source,
+    *,
+    fmt: Optional[str] = None,
+    replace: bool = False,
+    on_rows: OnRows = None,
+) -> dict:
+    lock_tables(db, TABLES["software_requirements"])
+    stats = ingest.ingest_software_requirements_df(db, _read(source, fmt, on_rows), replace=replace)
+    bump_generation(db)
+    return stats
+
+
+def import_lab_locations(
+    db: Session,
+    source: Source,
+    *,
+    fmt: Optional[str] = None,
+    replace: bool = False,
+    on_rows: OnRows = None,
+) -> dict:
+    lock_tables(db, TABLES["lab_locations"])
+    stats = ingest.ingest_lab_locations_df(db, _read(source, fmt, on_rows), replace=replace)
+    bump_generation(db)
+    return stats
+
+
+def import_timetable(
+    db: Session,
+    source: Source,
+    *,
+    fmt: Optional[str] = None,
+    replace: bool = False,
+    on_rows: OnRows = None,
+) -> dict:
+    lock_tables(db, TABLES["timetable"])
+    stats = ingest.ingest_timetable_df(db, _read(source, fmt, on_rows), replace=replace)
+    bump_generation(db)
+    return stats
+
+
+def import_offers(
+    db: Session,
+    source: Source,
+    *,
+    fmt: Optional[str] = None,
+    replace: bool = False,
+    on_rows: OnRows = None,
+) -> dict:
+    """Выгрузка parser_unified (CSV с разделителем ";"); пустой файл — ещё ничего не собрано."""
+    lock_tables(db, TABLES["offers"])
+    try:
+        df = _read(source, fmt, on_rows, sep=";")
+    except pd.errors.EmptyDataError:
+        df = pd.DataFrame(columns=list(ingest.OFFER_COLUMNS))
+    stats = ingest.ingest_offers_df(db, df, replace=replace)
+    bump_generation(db)
+    return stats
@@ -1,87 +1,317 @@
 from __future__ import annotations
 
+from typing import Iterable, Optional
+
 import pandas as pd
+from sqlalchemy import Column, Integer, MetaData, Numeric, String, Table, literal_column, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 
-from .models import Item, Location, Inventory, SoftwareInventory, SoftwareRequirement
+from . import coverage
+from .bulk import copy_dataframe, create_shadow, create_stage, swap_shadow
+from .cache import bump_generation
+from .models import ImportManifest, Item, LabLocation, Location, SoftwareInventory, Timetable
+from .normalize_items import canonical_map
 from .normalize_software import canonicalize_software
+from .readers import as_text
 
 
 REQUIRED_COLS = {"item_name", "location", "qty_available"}
-
-def _get_or_create_item(db: Session, name: str) -> Item:
-    obj = db.query(Item).filter(Item.name == name).one_or_none()
-    if obj:
-        return obj
-    obj = Item(name=name)
-    db.add(obj)
-    db.flush()  # get id
-    return obj
-
-
-def _get_or_create_location(db: Session, name: str) -> Location:
-    obj = db.query(Location).filter(Location.name == name).one_or_none()
-    if obj:
-        return obj
-    obj = Location(name=name)
-    db.add(obj)
-    db.flush()
-    return obj
-
-
-def ingest_inventory_df(db: Session, df: pd.DataFrame) -> dict:
-    required = {"item_name", "location", "qty_available"}
-    missing = required - set(df.columns)
+# Типы для потокового чтения CSV: локации сильно повторяются — category
+CSV_DTYPES = {"location": "category"}
+
+# Сколько строк отправляем в одном многострочном INSERT
+BULK_BATCH = 5000
+
+
+def _batches(rows: list, size: int = BULK_BATCH):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _resolve_ids(db: Session, model, names) -> dict[str, int]:
+    """
+    name -> id для Item/Location одним проходом:
+    уже существующие имена берутся одним SELECT, недостающие вставляются пачкой
+    (ON CONFLICT DO NOTHING ... RETURNING). Новым Item сразу пишется canonical_name —
+    канонизация считается только для действительно новых названий.
+    """
+    names = list(dict.fromkeys(names))
+    ids: dict[str, int] = {}
+    for batch in _batches(names):
+        rows = db.execute(select(model.id, model.name).where(model.name.in_(batch)))
+        ids.update({name: id_ for id_, name in rows})
+
+        new = [n for n in batch if n not in ids]
+        if not new:
+            continue
+        if model is Item:
+            canon = canonical_map(new)
+            values = [{"name": n, "canonical_name": canon[n]} for n in new]
+        else:
+            values = [{"name": n} for n in new]
+        stmt = (
+            pg_insert(model)
+            .values(values)
+            .on_conflict_do_nothing(index_elements=[model.name])
+            .returning(model.id, model.name)
+        )
+        ids.update({name: id_ for id_, name in db.execute(stmt)})
+
+        # вставлены параллельно кем-то ещё
+        rest = [n for n in new if n not in ids]
+        if rest:
+            rows = db.execute(select(model.id, model.name).where(model.name.in_(rest)))
+            ids.update({name: id_ for id_, name in rows})
+    return ids
+
+
+# Промежуточная таблица импорта: живёт до конца транзакции.
+# Куски файла пишутся сюда по мере чтения, итоговая агрегация по (item, location) — в SQL.
+_inventory_stage = Table(
+    "_inventory_stage",
+    MetaData(),
+    Column("item_id", Integer, nullable=False),
+    Column("location_id", Integer, nullable=False),
+    Column("qty_available", Integer, nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+def _clean_inventory(df: pd.DataFrame) -> pd.DataFrame:
+    missing = REQUIRED_COLS - set(df.columns)
     if missing:
         raise ValueError(f"CSV missing columns: {sorted(missing)}")
 
-    df = df.copy()
-    df["item_name"] = df["item_name"].astype(str).str.strip()
-    df["location"] = df["location"].astype(str).str.strip()
-    df["qty_available"] = pd.to_numeric(df["qty_available"], errors="coerce").fillna(0).astype(int)
+    # собираем новый фрейм только из нужных колонок вместо df.copy()
+    df = pd.DataFrame({
+        "item_name": as_text(df["item_name"]),
+        "location": as_text(df["location"]),
+        "qty_available": pd.to_numeric(df["qty_available"], errors="coerce").fillna(0).astype(int),
+    })
 
     # агрегируем на всякий случай
-    df = (
+    return (
         df[(df["item_name"] != "") & (df["location"] != "")]
-        .groupby(["item_name", "location"], as_index=False)["qty_available"]
+        .groupby(["item_name", "location"], as_index=False, sort=False)["qty_available"]
         .sum()
     )
 
-    inserted = 0
-    updated = 0
-    skipped = 0
-
-    for row in df.itertuples(index=False):
-        item_name = row.item_name
-        location_name = row.location
-        qty = int(row.qty_available)
-
-        item = db.query(Item).filter(Item.name == item_name).one_or_none()
-        if not item:
-            item = Item(name=item_name)
-            db.add(item)
-            db.flush()
-
-        loc = db.query(Location).filter(Location.name == location_name).one_or_none()
-        if not loc:
-            loc = Location(name=location_name)
-            db.add(loc)
-            db.flush()
-
-        inv = (
-            db.query(Inventory)
-            .filter(Inventory.item_id == item.id, Inventory.location_id == loc.id)
-            .one_or_none()
-        )
-
-        if inv:
-            inv.qty_available = qty
-            updated += 1
-        else:
-            db.add(Inventory(item_id=item.id, location_id=loc.id, qty_available=qty))
-            inserted += 1
 
-    return {"inserted": inserted, "updated": updated, "skipped": skipped, "rows": int(len(df))}
+def _stage_inventory(db: Session, df: pd.DataFrame) -> None:
+    item_ids = _resolve_ids(db, Item, df["item_name"])
+    location_ids = _resolve_ids(db, Location, df["location"])
+
+    staged = pd.DataFrame({
+        "item_id": df["item_name"].map(item_ids),
+        "location_id": df["location"].map(location_ids),
+        "qty_available": df["qty_available"],
+    })
+    copy_dataframe(db, _inventory_stage, staged)
+
+
+def _aggregate_inventory_stage(db: Session) -> None:
+    """Итог файла по (item, location) — во временную таблицу _inventory_current."""
+    db.execute(text("DROP TABLE IF EXISTS _inventory_current"))
+    db.execute(text("""
+        CREATE TEMPORARY TABLE _inventory_current ON COMMIT DROP AS
+        SELECT item_id, location_id, SUM(qty_available)::int AS qty_available
+        FROM _inventory_stage
+        GROUP BY item_id, location_id
+    """))
+
+
+def _merge_inventory(db: Session, source: str) -> tuple[int, int]:
+    """
+    Одна вставка INSERT ... SELECT ... ON CONFLICT DO UPDATE из временной таблицы source.
+    xmax = 0 только у только что вставленных строк — так считаем inserted/updated.
+    """
+    row = db.execute(text(f"""
+        WITH up AS (
+            INSERT INTO inventory (item_id, location_id, qty_available)
+            SELECT item_id, location_id, qty_available FROM {source}
+            ON CONFLICT ON CONSTRAINT uq_inventory_item_location
+            DO UPDATE SET qty_available = EXCLUDED.qty_available
+            RETURNING (xmax = 0) AS is_new
+        )
+        SELECT COUNT(*) FILTER (WHERE is_new), COUNT(*) FILTER (WHERE NOT is_new) FROM up
+    """)).one()
+    return int(row[0]), int(row[1])
+
+
+def manifest_state(db: Session, source: str) -> Optional[tuple[str, int]]:
+    """(file_hash, rows) последнего инкрементального импорта source или None."""
+    row = db.execute(
+        select(ImportManifest.file_hash, ImportManifest.rows).where(ImportManifest.source == source)
+    ).one_or_none()
+    return (row[0], int(row[1])) if row else None
+
+
+def _apply_inventory_delta(db: Session, source: str, file_hash: str) -> dict:
+    """
+    Сравнивает итог файла с отпечатками прошлого импорта того же source
+    и трогает в inventory только добавленные, изменённые и исчезнувшие строки.
+    """
+    manifest_id = db.execute(text("""
+        INSERT INTO import_manifests (source, file_hash, rows, imported_at)
+        VALUES (:source, :file_hash, (SELECT COUNT(*) FROM _inventory_current), now())
+        ON CONFLICT (source) DO UPDATE
+        SET file_hash = EXCLUDED.file_hash, rows = EXCLUDED.rows, imported_at = EXCLUDED.imported_at
+        RETURNING id
+    """), {"source": source, "file_hash": file_hash}).scalar_one()
+
+    # строки, чей отпечаток не совпал с прошлым (новые или изменённые)
+    db.execute(text("DROP TABLE IF EXISTS _inventory_delta"))
+    db.execute(text("""
+        CREATE TEMPORARY TABLE _inventory_delta ON COMMIT DROP AS
+        SELECT c.item_id, c.location_id, c.qty_available, c.row_hash, (m.row_hash IS NULL) AS is_added
+        FROM (
+            SELECT *, hashtextextended(concat_ws('|', item_id, location_id, qty_available), 0) AS row_hash
+            FROM _inventory_current
+        ) c
+        LEFT JOIN import_manifest_rows m
+          ON m.manifest_id = :mid AND m.item_id = c.item_id AND m.location_id = c.location_id
+        WHERE m.row_hash IS DISTINCT FROM c.row_hash
+    """), {"mid": manifest_id})
+
+    added, changed = db.execute(text(
+        "SELECT COUNT(*) FILTER (WHERE is_added), COUNT(*) FILTER (WHERE NOT is_added) FROM _inventory_delta"
+    )).one()
+    inserted, updated = _merge_inventory(db, "_inventory_delta")
+    coverage.add_keys(db, coverage.item_keys_sql("SELECT item_id FROM _inventory_delta"))
+
+    # строки, которые были в прошлой версии файла, а теперь пропали
+    db.execute(text("DROP TABLE IF EXISTS _inventory_removed"))
+    db.execute(text("CREATE TEMPORARY TABLE _inventory_removed (item_id int) ON COMMIT DROP"))
+    removed = db.execute(text("""
+        WITH gone AS (
+            DELETE FROM import_manifest_rows m
+            WHERE m.manifest_id = :mid
+              AND NOT EXISTS (
+                  SELECT 1 FROM _inventory_current c
+                  WHERE c.item_id = m.item_id AND c.location_id = m.location_id
+              )
+            RETURNING m.item_id, m.location_id
+        ),
+        del AS (
+            DELETE FROM inventory i USING gone
+            WHERE i.item_id = gone.item_id AND i.location_id = gone.location_id
+            RETURNING i.item_id
+        )
+        INSERT INTO _inventory_removed SELECT item_id FROM del
+    """), {"mid": manifest_id}).rowcount
+    coverage.add_keys(db, coverage.item_keys_sql("SELECT item_id FROM _inventory_removed"))
+
+    db.execute(text("""
+        INSERT INTO import_manifest_rows (manifest_id, item_id, location_id, row_hash)
+        SELECT :mid, item_id, location_id, row_hash FROM _inventory_delta
+        ON CONFLICT (manifest_id, item_id, location_id) DO UPDATE SET row_hash = EXCLUDED.row_hash
+    """), {"mid": manifest_id})
+
+    total = db.execute(text("SELECT COUNT(*) FROM _inventory_current")).scalar_one()
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "added": int(added),
+        "changed": int(changed),
+        "removed": removed,
+        "unchanged": int(total) - int(added) - int(changed),
+        "rows": int(total),
+    }
+
+
+def _prune_inventory(db: Session) -> dict:
+    """
+    mode=sync: в локациях, которые есть в файле, удаляет пары (item, location), которых в файле нет —
+    одним DELETE с анти-джойном к _inventory_current. Затем пачкой убирает осиротевшие items/locations
+    (только среди затронутых удалением).
+    """
+    db.execute(text("DROP TABLE IF EXISTS _inventory_gone"))
+    db.execute(text("CREATE TEMPORARY TABLE _inventory_gone (item_id int, location_id int) ON COMMIT DROP"))
+    pruned = db.execute(text("""
+        WITH gone AS (
+            DELETE FROM inventory inv
+            WHERE inv.location_id IN (SELECT DISTINCT location_id FROM _inventory_current)
+              AND NOT EXISTS (
+                  SELECT 1 FROM _inventory_current c
+                  WHERE c.item_id = inv.item_id AND c.location_id = inv.location_id
+              )
+            RETURNING inv.item_id, inv.location_id
+        )
+        INSERT INTO _inventory_gone SELECT item_id, location_id FROM gone
+    """)).rowcount
+    # канон затронутых позиций — пока сами items ещё не удалены
+    coverage.add_keys(db, coverage.item_keys_sql("SELECT item_id FROM _inventory_gone"))
+
+    items_gc = db.execute(text("""
+        DELETE FROM items it
+        WHERE it.id IN (SELECT DISTINCT item_id FROM _inventory_gone)
+          AND NOT EXISTS (SELECT 1 FROM inventory inv WHERE inv.item_id = it.id)
+    """)).rowcount
+    locations_gc = db.execute(text("""
+        DELETE FROM locations l
+        WHERE l.id IN (SELECT DISTINCT location_id FROM _inventory_gone)
+          AND NOT EXISTS (SELECT 1 FROM inventory inv WHERE inv.location_id = l.id)
+    """)).rowcount
+
+    return {"pruned": pruned, "items_gc": items_gc, "locations_gc": locations_gc}
+
+
+def ingest_inventory_chunks(
+    db: Session,
+    chunks: Iterable[pd.DataFrame],
+    *,
+    manifest: Optional[tuple[str, str]] = None,
+    mode: str = "upsert",
+) -> dict:
+    """
+    Потоковый импорт: каждый кусок нормализуется и пишется в БД до чтения следующего,
+    поэтому память не зависит от размера файла. Одинаковые (item, location) из разных
+    кусков суммируются при финальном слиянии.
+
+    manifest=(source, file_hash) — инкрементальный режим: пишутся только строки,
+    изменившиеся с прошлого импорта того же source (см. _apply_inventory_delta).
+    mode="sync" — файл считается полным состоянием своих локаций (см. _prune_inventory).
+    """
+    if mode not in ("upsert", "sync"):
+        raise ValueError("mode must be 'upsert' or 'sync'")
+
+    create_stage(db, _inventory_stage)
+
+    chunks_read = 0
+    for chunk in chunks:
+        _stage_inventory(db, _clean_inventory(chunk))
+        chunks_read += 1
+
+    _aggregate_inventory_stage(db)
+    coverage.begin_keys(db)
+
+    if manifest:
+        stats = {**_apply_inventory_delta(db, *manifest), "skipped": 0}
+    else:
+        inserted, updated = _merge_inventory(db, "_inventory_current")
+        coverage.add_keys(db, coverage.item_keys_sql("SELECT item_id FROM _inventory_current"))
+        stats = {"inserted": inserted, "updated": updated, "skipped": 0, "rows": inserted + updated}
+
+    if mode == "sync":
+        stats.update(_prune_inventory(db))
+
+    # агрегаты покрытия — только по названиям, которых коснулся импорт
+    coverage.refresh(db, "items", required=False)
+    return {**stats, "chunks": chunks_read}
+
+
+def ingest_inventory_df(
+    db: Session,
+    df: pd.DataFrame,
+    *,
+    manifest: Optional[tuple[str, str]] = None,
+    mode: str = "upsert",
+) -> dict:
+    stats = ingest_inventory_chunks(db, [df], manifest=manifest, mode=mode)
+    del stats["chunks"]
+    return stats
 
 
 def ingest_software_inventory_df(db: Session, df: pd.DataFrame) -> dict:
@@ -91,8 +321,8 @@ def ingest_software_inventory_df(db: Session, df: pd.DataFrame) -> dict:
         raise ValueError(f"CSV missing columns: {sorted(missing)}")
 
     df = df.copy()
-    df["software_name"] = df["software_name"].astype(str).map(canonicalize_software)
-    df["location"] = df["location"].astype(str).str.strip()
+    df["software_name"] = as_text(df["software_name"]).map(canonicalize_software)
+    df["location"] = as_text(df["location"])
     df["seats_available"] = pd.to_numeric(df["seats_available"], errors="coerce").fillna(0).astype(int)
 
     # агрегируем на всякий случай
@@ -121,35 +351,267 @@ def ingest_software_inventory_df(db: Session, df: pd.DataFrame) -> dict:
             ))
             inserted += 1
 
+    db.flush()
+    coverage.begin_keys(db)
+    coverage.add_names(db, df["software_name"].unique())
+    coverage.refresh(db, "software", required=False)
+
     return {"rows": int(len(df)), "inserted": inserted, "updated": updated, "skipped": 0}
 
 
+_software_requirements_stage = Table(
+    "_software_requirements_stage",
+    MetaData(),
+    Column("software_name", String, nullable=False),
+    Column("seats_required", Integer, nullable=False),
+    Column("discipline", String, nullable=False),
+    Column("lab", String, nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
 def ingest_software_requirements_df(db: Session, df: pd.DataFrame, *, replace: bool = False) -> dict:
     required = {"software_name", "seats_required", "discipline", "lab"}
     missing = required - set(df.columns)
     if missing:
         raise ValueError(f"CSV missing columns: {sorted(missing)}")
 
+    df = pd.DataFrame({
+        "software_name": as_text(df["software_name"]).map(canonicalize_software),
+        "seats_required": pd.to_numeric(df["seats_required"], errors="coerce").fillna(0).astype(int),
+        "discipline": as_text(df["discipline"]),
+        "lab": as_text(df["lab"]),
+    })
+    df = df[(df["software_name"] != "") & (df["discipline"] != "") & (df["lab"] != "")]
+
+    create_stage(db, _software_requirements_stage)
+    copy_dataframe(db, _software_requirements_stage, df)
+
     if replace:
-        db.query(SoftwareRequirement).delete()
+        # полная замена: shadow-таблица и атомарная подмена вместо DELETE (см. bulk.swap_shadow)
+        shadow = create_shadow(db, "software_requirements")
+        inserted = keys = db.execute(text(f"""
+            INSERT INTO {shadow} (software_name, seats_required, discipline, lab)
+            SELECT software_name, SUM(seats_required)::int, discipline, lab
+            FROM _software_requirements_stage
+            GROUP BY software_name, discipline, lab
+        """)).rowcount
+        updated = 0
+        # агрегаты и поколение — до подмены, чтобы эксклюзивный лок подмены был последним перед коммитом
+        coverage.refresh(db, "software", available=False, full=True, required_from=shadow)
+        bump_generation(db)
+        swap_shadow(db, "software_requirements")
+    else:
+        coverage.begin_keys(db)
+        coverage.add_keys(db, "SELECT software_name FROM _software_requirements_stage")
+        # один upsert по естественному ключу (discipline, lab, software_name);
+        # дубли ключа внутри файла суммируются, строки с тем же числом мест не переписываются
+        inserted, updated, keys = db.execute(text("""
+            WITH src AS (
+                SELECT software_name, discipline, lab, SUM(seats_required)::int AS seats_required
+                FROM _software_requirements_stage
+                GROUP BY software_name, discipline, lab
+            ),
+            up AS (
+                INSERT INTO software_requirements (software_name, seats_required, discipline, lab)
+                SELECT software_name, seats_required, discipline, lab FROM src
+                ON CONFLICT ON CONSTRAINT uq_software_requirements_natural_key
+                DO UPDATE SET seats_required = EXCLUDED.seats_required
+                WHERE software_requirements.seats_required IS DISTINCT FROM EXCLUDED.seats_required
+                RETURNING (xmax = 0) AS is_new
+            )
+            SELECT
+                (SELECT COUNT(*) FROM up WHERE is_new),
+                (SELECT COUNT(*) FROM up WHERE NOT is_new),
+                (SELECT COUNT(*) FROM src)
+        """)).one()
+        coverage.refresh(db, "software", available=False)
+
+    return {
+        "rows": int(len(df)),
+        "inserted": int(inserted),
+        "updated": int(updated),
+        "unchanged": int(keys) - int(inserted) - int(updated),
+        "skipped": 0,
+        "replace": replace,
+    }
+
+
+def ingest_lab_locations_df(db: Session, df: pd.DataFrame, *, replace: bool = False) -> dict:
+    """Привязка лабораторий к местам: lab -> location ("адрес | аудитория" или только адрес)."""
+    required = {"lab", "location"}
+    missing = required - set(df.columns)
+    if missing:
+        raise ValueError(f"CSV missing columns: {sorted(missing)}")
 
-    df = df.copy()
-    df["software_name"] = df["software_name"].astype(str).map(canonicalize_software)
-    df["discipline"] = df["discipline"].astype(str).str.strip()
-    df["lab"] = df["lab"].astype(str).str.strip()
-    df["seats_required"] = pd.to_numeric(df["seats_required"], errors="coerce").fillna(0).astype(int)
+    df = pd.DataFrame({"lab": as_text(df["lab"]), "location": as_text(df["location"])})
+    df = df[(df["lab"] != "") & (df["location"] != "")].drop_duplicates("lab", keep="last")
 
-    df = df[(df["software_name"] != "") & (df["discipline"] != "") & (df["lab"] != "")]
+    deleted = db.query(LabLocation).delete() if replace else 0
+    inserted, updated = 0, 0
+    for batch in _batches(df.to_dict("records")):
+        stmt = pg_insert(LabLocation).values(batch)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[LabLocation.lab],
+            set_={"location": stmt.excluded.location},
+            where=LabLocation.location.is_distinct_from(stmt.excluded.location),
+        ).returning(literal_column("xmax = 0"))
+        flags = db.execute(stmt).scalars().all()
+        inserted += sum(1 for f in flags if f)
+        updated += sum(1 for f in flags if not f)
+
+    return {"rows": int(len(df)), "inserted": inserted, "updated": updated, "deleted": int(deleted), "replace": replace}
+
+
+# Дни недели в расписании: число 1..7 или название
+WEEKDAYS = {
+    **{str(i): i for i in range(1, 8)},
+    **dict(zip(("пн", "вт", "ср", "чт", "пт", "сб", "вс"), range(1, 8))),
+    **dict(zip(("понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье"), range(1, 8))),
+    **dict(zip(("mon", "tue", "wed", "thu", "fri", "sat", "sun"), range(1, 8))),
+}
+
+
+def _clock(s: pd.Series) -> pd.Series:
+    # "8:30" / "08:30:00" -> datetime.time; нераспознанное -> NaT
+    # (без ":" не пропускаем: to_timedelta прочитал бы "9" как наносекунды, т.е. 00:00)
+    text_ = as_text(s)
+    colons = text_.str.count(":")
+    text_ = text_.where(colons != 1, text_ + ":00").where(colons.between(1, 2), "")
+    delta = pd.to_timedelta(text_, errors="coerce")
+    delta = delta.where((delta >= pd.Timedelta(0)) & (delta < pd.Timedelta(days=1)))
+    return (pd.Timestamp(0) + delta).dt.time.where(delta.notna())
+
+
+def ingest_timetable_df(db: Session, df: pd.DataFrame, *, replace: bool = False) -> dict:
+    """Расписание: discipline, lab, weekday, start, end (время — ЧЧ:ММ)."""
+    required = {"discipline", "lab", "weekday", "start", "end"}
+    missing = required - set(df.columns)
+    if missing:
+        raise ValueError(f"CSV missing columns: {sorted(missing)}")
 
-    inserted = 0
-    for r in df.itertuples(index=False):
-        db.add(SoftwareRequirement(
-            software_name=r.software_name,
-            seats_required=int(r.seats_required),
-            discipline=r.discipline,
-            lab=r.lab,
-        ))
-        inserted += 1
+    rows = pd.DataFrame({
+        "discipline": as_text(df["discipline"]),
+        "lab": as_text(df["lab"]),
+        "weekday": as_text(df["weekday"]).str.lower().str.removesuffix(".0").map(WEEKDAYS),
+        "starts_at": _clock(df["start"]),
+        "ends_at": _clock(df["end"]),
+    })
+    ok = (
+        (rows["discipline"] != "") & (rows["lab"] != "") & rows["weekday"].notna()
+        & rows["starts_at"].notna() & rows["ends_at"].notna()
+    )
+    ok[ok] = (rows.loc[ok, "starts_at"] < rows.loc[ok, "ends_at"]).astype(bool)
+    ok = ok.astype(bool)
+    skipped = int((~ok).sum())
+    rows = rows[ok].astype({"weekday": int}).drop_duplicates(["discipline", "lab", "weekday", "starts_at"], keep="last")
 
-    return {"rows": int(len(df)), "inserted": inserted, "skipped": 0, "replace": replace}
+    deleted = db.query(Timetable).delete() if replace else 0
+    inserted, updated = 0, 0
+    for batch in _batches(rows.to_dict("records")):
+        stmt = pg_insert(Timetable).values(batch)
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_timetable_natural_key",
+            set_={"ends_at": stmt.excluded.ends_at},
+            where=Timetable.ends_at.is_distinct_from(stmt.excluded.ends_at),
+        ).returning(literal_column("xmax = 0"))
+        flags = db.execute(stmt).scalars().all()
+        inserted += sum(1 for f in flags if f)
+        updated += sum(1 for f in flags if not f)
+
+    # расписание меняет пики по всем названиям сразу
+    for kind in coverage.SPECS:
+        coverage.refresh(db, kind, available=False, full=True)
+
+    return {
+        "rows": int(len(rows)),
+        "inserted": inserted,
+        "updated": updated,
+        "deleted": int(deleted),
+        "skipped": skipped,
+        "replace": replace,
+    }
+
+
+# Колонки выгрузки parser_unified.save_top3_to_csv (кроме search_query и price — необязательные)
+OFFER_COLUMNS = ("search_query", "number", "brand", "name", "price", "link", "marketplace")
+
+_offers_stage = Table(
+    "_offers_stage",
+    MetaData(),
+    Column("search_query", String, nullable=False),
+    Column("canonical_name", String),
+    Column("number", Integer),
+    Column("brand", String),
+    Column("name", String),
+    Column("price", Numeric(14, 2), nullable=False),
+    Column("link", String),
+    Column("marketplace", String),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+def _price(s: pd.Series) -> pd.Series:
+    # "12 990 ₽" / "1290,50" -> число (как parser_unified.parse_price_to_float); "Цена не указана" -> NaN
+    digits = as_text(s).str.replace(r"[^\d.,]", "", regex=True).str.replace(",", ".", regex=False)
+    price = pd.to_numeric(digits, errors="coerce")
+    return price.where(price > 0)
+
+
+def ingest_offers_df(db: Session, df: pd.DataFrame, *, replace: bool = False) -> dict:
+    """
+    Предложения продавцов. Файл дописывается при каждом запуске парсера, поэтому по каждому
+    запросу берётся только последняя выгрузка (номера 1, 2, 3 подряд), и она целиком заменяет
+    прежние предложения этого запроса. replace=True — удаляются и запросы, которых нет в файле.
+    """
+    missing = {"search_query", "price"} - set(df.columns)
+    if missing:
+        raise ValueError(f"CSV missing columns: {sorted(missing)}")
 
+    rows = pd.DataFrame({
+        c: (as_text(df[c]) if c in df.columns else pd.Series("", index=df.index))
+        for c in OFFER_COLUMNS
+    })
+    rows["number"] = pd.to_numeric(rows["number"], errors="coerce")
+    rows["price"] = _price(rows["price"])
+    rows = rows[rows["search_query"] != ""].reset_index(drop=True)
+
+    # выгрузка — подряд идущие строки одного запроса с растущим number; последняя по файлу — текущая
+    query = rows["search_query"]
+    number = rows["number"].fillna(0)
+    rows["run"] = ((query != query.shift()) | (number <= number.shift())).cumsum()
+    current = rows["run"] == rows.groupby("search_query")["run"].transform("max")
+    queries = int(query.nunique())
+    rows = rows[current & rows["price"].notna()]
+    skipped = int(current.sum()) - len(rows)
+    rows = rows.drop(columns="run").drop_duplicates(["search_query", "marketplace", "link", "name"], keep="last")
+
+    canon = canonical_map(rows["search_query"].unique())
+    rows.insert(1, "canonical_name", rows["search_query"].map(canon))
+    rows["number"] = rows["number"].astype("Int64")
+    for c in ("brand", "name", "link", "marketplace"):
+        rows[c] = rows[c].replace("", None)
+
+    create_stage(db, _offers_stage)
+    copy_dataframe(db, _offers_stage, rows)
+    if replace:
+        deleted = db.execute(text("DELETE FROM offers")).rowcount
+    else:
+        # запросы из файла — без предложений с ценой тоже: их прежние предложения устарели
+        deleted = db.execute(
+            text("DELETE FROM offers WHERE search_query = ANY(:queries)"),
+            {"queries": list(query.unique())},
+        ).rowcount
+    columns = ", ".join(c.name for c in _offers_stage.columns)
+    inserted = db.execute(text(f"INSERT INTO offers ({columns}) SELECT {columns} FROM _offers_stage")).rowcount
+
+    return {
+        "rows": int(len(df)),
+        "queries": queries,
+        "inserted": int(inserted),
+        "deleted": int(deleted),
+        "skipped": skipped,
+        "replace": replace,
+    }
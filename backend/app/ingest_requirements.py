@@ -1,53 +1,157 @@
 from __future__ import annotations
 
+from typing import Iterable
+
 import pandas as pd
+from sqlalchemy import Column, Integer, MetaData, String, Table, text
 from sqlalchemy.orm import Session
 
-from .models import Requirement
+from . import coverage
+from .bulk import copy_dataframe, create_shadow, create_stage, swap_shadow
+from .cache import bump_generation
+from .normalize_items import canonical_map, load_synonyms
+from .readers import as_text
 
 REQUIRED_COLS = {"item_name", "qty_required"}
+OPTIONAL_COLS = {"discipline", "lab"}
+# Типы для потокового чтения CSV: дисциплины и лаборатории сильно повторяются — category
+CSV_DTYPES = {"discipline": "category", "lab": "category"}
 
-def ingest_requirements_df(db: Session, df: pd.DataFrame, *, replace: bool = False) -> dict:
+# Промежуточная таблица импорта (до конца транзакции); пустые discipline/lab приходят как NULL
+_requirements_stage = Table(
+    "_requirements_stage",
+    MetaData(),
+    Column("discipline", String),
+    Column("lab", String),
+    Column("item_name", String, nullable=False),
+    Column("canonical_name", String),
+    Column("qty_required", Integer, nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+def _clean_requirements(df: pd.DataFrame) -> pd.DataFrame:
     missing = REQUIRED_COLS - set(df.columns)
     if missing:
         raise ValueError(f"CSV missing required columns: {sorted(missing)}")
 
-    df = df.copy()
-    df["item_name"] = df["item_name"].astype(str).str.strip()
-    df["qty_required"] = pd.to_numeric(df["qty_required"], errors="coerce").fillna(0).astype(int)
+    # собираем новый фрейм только из нужных колонок вместо df.copy()
+    out = pd.DataFrame({
+        "item_name": as_text(df["item_name"]),
+        "qty_required": pd.to_numeric(df["qty_required"], errors="coerce").fillna(0).astype(int),
+    })
 
-    if "discipline" in df.columns:
-        df["discipline"] = df["discipline"].astype(str).str.strip()
-        df.loc[df["discipline"] == "nan", "discipline"] = ""
-    else:
-        df["discipline"] = ""
+    for col in ("discipline", "lab"):
+        if col in df.columns:
+            out[col] = as_text(df[col])
+            out.loc[out[col] == "nan", col] = ""
+        else:
+            out[col] = ""
 
-    if "lab" in df.columns:
-        df["lab"] = df["lab"].astype(str).str.strip()
-        df.loc[df["lab"] == "nan", "lab"] = ""
-    else:
-        df["lab"] = ""
+    return out[(out["item_name"] != "") & (out["qty_required"] >= 0)]
 
-    df = df[(df["item_name"] != "") & (df["qty_required"] >= 0)]
 
-    if replace:
-        db.query(Requirement).delete()
+def _upsert_requirements_stage(db: Session) -> tuple[int, int, int]:
+    """
+    Перенос из промежуточной таблицы одним INSERT ... ON CONFLICT DO UPDATE по естественному ключу
+    (discipline, lab, item_name). Дубли ключа внутри файла суммируются. Строки с тем же количеством
+    не переписываются, поэтому повторный импорт того же плана почти ничего не стоит.
+    Возвращает (inserted, updated, число ключей в файле).
+    """
+    row = db.execute(text("""
+        WITH src AS (
+            SELECT discipline, lab, item_name, MAX(canonical_name) AS canonical_name,
+                   SUM(qty_required)::int AS qty_required
+            FROM _requirements_stage
+            GROUP BY discipline, lab, item_name
+        ),
+        up AS (
+            INSERT INTO requirements (discipline, lab, item_name, canonical_name, qty_required)
+            SELECT discipline, lab, item_name, canonical_name, qty_required FROM src
+            ON CONFLICT ON CONSTRAINT uq_requirements_natural_key
+            DO UPDATE SET qty_required = EXCLUDED.qty_required, canonical_name = EXCLUDED.canonical_name
+            WHERE requirements.qty_required IS DISTINCT FROM EXCLUDED.qty_required
+               OR requirements.canonical_name IS DISTINCT FROM EXCLUDED.canonical_name
+            RETURNING (xmax = 0) AS is_new
+        )
+        SELECT
+            (SELECT COUNT(*) FROM up WHERE is_new),
+            (SELECT COUNT(*) FROM up WHERE NOT is_new),
+            (SELECT COUNT(*) FROM src)
+    """)).one()
+    return int(row[0]), int(row[1]), int(row[2])
+
+
+def _replace_requirements_from_stage(db: Session) -> int:
+    """
+    replace=True: новый план собирается в shadow-таблице и подменяет requirements атомарно
+    (см. bulk.swap_shadow) — без DELETE всей таблицы. Агрегаты покрытия пересобираются из shadow
+    до подмены: эксклюзивный лок подмены берётся последним перед коммитом.
+    """
+    shadow = create_shadow(db, "requirements")
+    inserted = db.execute(text(f"""
+        INSERT INTO {shadow} (discipline, lab, item_name, canonical_name, qty_required)
+        SELECT discipline, lab, item_name, MAX(canonical_name), SUM(qty_required)::int
+        FROM _requirements_stage
+        GROUP BY discipline, lab, item_name
+    """)).rowcount
+    coverage.refresh(db, "items", available=False, full=True, required_from=shadow)
+    # поколение — до подмены: ожидание строки app_state не должно идти под эксклюзивным локом
+    bump_generation(db)
+    swap_shadow(db, "requirements")
+    return inserted
+
+
+def ingest_requirements_chunks(db: Session, chunks: Iterable[pd.DataFrame], *, replace: bool = False) -> dict:
+    """
+    Потоковый импорт требований: каждый кусок пишется через COPY в промежуточную таблицу
+    до чтения следующего, затем всё переносится в requirements одним upsert по естественному ключу.
+    canonical_name считается здесь же, при импорте.
+    """
+    create_stage(db, _requirements_stage)
+    syn = load_synonyms()
 
-    inserted = 0
     skipped = 0
-    for row in df.itertuples(index=False):
-        qty = int(row.qty_required)
-        if qty == 0:
-            skipped += 1
-            continue
-        db.add(
-            Requirement(
-                discipline=row.discipline or None,
-                lab=row.lab or None,
-                item_name=row.item_name,
-                qty_required=qty,
-            )
-        )
-        inserted += 1
+    rows = 0
+    chunks_read = 0
+    for chunk in chunks:
+        df = _clean_requirements(chunk)
+        rows += len(df)
+        chunks_read += 1
+
+        keep = df[df["qty_required"] != 0]
+        skipped += len(df) - len(keep)
+        # канон считается один раз на уникальное название куска
+        keep = keep.assign(canonical_name=keep["item_name"].map(canonical_map(keep["item_name"].unique(), syn)))
+        copy_dataframe(db, _requirements_stage, keep)
+
+    if replace:
+        inserted = keys = _replace_requirements_from_stage(db)
+        updated = 0
+    else:
+        # агрегаты покрытия: канон из файла и прежний канон тех же названий (если правила менялись)
+        coverage.begin_keys(db)
+        coverage.add_keys(db, "SELECT canonical_name FROM _requirements_stage")
+        coverage.add_keys(db, """
+            SELECT COALESCE(canonical_name, item_name) FROM requirements
+            WHERE item_name IN (SELECT item_name FROM _requirements_stage)
+        """)
+        inserted, updated, keys = _upsert_requirements_stage(db)
+        coverage.refresh(db, "items", available=False)
+
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": keys - inserted - updated,
+        "skipped": skipped,
+        "rows": rows,
+        "replace": bool(replace),
+        "chunks": chunks_read,
+    }
 
-    return {"inserted": inserted, "skipped": skipped, "rows": int(len(df)), "replace": bool(replace)}
\ No newline at end of file
+
+def ingest_requirements_df(db: Session, df: pd.DataFrame, *, replace: bool = False) -> dict:
+    stats = ingest_requirements_chunks(db, [df], replace=replace)
+    del stats["chunks"]
+    return stats
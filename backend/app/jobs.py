@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+
+
+# Сколько импортов выполняется параллельно (остальные ждут в очереди пула)
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "2"))
+# Сколько последних задач держим в памяти для GET /jobs
+JOBS_KEEP = 200
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    params: dict = field(default_factory=dict)
+    status: str = "queued"  # queued | running | done | failed
+    rows_processed: int = 0
+    stats: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def add_rows(self, n: int) -> None:
+        self.rows_processed += int(n)
+
+    def to_dict(self) -> dict:
+        end = self.finished_at or time.time()
+        elapsed = (end - self.started_at) if self.started_at else 0.0
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "rows_processed": self.rows_processed,
+            "elapsed_sec": round(elapsed, 3),
+            "rows_per_sec": round(self.rows_processed / elapsed, 1) if elapsed > 0 else None,
+            "stats": self.stats,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+_pool = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="import")
+_jobs: "OrderedDict[str, Job]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _remember(job: Job) -> None:
+    with _lock:
+        _jobs[job.id] = job
+        # выкидываем самые старые завершённые задачи
+        extra = len(_jobs) - JOBS_KEEP
+        for jid in [j.id for j in _jobs.values() if j.status in ("done", "failed")][:max(0, extra)]:
+            del _jobs[jid]
+
+
+def get_job(job_id: str) -> Optional[Job]:
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def list_jobs() -> list[Job]:
+    with _lock:
+        return list(reversed(_jobs.values()))
+
+
+def _run(job: Job, fn: Callable[..., dict], args: tuple, kwargs: dict, cleanup: Optional[Callable[[], None]]) -> None:
+    job.status = "running"
+    job.started_at = time.time()
+    db: Session = SessionLocal()
+    try:
+        job.stats = fn(db, *args, on_rows=job.add_rows, **kwargs)
+        db.commit()
+        job.status = "done"
+    except Exception as e:
+        db.rollback()
+        job.error = str(e)
+        job.status = "failed"
+    finally:
+        db.close()
+        job.finished_at = time.time()
+        if cleanup:
+            cleanup()
+
+
+def submit(
+    kind: str,
+    fn: Callable[..., dict],
+    *args,
+    cleanup: Optional[Callable[[], None]] = None,
+    params: Optional[dict] = None,
+    **kwargs,
+) -> Job:
+    """
+    Ставит импорт в очередь пула. fn(db, *args, on_rows=..., **kwargs) выполняется
+    в своей сессии и коммитится целиком; cleanup() вызывается в любом случае
+    (например, удалить временный файл загрузки).
+    """
+    job = Job(id=uuid.uuid4().hex, kind=kind, params=params or {})
+    _remember(job)
+    _pool.submit(_run, job, fn, args, kwargs, cleanup)
+    return job
@@ -4,26 +4,64 @@ import os
 import json
 import httpx
 from datetime import datetime
-import io
-import csv
+import shutil
+import tempfile
 from pathlib import Path
 from typing import Optional, Literal
-import pandas as pd
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Query
+from pydantic import BaseModel, Field
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from .normalize_software import canonicalize_software
 from sqlalchemy import text, func
 from sqlalchemy.orm import Session
 
-from .db import engine, get_db
-from .models import Base, Item, Location, Inventory, Requirement, SoftwareInventory, SoftwareRequirement
-from .ingest import ingest_inventory_df, ingest_software_inventory_df, ingest_software_requirements_df
-from .ingest_requirements import ingest_requirements_df
+from .cache import RESPONSE_CACHE, ResponseCacheMiddleware, on_generation_change
+from .compression import CompressionMiddleware, negotiate
+from .db import SessionLocal, engine, get_db
+from .models import Base, Item, Location, Inventory, Requirement
+from . import allocation, artifacts, canon, coverage, importers, jobs, migrations, paging, reports, scenarios
+from .readers import DEFAULT_CHUNK_ROWS, FORMATS, file_format
+from .normalize_items import SYNONYMS
 from .parser.mstuca import parse_on_startup
 
 app = FastAPI(title="MTO Minimal API")
 
+CHUNKSIZE_QUERY = Query(
+    None, ge=1000, le=1_000_000,
+    description="Если задан — потоковый импорт кусками по chunksize строк (память не зависит от размера файла)",
+)
+DELTA_QUERY = Query(
+    False,
+    description="Инкрементальный импорт: неизменённый файл пропускается, иначе пишутся только добавленные/изменённые/удалённые строки",
+)
+INVENTORY_MODE_QUERY = Query(
+    "upsert",
+    description="upsert — только вставка/обновление; sync — в локациях из файла удалить позиции, которых в файле нет",
+)
+BACKGROUND_QUERY = Query(
+    False,
+    description="Если true — импорт ставится в очередь, сразу возвращается job_id (прогресс: GET /jobs/{job_id})",
+)
+
+# Ответы эндпоинтов чтения кэшируются до следующего импорта (ETag / 304 / готовые байты).
+# Добавляется до CORS, чтобы CORS-заголовки ставились на каждый ответ, а не попадали в кэш.
+CACHED_PATHS = (
+    "/stats",
+    "/inventory/summary",
+    "/requirements/summary",
+    "/calc/coverage",
+    "/calc/software-coverage",
+    "/calc/allocation",
+    # CSV/XLSX-отчёты покрытия сюда не входят: их отдают готовые файлы (artifacts) —
+    # с ETag по содержимому, Range и предсжатыми вариантами; до сборки файла — поток
+    "/reports/procurement-priced",
+)
+app.add_middleware(ResponseCacheMiddleware, paths=CACHED_PATHS)
+# gzip / zstd для больших текстовых ответов; снаружи кэша — из кэша ответы приходят уже сжатыми
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://localhost:3000", "http://127.0.0.1:5173", "http://127.0.0.1:3000"],
@@ -32,10 +70,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _synonyms_changed(version: str) -> None:
+    jobs.submit("recanonicalize", canon.recanonicalize, params={"version": version})
+
 @app.on_event("startup")
 def startup():
     # Пока создаём таблицы автоматически (позже заменим на миграции)
     Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine)
+    # synonyms.csv или правила канонизации поменялись (или есть строки без канона) — пересчёт в фоне
+    with SessionLocal() as db:
+        if canon.status(db)["stale"]:
+            jobs.submit("recanonicalize", canon.recanonicalize)
+        # агрегаты покрытия ещё не построены (новая БД или обновление) — собираем в фоне,
+        # а пока /calc/* считает прямо по таблицам
+        if not coverage.aggregates_ready(db):
+            jobs.submit("coverage_rebuild", coverage.rebuild)
+    # synonyms.csv поправили на ходу — SYNONYMS заметит это при следующем обращении
+    SYNONYMS.on_change(_synonyms_changed)
+    # готовые файлы отчётов пересобираются после каждого импорта; при старте — если их нет для текущих данных
+    on_generation_change(artifacts.schedule)
+    artifacts.schedule()
     # Парсинг и нормализация таблицы оснащённости МГТУ ГА (в файл CSV).
     # Файл сохраняется в /app/data/processed и пока не используется системой.
     parse_on_startup()
@@ -45,37 +100,102 @@ def health(db: Session = Depends(get_db)):
     db.execute(text("SELECT 1"))
     return {"status": "ok", "db": "ok"}
 
+# -------------------- import helpers --------------------
+
+DATA_ROOT = Path("/app/data")
+
+
+def _data_file(rel_path: str) -> Path:
+    safe_root = DATA_ROOT.resolve()
+    target = (safe_root / rel_path).resolve()
+
+    if not str(target).startswith(str(safe_root)):
+        raise HTTPException(status_code=400, detail="Bad path (outside /app/data)")
+    if not target.exists() or not target.is_file():
+        raise HTTPException(status_code=404, detail=f"File not found: {rel_path}")
+    if target.suffix.lower() not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Only {', '.join(sorted(FORMATS))} files are supported")
+    return target
+
+
+def _check_upload(file: UploadFile) -> str:
+    """Формат загрузки по расширению: csv | parquet | arrow."""
+    try:
+        return file_format(file.filename or "")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Upload a {', '.join(sorted(FORMATS))} file")
+
+
+async def _spool_upload(file: UploadFile) -> Path:
+    # копия загрузки во временный файл: UploadFile закрывается вместе с запросом, а задача живёт дольше
+    fd, tmp = tempfile.mkstemp(prefix="mto-import-", suffix=Path(file.filename).suffix)
+    with os.fdopen(fd, "wb") as out:
+        await run_in_threadpool(shutil.copyfileobj, file.file, out)
+    return Path(tmp)
+
+
+def _submitted(job: jobs.Job) -> dict:
+    return {"ok": True, "job_id": job.id, "status": job.status, "url": f"/jobs/{job.id}"}
+
+
 # -------------------- import inventory --------------------
 
 @app.post("/import/inventory")
-async def import_inventory(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    if not file.filename.lower().endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Upload a .csv file")
-
-    content = await file.read()
-    df = pd.read_csv(io.BytesIO(content), encoding="utf-8-sig")
+async def import_inventory(
+    file: UploadFile = File(...),
+    chunksize: Optional[int] = CHUNKSIZE_QUERY,
+    delta: bool = DELTA_QUERY,
+    mode: Literal["upsert", "sync"] = INVENTORY_MODE_QUERY,
+    background: bool = BACKGROUND_QUERY,
+    db: Session = Depends(get_db),
+):
+    fmt = _check_upload(file)
+
+    if background:
+        tmp = await _spool_upload(file)
+        job = jobs.submit(
+            "inventory", importers.import_inventory, tmp,
+            fmt=fmt,
+            chunksize=chunksize or DEFAULT_CHUNK_ROWS,
+            delta=delta,
+            source_key=file.filename,
+            mode=mode,
+            cleanup=lambda: tmp.unlink(missing_ok=True),
+            params={"filename": file.filename, "delta": delta, "mode": mode},
+        )
+        return _submitted(job)
 
-    stats = ingest_inventory_df(db, df)
+    # читаем прямо из временного файла загрузки, не поднимая его целиком в память
+    stats = await run_in_threadpool(
+        importers.import_inventory, db, file.file,
+        fmt=fmt, chunksize=chunksize, delta=delta, source_key=file.filename, mode=mode,
+    )
     db.commit()
     return {"ok": True, **stats}
 
 @app.post("/import/inventory-from-path")
 def import_inventory_from_path(
     rel_path: str = Query(..., description="Путь относительно /app/data, например processed/inventory_normalized_aggregated.csv"),
+    chunksize: Optional[int] = CHUNKSIZE_QUERY,
+    delta: bool = DELTA_QUERY,
+    mode: Literal["upsert", "sync"] = INVENTORY_MODE_QUERY,
+    background: bool = BACKGROUND_QUERY,
     db: Session = Depends(get_db),
 ):
-    safe_root = Path("/app/data").resolve()
-    target = (safe_root / rel_path).resolve()
-
-    if not str(target).startswith(str(safe_root)):
-        raise HTTPException(status_code=400, detail="Bad path (outside /app/data)")
-    if not target.exists() or not target.is_file():
-        raise HTTPException(status_code=404, detail=f"File not found: {rel_path}")
-    if target.suffix.lower() != ".csv":
-        raise HTTPException(status_code=400, detail="Only .csv files are supported")
+    target = _data_file(rel_path)
+
+    if background:
+        job = jobs.submit(
+            "inventory", importers.import_inventory, target,
+            chunksize=chunksize or DEFAULT_CHUNK_ROWS,
+            delta=delta,
+            source_key=rel_path,
+            mode=mode,
+            params={"path": rel_path, "delta": delta, "mode": mode},
+        )
+        return _submitted(job)
 
-    df = pd.read_csv(target, encoding="utf-8-sig")
-    stats = ingest_inventory_df(db, df)
+    stats = importers.import_inventory(db, target, chunksize=chunksize, delta=delta, source_key=rel_path, mode=mode)
     db.commit()
     return {"ok": True, "path": rel_path, **stats}
 
@@ -85,15 +205,28 @@ def import_inventory_from_path(
 async def import_requirements(
     file: UploadFile = File(...),
     replace: bool = Query(False, description="Если true — очищает requirements перед импортом"),
+    chunksize: Optional[int] = CHUNKSIZE_QUERY,
+    background: bool = BACKGROUND_QUERY,
     db: Session = Depends(get_db),
 ):
-    if not file.filename.lower().endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Upload a .csv file")
-
-    content = await file.read()
-    df = pd.read_csv(io.BytesIO(content), encoding="utf-8-sig")
+    fmt = _check_upload(file)
+
+    if background:
+        tmp = await _spool_upload(file)
+        job = jobs.submit(
+            "requirements", importers.import_requirements, tmp,
+            fmt=fmt,
+            replace=replace,
+            chunksize=chunksize or DEFAULT_CHUNK_ROWS,
+            cleanup=lambda: tmp.unlink(missing_ok=True),
+            params={"filename": file.filename, "replace": replace},
+        )
+        return _submitted(job)
 
-    stats = ingest_requirements_df(db, df, replace=replace)
+    stats = await run_in_threadpool(
+        importers.import_requirements, db, file.file,
+        fmt=fmt, replace=replace, chunksize=chunksize,
+    )
     db.commit()
     return {"ok": True, **stats}
 
@@ -101,23 +234,65 @@ async def import_requirements(
 def import_requirements_from_path(
     rel_path: str = Query(..., description="Путь относительно /app/data, например processed/requirements.csv"),
     replace: bool = Query(False, description="Если true — очищает requirements перед импортом"),
+    chunksize: Optional[int] = CHUNKSIZE_QUERY,
+    background: bool = BACKGROUND_QUERY,
     db: Session = Depends(get_db),
 ):
-    safe_root = Path("/app/data").resolve()
-    target = (safe_root / rel_path).resolve()
-
-    if not str(target).startswith(str(safe_root)):
-        raise HTTPException(status_code=400, detail="Bad path (outside /app/data)")
-    if not target.exists() or not target.is_file():
-        raise HTTPException(status_code=404, detail=f"File not found: {rel_path}")
-    if target.suffix.lower() != ".csv":
-        raise HTTPException(status_code=400, detail="Only .csv files are supported")
+    target = _data_file(rel_path)
+
+    if background:
+        job = jobs.submit(
+            "requirements", importers.import_requirements, target,
+            replace=replace,
+            chunksize=chunksize or DEFAULT_CHUNK_ROWS,
+            params={"path": rel_path, "replace": replace},
+        )
+        return _submitted(job)
 
-    df = pd.read_csv(target, encoding="utf-8-sig")
-    stats = ingest_requirements_df(db, df, replace=replace)
+    stats = importers.import_requirements(db, target, replace=replace, chunksize=chunksize)
     db.commit()
     return {"ok": True, "path": rel_path, **stats}
 
+# -------------------- import jobs --------------------
+
+@app.get("/jobs")
+def list_import_jobs():
+    return {"rows": [j.to_dict() for j in jobs.list_jobs()]}
+
+@app.get("/jobs/{job_id}")
+def get_import_job(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_dict()
+
+@app.get("/cache/stats")
+def cache_stats():
+    return RESPONSE_CACHE.stats()
+
+# -------------------- canonical names --------------------
+
+@app.get("/canon/status")
+def canon_status(db: Session = Depends(get_db)):
+    return canon.status(db)
+
+@app.get("/canon/synonyms")
+def canon_synonyms():
+    return SYNONYMS.stats()
+
+@app.post("/canon/recompute")
+def canon_recompute(
+    force: bool = Query(False, description="Пересчитать канон для всех названий, даже если версия правил не менялась"),
+    background: bool = BACKGROUND_QUERY,
+    db: Session = Depends(get_db),
+):
+    if background:
+        return _submitted(jobs.submit("recanonicalize", canon.recanonicalize, force=force, params={"force": force}))
+
+    stats = canon.recanonicalize(db, force=force)
+    db.commit()
+    return {"ok": True, **stats}
+
 # -------------------- views --------------------
 
 @app.get("/inventory")
@@ -125,9 +300,14 @@ def list_inventory(
     item: Optional[str] = Query(None),
     location: Optional[str] = Query(None),
     limit: int = Query(200, ge=1, le=2000),
-    offset: int = Query(0, ge=0),
+    offset: int = Query(0, ge=0, description="Устаревшее: OFFSET-страницы; для листания — cursor"),
+    cursor: Optional[str] = Query(None, description="next_cursor / prev_cursor из предыдущего ответа"),
     db: Session = Depends(get_db),
 ):
+    """
+    Инвентарь по (локация, позиция). Без offset листается курсорами (keyset): next_cursor / prev_cursor
+    в ответе — страница N стоит как первая. total считается только для первой страницы (без cursor).
+    """
     q = (
         db.query(
             Item.name.label("item_name"),
@@ -142,14 +322,26 @@ def list_inventory(
     if location:
         q = q.filter(Location.name.ilike(f"%{location}%"))
 
-    total = q.count()
-    rows = q.order_by(Location.name.asc(), Item.name.asc()).offset(offset).limit(limit).all()
+    total = q.count() if cursor is None else None
+    next_cursor = prev_cursor = None
+    if offset and cursor is None:
+        rows = q.order_by(Location.name.asc(), Item.name.asc()).offset(offset).limit(limit).all()
+    else:
+        try:
+            rows, next_cursor, prev_cursor = paging.keyset_page(
+                q, [Location.name, Item.name], lambda r: (r.location, r.item_name),
+                limit=limit, cursor=cursor, lead=Location.name, filters=paging.filters_tag(item, location),
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
     return {
         "total": total,
         "limit": limit,
         "offset": offset,
         "rows": [{"item_name": r.item_name, "location": r.location, "qty_available": r.qty_available} for r in rows],
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
     }
 
 @app.get("/inventory/summary")
@@ -171,23 +363,47 @@ def list_requirements(
     discipline: Optional[str] = Query(None),
     item: Optional[str] = Query(None),
     limit: int = Query(200, ge=1, le=2000),
-    offset: int = Query(0, ge=0),
+    offset: int = Query(0, ge=0, description="Устаревшее: OFFSET-страницы; для листания — cursor"),
+    cursor: Optional[str] = Query(None, description="next_cursor / prev_cursor из предыдущего ответа"),
     db: Session = Depends(get_db),
 ):
+    """
+    Требования по (дисциплина — пустые в конце, позиция). Листание — как у /inventory:
+    курсоры next_cursor / prev_cursor по индексу ix_requirements_keyset, total — только без cursor.
+    """
     q = db.query(Requirement)
     if discipline:
         q = q.filter(Requirement.discipline.ilike(f"%{discipline}%"))
     if item:
         q = q.filter(Requirement.item_name.ilike(f"%{item}%"))
 
-    total = q.count()
-    rows = q.order_by(Requirement.discipline.asc().nulls_last(), Requirement.item_name.asc()).offset(offset).limit(limit).all()
+    # тот же порядок, что discipline ASC NULLS LAST, item_name, но без NULL в ключе (сравнение кортежей)
+    order_by = [
+        Requirement.discipline.is_(None),
+        func.coalesce(Requirement.discipline, ""),
+        Requirement.item_name,
+        Requirement.id,
+    ]
+    total = q.count() if cursor is None else None
+    next_cursor = prev_cursor = None
+    if offset and cursor is None:
+        rows = q.order_by(*order_by).offset(offset).limit(limit).all()
+    else:
+        try:
+            rows, next_cursor, prev_cursor = paging.keyset_page(
+                q, order_by, lambda r: (r.discipline is None, r.discipline or "", r.item_name, r.id),
+                limit=limit, cursor=cursor, filters=paging.filters_tag(discipline, item),
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
     return {
         "total": total,
         "limit": limit,
         "offset": offset,
         "rows": [{"discipline": r.discipline, "lab": r.lab, "item_name": r.item_name, "qty_required": r.qty_required} for r in rows],
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
     }
 
 @app.get("/requirements/summary")
@@ -221,91 +437,125 @@ def requirements_summary(
 
 # -------------------- calc: coverage --------------------
 
+SORT_QUERY = Query("deficit", description="deficit | required — по убыванию (при равенстве по названию); name — по названию")
+NAME_FILTER_QUERY = Query(None, description="Фильтр: подстрока названия (без учёта регистра)")
+TOP_QUERY = Query(None, ge=1, le=100_000, description="Только первые N строк в порядке sort")
+LIMIT_QUERY = Query(None, ge=1, le=5000, description="Постранично: размер страницы (следующая — по next_cursor)")
+CURSOR_QUERY = Query(None, description="next_cursor из предыдущей страницы")
+# Для вызова эндпоинтов покрытия из кода (ИИ-записка): все строки, порядок по умолчанию
+ALL_ROWS = {"sort": "deficit", "q": None, "top": None, "limit": None, "cursor": None}
+
+
+def _coverage_result(
+    kind: str,
+    db: Session,
+    *,
+    only_deficit: bool,
+    mode: str,
+    by_lab: bool,
+    sort: str = "deficit",
+    q: Optional[str] = None,
+    top: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> dict:
+    """Общая часть /calc/coverage и /calc/software-coverage; ошибки параметров — ValueError."""
+    if mode not in coverage.MODES:
+        raise ValueError("mode must be 'sum', 'max_per_lab' or 'peak'")
+    if sort not in coverage.SORTS:
+        raise ValueError(f"sort must be one of: {', '.join(coverage.SORTS)}")
+    if top is not None and (limit is not None or cursor):
+        raise ValueError("use either top or limit/cursor")
+    if cursor and limit is None:
+        raise ValueError("cursor requires limit")
+
+    result = {"only_deficit": only_deficit, "mode": mode}
+    if limit is not None:
+        page = coverage.coverage_page(
+            db, kind, mode=mode, only_deficit=only_deficit, by_lab=by_lab,
+            sort=sort, q=q, limit=limit, cursor=cursor,
+        )
+        return {**result, "sort": sort, "limit": limit, **page}
+
+    read = coverage.item_coverage if kind == "items" else coverage.software_coverage
+    rows = read(db, mode=mode, only_deficit=only_deficit, by_lab=by_lab, sort=sort, q=q, top=top)
+    return {**result, "rows": rows}
+
+
 @app.get("/calc/coverage")
 def calc_coverage(
     only_deficit: bool = Query(True),
-    mode: str = Query("sum"),  # "sum" | "max_per_lab"
+    mode: str = Query("sum"),  # "sum" | "max_per_lab" | "peak"
+    by_lab: bool = Query(False, description="Добавить к каждой позиции требования по лабораториям (labs)"),
+    sort: str = SORT_QUERY,
+    q: Optional[str] = NAME_FILTER_QUERY,
+    top: Optional[int] = TOP_QUERY,
+    limit: Optional[int] = LIMIT_QUERY,
+    cursor: Optional[str] = CURSOR_QUERY,
     db: Session = Depends(get_db),
 ):
+    # Проверка synonyms.csv — один stat(); если файл поменялся, пересчёт канона уйдёт в фон
+    SYNONYMS.version()
+
+    # один запрос: канон посчитан при импорте (canonical_name), сводка/дефицит/фильтры/сортировка/страница — в БД
     try:
-        from .normalize_items import load_synonyms, canonicalize
-        syn = load_synonyms()
-        def canon(x: str) -> str:
-            return canonicalize(x, syn)
-    except Exception:
-        syn = {}
-        def canon(x: str) -> str:
-            return str(x).strip()
-
-    # --- inventory: сколько есть (по всем локациям) ---
-    inv_rows = (
-        db.query(
-            Item.name.label("item_name"),
-            func.sum(Inventory.qty_available).label("qty_available"),
+        return _coverage_result(
+            "items", db, only_deficit=only_deficit, mode=mode, by_lab=by_lab,
+            sort=sort, q=q, top=top, limit=limit, cursor=cursor,
         )
-        .join(Inventory, Inventory.item_id == Item.id)
-        .group_by(Item.name)
-        .all()
-    )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    inv_map: dict[str, int] = {}
-    for r in inv_rows:
-        c = canon(r.item_name)
-        inv_map[c] = inv_map.get(c, 0) + int(r.qty_available or 0)
 
-    # --- requirements: сколько надо ---
-    req_map: dict[str, int] = {}
+class CoverageScenario(BaseModel):
+    name: Optional[str] = None
+    students_factor: float = Field(1.0, gt=0, le=10)
+    labs: Optional[list[str]] = Field(None, description="Только эти лаборатории (по умолчанию — все)")
+    disciplines: Optional[list[str]] = Field(None, description="Только эти дисциплины (по умолчанию — все)")
+    mode: Optional[Literal["sum", "max_per_lab"]] = None
 
-    if mode == "sum":
-        req_rows = (
-            db.query(
-                Requirement.item_name.label("item_name"),
-                func.sum(Requirement.qty_required).label("qty_required"),
-            )
-            .group_by(Requirement.item_name)
-            .all()
-        )
-        for r in req_rows:
-            c = canon(r.item_name)
-            req_map[c] = req_map.get(c, 0) + int(r.qty_required or 0)
 
-    elif mode == "max_per_lab":
-        # Берём MAX по каждой лаборатории для каждой позиции
-        req_rows = (
-            db.query(
-                Requirement.lab.label("lab"),
-                Requirement.item_name.label("item_name"),
-                func.max(Requirement.qty_required).label("qty_required"),
-            )
-            .group_by(Requirement.lab, Requirement.item_name)
-            .all()
-        )
-        # Потом суммируем по lab’ам (разные lab → разные комплекты оборудования)
-        for r in req_rows:
-            c = canon(r.item_name)
-            req_map[c] = req_map.get(c, 0) + int(r.qty_required or 0)
+class ScenarioBatch(BaseModel):
+    kind: Literal["items", "software"] = "items"
+    top: int = Field(10, ge=0, le=1000, description="Сколько самых дефицитных позиций вернуть по каждому сценарию")
+    scenarios: list[CoverageScenario] = Field(..., min_length=1, max_length=1000)
 
-    else:
-        raise HTTPException(status_code=400, detail="mode must be 'sum' or 'max_per_lab'")
-
-    # --- собираем результат ---
-    rows = []
-    for item_name, qty_required in req_map.items():
-        qty_available = inv_map.get(item_name, 0)
-        deficit = max(0, qty_required - qty_available)
-        if only_deficit and deficit == 0:
-            continue
-        rows.append(
-            {
-                "item_name": item_name,
-                "qty_required": qty_required,
-                "qty_available": qty_available,
-                "deficit": deficit,
-            }
-        )
 
-    rows.sort(key=lambda x: (-x["deficit"], x["item_name"]))
-    return {"only_deficit": only_deficit, "mode": mode, "rows": rows}
+@app.post("/calc/coverage/scenarios")
+def calc_coverage_scenarios(batch: ScenarioBatch, db: Session = Depends(get_db)):
+    """
+    What-if: покрытие для пакета сценариев (коэффициент студентов, набор лабораторий/дисциплин, режим)
+    за один проход по матрицам требований и наличия — 100 сценариев стоят примерно как один.
+    """
+    default_mode = "sum" if batch.kind == "items" else "max_per_lab"
+    items = [{**s.model_dump(), "mode": s.mode or default_mode} for s in batch.scenarios]
+    return scenarios.evaluate(db, batch.kind, items, top=batch.top)
+
+
+@app.get("/calc/allocation")
+def calc_allocation(
+    mode: str = Query("max_per_lab"),  # "sum" | "max_per_lab" | "peak"
+    db: Session = Depends(get_db),
+):
+    """
+    Покрытие с учётом мест: инвентарь каждой локации распределяется по лабораториям
+    (сначала своя аудитория, затем корпус, затем весь вуз) — дефициты по лабораториям
+    и предлагаемые перемещения. Места лабораторий — /import/lab-locations-from-path.
+    """
+    if mode not in coverage.MODES:
+        raise HTTPException(status_code=400, detail="mode must be 'sum', 'max_per_lab' or 'peak'")
+    return allocation.allocate(db, mode=mode)
+
+
+@app.post("/calc/coverage/rebuild")
+def rebuild_coverage(background: bool = BACKGROUND_QUERY, db: Session = Depends(get_db)):
+    """Полная пересборка агрегатов покрытия (coverage_*) — для восстановления."""
+    if background:
+        return _submitted(jobs.submit("coverage_rebuild", coverage.rebuild))
+
+    stats = coverage.rebuild(db)
+    db.commit()
+    return {"ok": True, **stats}
 
 
 @app.get("/stats")
@@ -326,46 +576,88 @@ def stats(db: Session = Depends(get_db)):
     }
 
 
+def _coverage_report(kind: str, mode: str, only_deficit: bool, fmt: str, request: Request) -> Response:
+    if mode not in coverage.MODES:
+        raise HTTPException(status_code=400, detail="mode must be 'sum', 'max_per_lab' or 'peak'")
+    filename, _ = reports.REPORTS[kind]
+    body, media_type = reports.FORMATS[fmt]
+
+    # готовый файл текущего поколения (собирается после каждого импорта): отдаётся с диска как есть,
+    # с Content-Length, ETag = sha256 содержимого и поддержкой Range; CSV — сразу в сжатом варианте
+    artifact = artifacts.lookup(
+        kind, fmt, mode=mode, only_deficit=only_deficit,
+        encoding=negotiate(request.headers.get("accept-encoding")),
+    )
+    if artifact is not None:
+        path, etag, encoding = artifact
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        return FileResponse(path, media_type=media_type, filename=f"{filename}.{fmt}", headers=headers)
+
+    # строки идут из серверного курсора пачками: память не зависит от размера отчёта,
+    # первые байты (BOM и заголовок CSV, служебные части XLSX) уходят сразу
+    return StreamingResponse(
+        body(kind, mode=mode, only_deficit=only_deficit),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
+
+
 @app.get("/reports/procurement.csv")
 def report_procurement_csv(
-    mode: str = Query("max_per_lab"),          # "sum" | "max_per_lab"
+    request: Request,
+    mode: str = Query("max_per_lab"),          # "sum" | "max_per_lab" | "peak"
+    only_deficit: bool = Query(True),
+):
+    return _coverage_report("items", mode, only_deficit, "csv", request)
+
+
+@app.get("/reports/procurement.xlsx")
+def report_procurement_xlsx(
+    request: Request,
+    mode: str = Query("max_per_lab"),          # "sum" | "max_per_lab" | "peak"
     only_deficit: bool = Query(True),
+):
+    return _coverage_report("items", mode, only_deficit, "xlsx", request)
+
+
+@app.get("/reports/artifacts")
+def report_artifacts():
+    """Состояние готовых файлов отчётов: поколение данных, время и длительность последней сборки, ошибка."""
+    return artifacts.STATUS
+
+
+@app.get("/reports/procurement-priced")
+def report_procurement_priced(
+    mode: str = Query("max_per_lab"),          # "sum" | "max_per_lab" | "peak"
     db: Session = Depends(get_db),
 ):
-    # Используем уже готовую логику расчёта (тот же JSON, только в CSV)
-    result = calc_coverage(only_deficit=only_deficit, mode=mode, db=db)
-    rows = result["rows"]
-
-    buf = io.StringIO()
-    # BOM для Excel на Windows
-    buf.write("\ufeff")
-
-    writer = csv.writer(buf)
-    writer.writerow(["item_name", "qty_required", "qty_available", "deficit", "mode"])
-    for r in rows:
-        writer.writerow([
-            r["item_name"],
-            r["qty_required"],
-            r["qty_available"],
-            r["deficit"],
-            mode,
-        ])
-
-    data = buf.getvalue()
-    headers = {
-        "Content-Disposition": 'attachment; filename="procurement_plan.csv"'
-    }
-    return StreamingResponse(iter([data]), media_type="text/csv; charset=utf-8", headers=headers)
+    """
+    Дефициты оборудования с самым дешёвым текущим предложением продавцов (по каноническому названию):
+    цена, стоимость строки и итоговый бюджет. Предложения — /import/offers-from-path.
+    """
+    if mode not in coverage.MODES:
+        raise HTTPException(status_code=400, detail="mode must be 'sum', 'max_per_lab' or 'peak'")
+    return reports.procurement_priced(db, mode=mode)
 
 
 @app.post("/import/software-inventory-from-path")
 def import_software_inventory_from_path(
     rel_path: str = Query(...),
+    background: bool = BACKGROUND_QUERY,
     db: Session = Depends(get_db),
 ):
-    path = Path("/app/data") / rel_path
-    df = pd.read_csv(path, encoding="utf-8-sig")
-    result = ingest_software_inventory_df(db, df)
+    target = _data_file(rel_path)
+
+    if background:
+        job = jobs.submit("software_inventory", importers.import_software_inventory, target, params={"path": rel_path})
+        return _submitted(job)
+
+    result = importers.import_software_inventory(db, target)
     db.commit()
     return {"ok": True, "path": rel_path, **result}
 
@@ -374,106 +666,136 @@ def import_software_inventory_from_path(
 def import_software_requirements_from_path(
     rel_path: str = Query(...),
     replace: bool = Query(False),
+    background: bool = BACKGROUND_QUERY,
     db: Session = Depends(get_db),
 ):
-    path = Path("/app/data") / rel_path
-    df = pd.read_csv(path, encoding="utf-8-sig")
-    result = ingest_software_requirements_df(db, df, replace=replace)
+    target = _data_file(rel_path)
+
+    if background:
+        job = jobs.submit(
+            "software_requirements", importers.import_software_requirements, target,
+            replace=replace,
+            params={"path": rel_path, "replace": replace},
+        )
+        return _submitted(job)
+
+    result = importers.import_software_requirements(db, target, replace=replace)
     db.commit()
     return {"ok": True, "path": rel_path, **result}
 
 
-@app.get("/calc/software-coverage")
-def calc_software_coverage(
-    only_deficit: bool = Query(True),
-    mode: str = Query("max_per_lab"),  # "sum" | "max_per_lab"
+@app.post("/import/lab-locations-from-path")
+def import_lab_locations_from_path(
+    rel_path: str = Query(...),
+    replace: bool = Query(False, description="Если true — заменяет все привязки лабораторий"),
+    background: bool = BACKGROUND_QUERY,
     db: Session = Depends(get_db),
 ):
-    # inventory: суммарно по всем локациям
-    inv_rows = (
-        db.query(
-            SoftwareInventory.software_name.label("software_name"),
-            func.sum(SoftwareInventory.seats_available).label("seats_available"),
+    """CSV/Parquet с колонками lab, location ("адрес | аудитория" как в locations или только адрес)."""
+    target = _data_file(rel_path)
+
+    if background:
+        job = jobs.submit(
+            "lab_locations", importers.import_lab_locations, target,
+            replace=replace,
+            params={"path": rel_path, "replace": replace},
         )
-        .group_by(SoftwareInventory.software_name)
-        .all()
-    )
-    inv_map = {r.software_name: int(r.seats_available or 0) for r in inv_rows}
+        return _submitted(job)
 
-    req_map = {}
+    result = importers.import_lab_locations(db, target, replace=replace)
+    db.commit()
+    return {"ok": True, "path": rel_path, **result}
 
-    if mode == "sum":
-        req_rows = (
-            db.query(
-                SoftwareRequirement.software_name.label("software_name"),
-                func.sum(SoftwareRequirement.seats_required).label("seats_required"),
-            )
-            .group_by(SoftwareRequirement.software_name)
-            .all()
+
+@app.post("/import/offers-from-path")
+def import_offers_from_path(
+    rel_path: str = Query("sellers/data_sellers.csv"),
+    replace: bool = Query(False, description="Если true — удаляет и предложения по запросам, которых нет в файле"),
+    background: bool = BACKGROUND_QUERY,
+    db: Session = Depends(get_db),
+):
+    """
+    Предложения продавцов из выгрузки parser_unified (search_query;number;brand;name;price;link;marketplace).
+    По каждому запросу берётся последняя выгрузка; запрос канонизируется как название позиции.
+    """
+    target = _data_file(rel_path)
+
+    if background:
+        job = jobs.submit(
+            "offers", importers.import_offers, target,
+            replace=replace,
+            params={"path": rel_path, "replace": replace},
         )
-        for r in req_rows:
-            req_map[r.software_name] = int(r.seats_required or 0)
+        return _submitted(job)
 
-    elif mode == "max_per_lab":
-        req_rows = (
-            db.query(
-                SoftwareRequirement.lab.label("lab"),
-                SoftwareRequirement.software_name.label("software_name"),
-                func.max(SoftwareRequirement.seats_required).label("seats_required"),
-            )
-            .group_by(SoftwareRequirement.lab, SoftwareRequirement.software_name)
-            .all()
+    result = importers.import_offers(db, target, replace=replace)
+    db.commit()
+    return {"ok": True, "path": rel_path, **result}
+
+
+@app.post("/import/timetable-from-path")
+def import_timetable_from_path(
+    rel_path: str = Query(...),
+    replace: bool = Query(False, description="Если true — заменяет расписание целиком"),
+    background: bool = BACKGROUND_QUERY,
+    db: Session = Depends(get_db),
+):
+    """Расписание для mode=peak: колонки discipline, lab, weekday (1..7 или пн..вс), start, end (ЧЧ:ММ)."""
+    target = _data_file(rel_path)
+
+    if background:
+        job = jobs.submit(
+            "timetable", importers.import_timetable, target,
+            replace=replace,
+            params={"path": rel_path, "replace": replace},
         )
-        # суммируем по лабораториям (каждая лаба требует свой комплект ПО)
-        for r in req_rows:
-            req_map[r.software_name] = req_map.get(r.software_name, 0) + int(r.seats_required or 0)
-    else:
-        return {"ok": False, "error": "mode must be 'sum' or 'max_per_lab'"}
+        return _submitted(job)
 
-    rows = []
-    for sw, need in req_map.items():
-        have = inv_map.get(sw, 0)
-        deficit = max(0, need - have)
-        if only_deficit and deficit == 0:
-            continue
-        rows.append({
-            "software_name": sw,
-            "seats_required": need,
-            "seats_available": have,
-            "deficit": deficit,
-        })
+    result = importers.import_timetable(db, target, replace=replace)
+    db.commit()
+    return {"ok": True, "path": rel_path, **result}
 
-    rows.sort(key=lambda x: (-x["deficit"], x["software_name"]))
-    return {"only_deficit": only_deficit, "mode": mode, "rows": rows}
+
+@app.get("/calc/software-coverage")
+def calc_software_coverage(
+    only_deficit: bool = Query(True),
+    mode: str = Query("max_per_lab"),  # "sum" | "max_per_lab" | "peak"
+    by_lab: bool = Query(False, description="Добавить к каждой позиции требования по лабораториям (labs)"),
+    sort: str = SORT_QUERY,
+    q: Optional[str] = NAME_FILTER_QUERY,
+    top: Optional[int] = TOP_QUERY,
+    limit: Optional[int] = LIMIT_QUERY,
+    cursor: Optional[str] = CURSOR_QUERY,
+    db: Session = Depends(get_db),
+):
+    try:
+        return _coverage_result(
+            "software", db, only_deficit=only_deficit, mode=mode, by_lab=by_lab,
+            sort=sort, q=q, top=top, limit=limit, cursor=cursor,
+        )
+    except ValueError as e:
+        if limit is not None or cursor:
+            # постраничная выдача — новый API: ошибки (в т.ч. курсор от других фильтров) — 400, как в /calc/coverage
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"ok": False, "error": str(e)}
 
 
 @app.get("/reports/software_coverage.csv")
 def report_software_coverage_csv(
-    mode: str = Query("max_per_lab"),          # "sum" | "max_per_lab"
+    request: Request,
+    mode: str = Query("max_per_lab"),          # "sum" | "max_per_lab" | "peak"
     only_deficit: bool = Query(True),
-    db: Session = Depends(get_db),
 ):
-    result = calc_software_coverage(only_deficit=only_deficit, mode=mode, db=db)
-    rows = result["rows"]
-
-    buf = io.StringIO()
-    # BOM чтобы Excel на Windows нормально открыл UTF-8
-    buf.write("\ufeff")
+    return _coverage_report("software", mode, only_deficit, "csv", request)
 
-    w = csv.writer(buf)
-    w.writerow(["software_name", "seats_required", "seats_available", "deficit", "mode"])
-    for r in rows:
-        w.writerow([
-            r["software_name"],
-            r["seats_required"],
-            r["seats_available"],
-            r["deficit"],
-            mode,
-        ])
 
-    data = buf.getvalue()
-    headers = {"Content-Disposition": 'attachment; filename="software_coverage.csv"'}
-    return StreamingResponse(iter([data]), media_type="text/csv; charset=utf-8", headers=headers)
+@app.get("/reports/software_coverage.xlsx")
+def report_software_coverage_xlsx(
+    request: Request,
+    mode: str = Query("max_per_lab"),          # "sum" | "max_per_lab" | "peak"
+    only_deficit: bool = Query(True),
+):
+    return _coverage_report("software", mode, only_deficit, "xlsx", request)
 
 
 def _ollama_generate(prompt: str) -> str:
@@ -507,11 +829,11 @@ def ai_report_explain(
     students_factor: float = Query(1.0, ge=0.5, le=3.0),
     db: Session = Depends(get_db),
 ):
-    eq = calc_coverage(only_deficit=False, mode=mode, db=db)
+    eq = calc_coverage(only_deficit=False, mode=mode, by_lab=False, **ALL_ROWS, db=db)
 
     sw = None
     if include_software:
-        sw = calc_software_coverage(only_deficit=False, mode=mode, db=db)
+        sw = calc_software_coverage(only_deficit=False, mode=mode, by_lab=False, **ALL_ROWS, db=db)
 
     payload = {
         "generated_at": datetime.now().isoformat(timespec="seconds"),
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+
+# Естественные ключи, появившиеся после первых версий схемы:
+# (таблица, имя ограничения, колонки ключа, количество, DDL ограничения)
+_NATURAL_KEYS = [
+    (
+        "requirements",
+        "uq_requirements_natural_key",
+        ("discipline", "lab", "item_name"),
+        "qty_required",
+        "UNIQUE NULLS NOT DISTINCT (discipline, lab, item_name)",
+    ),
+    (
+        "software_requirements",
+        "uq_software_requirements_natural_key",
+        ("discipline", "lab", "software_name"),
+        "seats_required",
+        "UNIQUE (discipline, lab, software_name)",
+    ),
+]
+
+# Колонки, добавленные в уже существующие таблицы: (таблица, колонка, тип, нужен ли индекс)
+_NEW_COLUMNS = [
+    ("items", "canonical_name", "VARCHAR", True),
+    ("requirements", "canonical_name", "VARCHAR", True),
+    # заполняются пересборкой агрегатов (coverage.AGGREGATES_VERSION)
+    ("coverage_required", "qty_peak", "BIGINT NOT NULL DEFAULT 0", False),
+    ("coverage_required_lab", "qty_peak", "BIGINT NOT NULL DEFAULT 0", False),
+]
+
+# Индексы на уже существующих таблицах: (имя, "таблица (выражения)")
+_NEW_INDEXES = [
+    ("ix_coverage_required_kind_name_c", 'coverage_required (kind, name COLLATE "C")'),
+    ("ix_inventory_location_id", "inventory (location_id)"),
+    ("ix_requirements_keyset", "requirements ((discipline IS NULL), COALESCE(discipline, ''), item_name, id)"),
+]
+
+# Индексы, заменённые другими
+_DROPPED_INDEXES = ["ix_inventory_location_item"]
+
+
+def _add_column(conn, table: str, column: str, type_: str, indexed: bool) -> None:
+    # новые колонки заполняются в фоне (canon.recanonicalize, coverage.rebuild), тут только DDL
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {type_}"))
+    if indexed:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})"))
+
+
+def _add_natural_key(conn, table: str, name: str, cols: tuple[str, ...], qty: str, ddl: str) -> None:
+    existing = {uc["name"] for uc in inspect(conn).get_unique_constraints(table)}
+    if name in existing:
+        return
+
+    # дубли от прошлых импортов без ключа суммируются в самую свежую строку —
+    # как дубли ключа внутри файла при импорте (и как их раньше складывало покрытие)
+    key = ", ".join(cols)
+    conn.execute(text(f"""
+        WITH dup AS (
+            SELECT MAX(id) AS keep_id, SUM({qty}) AS total
+            FROM {table} GROUP BY {key} HAVING COUNT(*) > 1
+        )
+        UPDATE {table} t SET {qty} = dup.total FROM dup WHERE t.id = dup.keep_id
+    """))
+    conn.execute(text(f"""
+        DELETE FROM {table}
+        WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {key})
+    """))
+    conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {name} {ddl}"))
+
+
+def upgrade(engine: Engine) -> None:
+    """
+    Доводит уже существующую БД до текущих моделей там, где create_all бессилен
+    (новые колонки и ограничения на старых таблицах). Все шаги идемпотентны.
+    """
+    with engine.begin() as conn:
+        for table, column, type_, indexed in _NEW_COLUMNS:
+            _add_column(conn, table, column, type_, indexed)
+        for table, name, cols, qty, ddl in _NATURAL_KEYS:
+            _add_natural_key(conn, table, name, cols, qty, ddl)
+        for name, target in _NEW_INDEXES:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {target}"))
+        for name in _DROPPED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, Numeric, String, ForeignKey, Time, UniqueConstraint, func, text
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -7,6 +7,8 @@ class Item(Base):
     __tablename__ = "items"
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False, index=True)
+    # результат normalize_items.canonicalize на момент импорта (пересчёт — canon.recanonicalize)
+    canonical_name = Column(String, nullable=True, index=True)
 
 class Location(Base):
     __tablename__ = "locations"
@@ -25,6 +27,10 @@ class Inventory(Base):
 
     __table_args__ = (
         UniqueConstraint("item_id", "location_id", name="uq_inventory_item_location"),
+        # keyset /inventory по (locations.name, items.name): локации идут по ix_locations_name от курсора,
+        # их строки инвентаря — по этому индексу, сортировка по позиции — внутри локации (incremental sort).
+        # uq_inventory_item_location начинается с item_id и для этого не годится
+        Index("ix_inventory_location_id", "location_id"),
     )
 
 class Requirement(Base):
@@ -39,8 +45,24 @@ class Requirement(Base):
     lab = Column(String, nullable=True, index=True)         # например: "Компьютерный класс 201В"
 
     item_name = Column(String, nullable=False, index=True)
+    canonical_name = Column(String, nullable=True, index=True)
     qty_required = Column(Integer, nullable=False, default=0)
 
+    # естественный ключ: повторный импорт того же плана обновляет строки, а не дублирует их
+    # (NULLS NOT DISTINCT — пустые discipline/lab тоже считаются одним значением)
+    __table_args__ = (
+        UniqueConstraint(
+            "discipline", "lab", "item_name",
+            name="uq_requirements_natural_key",
+            postgresql_nulls_not_distinct=True,
+        ),
+        # ключ постраничной выдачи /requirements: discipline (пустые — в конце), item_name, id
+        Index(
+            "ix_requirements_keyset",
+            text("(discipline IS NULL)"), text("COALESCE(discipline, '')"), "item_name", "id",
+        ),
+    )
+
 class SoftwareRequirement(Base):
     __tablename__ = "software_requirements"
 
@@ -50,10 +72,137 @@ class SoftwareRequirement(Base):
     discipline = Column(String, nullable=False)
     lab = Column(String, nullable=False)
 
+    __table_args__ = (
+        UniqueConstraint("discipline", "lab", "software_name", name="uq_software_requirements_natural_key"),
+    )
+
 class SoftwareInventory(Base):
     __tablename__ = "software_inventory"
 
     id = Column(Integer, primary_key=True)
     software_name = Column(String, nullable=False)
     seats_available = Column(Integer, nullable=False)
-    location = Column(String, nullable=False)
\ No newline at end of file
+    location = Column(String, nullable=False)
+
+class ImportManifest(Base):
+    """
+    Отпечаток последнего инкрементального импорта файла:
+    хэш содержимого целиком + хэши строк (import_manifest_rows).
+    """
+    __tablename__ = "import_manifests"
+
+    id = Column(Integer, primary_key=True)
+    source = Column(String, unique=True, nullable=False)  # например "inventory:processed/inventory.csv"
+    file_hash = Column(String(64), nullable=False)         # sha256 содержимого файла
+    rows = Column(Integer, nullable=False, default=0)
+    imported_at = Column(DateTime, nullable=False, server_default=func.now())
+
+class ImportManifestRow(Base):
+    __tablename__ = "import_manifest_rows"
+
+    manifest_id = Column(Integer, ForeignKey("import_manifests.id", ondelete="CASCADE"), primary_key=True)
+    item_id = Column(Integer, ForeignKey("items.id", ondelete="CASCADE"), primary_key=True)
+    location_id = Column(Integer, ForeignKey("locations.id", ondelete="CASCADE"), primary_key=True)
+    row_hash = Column(BigInteger, nullable=False)
+
+class AppState(Base):
+    """Служебные значения приложения: ключ -> значение (например, версия правил канонизации)."""
+    __tablename__ = "app_state"
+
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+
+class CoverageAvailable(Base):
+    """
+    Агрегаты покрытия (поддерживаются импортами, см. coverage.refresh):
+    сколько есть по каноническому названию. kind — items | software.
+    """
+    __tablename__ = "coverage_available"
+
+    kind = Column(String, primary_key=True)
+    name = Column(String, primary_key=True)
+    qty = Column(BigInteger, nullable=False, default=0)
+
+class CoverageRequired(Base):
+    """Сколько надо по каноническому названию — сразу для обоих режимов расчёта."""
+    __tablename__ = "coverage_required"
+
+    kind = Column(String, primary_key=True)
+    name = Column(String, primary_key=True)
+    qty_sum = Column(BigInteger, nullable=False, default=0)
+    qty_max_per_lab = Column(BigInteger, nullable=False, default=0)
+    # пик одновременной потребности по расписанию (mode=peak)
+    qty_peak = Column(BigInteger, nullable=False, default=0)
+
+    # страницы /calc/coverage?sort=name идут по этому индексу (порядок — по кодовым точкам)
+    __table_args__ = (
+        Index("ix_coverage_required_kind_name_c", "kind", text('name COLLATE "C"')),
+    )
+
+class CoverageRequiredLab(Base):
+    """То же в разрезе лабораторий (для by_lab); lab может быть пустым."""
+    __tablename__ = "coverage_required_lab"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    lab = Column(String, nullable=True)
+    qty_sum = Column(BigInteger, nullable=False, default=0)
+    qty_max_per_lab = Column(BigInteger, nullable=False, default=0)
+    qty_peak = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("kind", "name", "lab", name="uq_coverage_required_lab", postgresql_nulls_not_distinct=True),
+    )
+
+class LabLocation(Base):
+    """
+    Где находится лаборатория из требований: location — как в locations.name ("адрес | аудитория")
+    или только адрес (корпус). Нужно для распределения инвентаря по местам (allocation).
+    """
+    __tablename__ = "lab_locations"
+
+    lab = Column(String, primary_key=True)
+    location = Column(String, nullable=False)
+
+class Timetable(Base):
+    """
+    Расписание (необязательно): когда дисциплина занимает лабораторию.
+    weekday — 1 (пн) .. 7 (вс). Нужно для mode=peak.
+    """
+    __tablename__ = "timetable"
+
+    id = Column(Integer, primary_key=True)
+    discipline = Column(String, nullable=False)
+    lab = Column(String, nullable=False)
+    weekday = Column(Integer, nullable=False)
+    starts_at = Column(Time, nullable=False)
+    ends_at = Column(Time, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("discipline", "lab", "weekday", "starts_at", name="uq_timetable_natural_key"),
+        Index("ix_timetable_discipline_lab", "discipline", "lab"),
+    )
+
+class Offer(Base):
+    """
+    Предложения продавцов (parser_unified -> data/sellers/data_sellers.csv): по каждому поисковому
+    запросу — только последняя выгрузка. canonical_name — канон запроса (как у requirements),
+    по нему план закупки находит самое дешёвое предложение.
+    """
+    __tablename__ = "offers"
+
+    id = Column(Integer, primary_key=True)
+    search_query = Column(String, nullable=False, index=True)
+    canonical_name = Column(String, nullable=True)
+    number = Column(Integer, nullable=True)
+    brand = Column(String, nullable=True)
+    name = Column(String, nullable=True)
+    price = Column(Numeric(14, 2), nullable=False)
+    link = Column(String, nullable=True)
+    marketplace = Column(String, nullable=True)
+
+    __table_args__ = (
+        # самое дешёвое предложение по канону — первая запись индекса
+        Index("ix_offers_canonical_price", "canonical_name", "price"),
+    )
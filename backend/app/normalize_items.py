@@ -1,6 +1,13 @@
 from __future__ import annotations
 
+import hashlib
+import io
+import threading
+import time
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType
+from typing import Callable, Iterable, Mapping, Optional
 import pandas as pd
 import re
 
@@ -11,21 +18,20 @@ _SYN_CANDIDATES = [
     Path(__file__).resolve().parents[2] / "data" / "processed" / "synonyms.csv",  # запуск из backend/app
 ]
 
+# Версия правил canonicalize: увеличить при любом изменении логики ниже —
+# сохранённые canonical_name в БД будут пересчитаны (см. canon.recanonicalize)
+RULES_VERSION = 1
 
-def _norm(s: str) -> str:
-    return re.sub(r"\s+", " ", str(s).strip()).lower()
 
+_WS_RE = re.compile(r"\s+")
 
-def load_synonyms() -> dict[str, str]:
-    """
-    Загружает mapping variant->canonical из CSV.
-    variant/canonical сравниваем в нижнем регистре.
-    """
-    syn_path = next((p for p in _SYN_CANDIDATES if p.exists()), None)
-    if syn_path is None:
-        return {}
 
-    df = pd.read_csv(syn_path, encoding="utf-8-sig")
+def _norm(s: str) -> str:
+    return _WS_RE.sub(" ", str(s).strip()).lower()
+
+
+def _parse_synonyms(data: bytes) -> dict[str, str]:
+    df = pd.read_csv(io.BytesIO(data), encoding="utf-8-sig")
     if "variant" not in df.columns or "canonical" not in df.columns:
         return {}
 
@@ -38,7 +44,180 @@ def load_synonyms() -> dict[str, str]:
     return m
 
 
-def canonicalize(name: str, syn: dict[str, str]) -> str:
+class SynonymStore:
+    """
+    Словарь synonyms.csv на весь процесс. Файл перечитывается, только если поменялись
+    путь, mtime или размер; если при этом не поменялся и sha256 содержимого — словарь не пересобирается.
+    Отдаётся неизменяемый mapping, поэтому его можно делить между потоками без копий.
+    on_change(fn) — fn(version) вызывается после перезагрузки с новым содержимым.
+    """
+
+    def __init__(self, candidates: list[Path]):
+        self._candidates = candidates
+        self._lock = threading.Lock()
+        self._stamp: Optional[tuple] = None     # (путь, mtime_ns, размер) последней проверки
+        self._digest: Optional[str] = None      # sha256 загруженного содержимого
+        self._syn: Mapping[str, str] = MappingProxyType({})
+        self._listeners: list[Callable[[str], None]] = []
+        self.path: Optional[Path] = None
+        self.loaded_at: Optional[float] = None
+        self.hits = 0        # файл не менялся — отдали кэш
+        self.reloads = 0     # перечитали и пересобрали словарь
+        self.unchanged = 0   # mtime поменялся, а содержимое — нет
+
+    def on_change(self, fn: Callable[[str], None]) -> None:
+        if fn not in self._listeners:
+            self._listeners.append(fn)
+
+    def _stat(self) -> Optional[tuple]:
+        for p in self._candidates:
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            return (p, st.st_mtime_ns, st.st_size)
+        return None
+
+    def _refresh(self) -> tuple[Mapping[str, str], str]:
+        stamp = self._stat()
+        changed = False
+        with self._lock:
+            if stamp is not None and stamp == self._stamp:
+                self.hits += 1
+            elif stamp is None:
+                changed = self._digest is not None
+                self._stamp, self._digest, self.path = None, None, None
+                self._syn = MappingProxyType({})
+                if changed:
+                    self.reloads += 1
+            else:
+                data = stamp[0].read_bytes()
+                digest = hashlib.sha256(data).hexdigest()
+                if digest == self._digest:
+                    self.unchanged += 1
+                else:
+                    changed = self._digest is not None
+                    self._syn = MappingProxyType(_parse_synonyms(data))
+                    self._digest = digest
+                    self.loaded_at = time.time()
+                    self.reloads += 1
+                self._stamp, self.path = stamp, stamp[0]
+            syn, version = self._syn, self._version()
+
+        if changed:
+            for fn in self._listeners:
+                fn(version)
+        return syn, version
+
+    def _version(self) -> str:
+        return f"{RULES_VERSION}:{self._digest[:12] if self._digest else 'none'}"
+
+    def get(self) -> Mapping[str, str]:
+        return self._refresh()[0]
+
+    def version(self) -> str:
+        return self._refresh()[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "path": str(self.path) if self.path else None,
+                "version": self._version(),
+                "entries": len(self._syn),
+                "loaded_at": self.loaded_at,
+                "hits": self.hits,
+                "reloads": self.reloads,
+                "unchanged": self.unchanged,
+            }
+
+
+SYNONYMS = SynonymStore(_SYN_CANDIDATES)
+
+
+def ruleset_version() -> str:
+    """Версия набора правил: RULES_VERSION + хэш содержимого synonyms.csv."""
+    return SYNONYMS.version()
+
+
+def load_synonyms() -> Mapping[str, str]:
+    """
+    mapping variant->canonical из synonyms.csv (variant в нижнем регистре).
+    Берётся из SYNONYMS: файл читается заново, только если он поменялся.
+    """
+    return SYNONYMS.get()
+
+
+# -------- предкомпилированные регулярки canonicalize --------
+_QUOTES_RE = re.compile(r'"+')
+_SEP_RE = re.compile(r"\s*[,;]\s*")
+_DOT_RE = re.compile(r"\s*\.\s*")
+_PAREN_RE = re.compile(r"\([^)]*\)")
+
+_PROJ_FOR_RE = re.compile(r"\b(для|к)\s+проектор[ауео]?\b")
+_PROJ_ACCESSORY_RE = re.compile(r"\b(экран|полотно|креплен|кронштейн|штатив|столик)\b")
+_BRAND_FIXES = [
+    (re.compile(r"\bpanasonik\b", re.IGNORECASE), "panasonic"),
+    (re.compile(r"\bsanio\b", re.IGNORECASE), "sanyo"),
+]
+_PROJ_TAIL_RE = re.compile(
+    r"(?:мультимед\.\s*)?(?:мультимедийный\s*)?(?:видео\s*)?(?:видеопроектор|проектор)\s*(.*)$",
+    re.IGNORECASE,
+)
+_TAIL_PREFIX_RE = re.compile(r"^(?:мультимед\.\s*|мультимедийный\s*)+", re.IGNORECASE)
+# шаблон перенесён как был (\\1 в raw-строке — буквальный "\1"), чтобы результаты не поменялись
+_DUP_BRAND_RE = re.compile(r"^(panasonic|epson|sanyo|sony|benq|nec|acer|jvc)\s+\\1\\b", re.IGNORECASE)
+# лёгкая капитализация брендов (модель оставляем как есть) — один проход вместо замены по каждому бренду
+_BRAND_CASE = {
+    "panasonic": "Panasonic",
+    "epson": "Epson",
+    "sanyo": "SANYO",
+    "sony": "Sony",
+    "benq": "BenQ",
+    "nec": "NEC",
+    "acer": "Acer",
+    "jvc": "JVC",
+}
+_BRAND_CASE_RE = re.compile(r"\b(" + "|".join(_BRAND_CASE) + r")\b", re.IGNORECASE)
+
+_FURNITURE = ("мебел", "стол", "стул", "доск")
+
+# Правила по ключевым словам после мебели и проекторов: первое сработавшее выигрывает.
+# Правило — кортеж групп; срабатывает, если из каждой группы в названии есть хотя бы одно слово.
+_KEYWORD_RULES: list[tuple[tuple[tuple[str, ...], ...], str]] = [
+    ((("персональн",), ("компьютер",)), "Персональный компьютер"),
+    ((("компьютер",), ("преподав",)), "Компьютер преподавателя"),
+    ((("ибп",),), "ИБП"),
+    ((("сервер",),), "Сервер учебный"),
+    # СНАЧАЛА коммутаторы (важно: DGS = линейка коммутаторов D-Link)
+    ((("switch", "коммут", "baseline", "dgs"),), "Коммутатор"),
+    # ПОТОМ маршрутизаторы; d-link иногда встречается и как маршрутизатор, и как коммутатор — DGS уже перехватили выше
+    ((("маршрут", "router", "routerboard", "mikrotik", "cisco", "d-link", "dlink"),), "Маршрутизатор"),
+    # патч-корды / кабели / тестеры (если появятся в инвентаре)
+    ((("патч", "patch", "patchcord", "patch-cord"),), "Набор кабелей/патч-кордов"),
+    ((("тестер", "tester"), ("вит", "twisted", "кабель", "cable")), "Тестер витой пары"),
+    # смартфоны
+    ((("iphone", "ios"),), "Смартфон iOS для тестирования"),
+    ((("android",),), "Смартфон Android для тестирования"),
+]
+
+# Все ключевые слова всех правил (вместе с мебелью и проекторами) одной регуляркой:
+# большинство названий не содержит ни одного — для них правила не перебираются вовсе
+_ALL_KEYWORDS = {"комплект", "проектор", *_FURNITURE}
+_ALL_KEYWORDS.update(w for groups, _ in _KEYWORD_RULES for group in groups for w in group)
+_ANY_KEYWORD_RE = re.compile("|".join(re.escape(w) for w in sorted(_ALL_KEYWORDS, key=len, reverse=True)))
+
+# Сколько последних названий помнит каждый CanonEngine
+CANON_CACHE_SIZE = 65_536
+
+
+def _has_any(low: str, words: tuple[str, ...]) -> bool:
+    for w in words:
+        if w in low:
+            return True
+    return False
+
+
+def _canonicalize(name: str, syn: Mapping[str, str]) -> str:
     """
     Приводит название к "каноническому":
     1) сначала пробует synonyms.csv (точное совпадение после нормализации)
@@ -50,115 +229,137 @@ def canonicalize(name: str, syn: dict[str, str]) -> str:
         return raw
 
     # первичная чистка для поискового запроса
-    raw = re.sub(r"\s+", " ", raw.replace("\xa0", " ")).strip()
-    raw = raw.replace("«", '"').replace("»", '"')
-    raw = re.sub(r'"+', '"', raw)
-    raw = re.sub(r"\s*[,;]\s*", ", ", raw)
-    raw = re.sub(r"\s*\.\s*", ". ", raw)
-    raw = re.sub(r"\s+", " ", raw).strip(" ,;.")
-
-    key = _norm(raw)
+    # (каждая замена — только если в строке есть что заменять; результат тот же)
+    raw = _WS_RE.sub(" ", raw.replace("\xa0", " ")).strip()
+    if "«" in raw or "»" in raw:
+        raw = raw.replace("«", '"').replace("»", '"')
+    if '""' in raw:
+        raw = _QUOTES_RE.sub('"', raw)
+    if "," in raw or ";" in raw:
+        raw = _SEP_RE.sub(", ", raw)
+    if "." in raw:
+        raw = _DOT_RE.sub(". ", raw)
+    # пробельные символы тут уже только одиночные пробелы — схлопывать нужно лишь двойные
+    if "  " in raw:
+        raw = _WS_RE.sub(" ", raw)
+    raw = raw.strip(" ,;.")
+
+    # raw уже без крайних и повторных пробелов: _norm(raw) == raw.lower()
+    key = raw.lower()
     if key in syn:
         return syn[key]
 
     # убираем "(...)" в конце/середине (для сопоставления по словарю и общим правилам)
-    no_paren = re.sub(r"\([^)]*\)", "", raw).strip(" ,;.")
-    key2 = _norm(no_paren)
-    if key2 in syn:
-        return syn[key2]
+    if "(" in raw:
+        no_paren = _PAREN_RE.sub("", raw).strip(" ,;.")
+        key2 = _norm(no_paren)
+        if key2 in syn:
+            return syn[key2]
+    else:
+        no_paren, key2 = raw, key
 
     low = key2
+    if not _ANY_KEYWORD_RE.search(low):
+        return no_paren
 
     # -------- мебель --------
-    if ("комплект" in low or low.startswith("мебел")) and ("мебел" in low or "стол" in low or "стул" in low or "доск" in low):
+    if ("комплект" in low or low.startswith("мебел")) and _has_any(low, _FURNITURE):
         # если есть уточнение в скобках — обычно полезно для закупки, оставим тип скобок убранным, но нормализуем название
         return "Комплект учебной мебели"
 
-    # -------- проекторы --------
-    if "проектор" in low or "видеопроектор" in low or "диапроектор" in low:
-        # диапроекторы оставим как отдельный класс (это не мультимедийный проектор)
-        if "диапроектор" in low:
-            # постараемся сохранить модель/бренд если есть
-            return re.sub(r"\s+", " ", raw).strip()
-
-        # аксессуары "для/к проектору" (экран, полотно, столик и т.п.) — это НЕ проектор
-        if re.search(r"\b(для|к)\s+проектор[ауео]?\b", low) or re.search(r"\b(экран|полотно|креплен|кронштейн|штатив|столик)\b", low):
-            return no_paren
-
-        brand_fixes = {
-            "panasonik": "panasonic",
-            "sanio": "sanyo",
-        }
-        raw_fixed = raw
-        for bad, good in brand_fixes.items():
-            raw_fixed = re.sub(rf"\b{re.escape(bad)}\b", good, raw_fixed, flags=re.IGNORECASE)
-
-        # достаём хвост после слова "проектор/видеопроектор" — там обычно бренд/модель
-        m = re.search(
-            r"(?:мультимед\.\s*)?(?:мультимедийный\s*)?(?:видео\s*)?(?:видеопроектор|проектор)\s*(.*)$",
-            raw_fixed,
-            flags=re.IGNORECASE,
-        )
-        tail = (m.group(1) if m else "").strip(" -–—:,.")
-        tail = re.sub(r"^(?:мультимед\.\s*|мультимедийный\s*)+", "", tail, flags=re.IGNORECASE).strip(" -–—:,.")
-
-        # если tail пустой — возвращаем единый канон
-        if not tail:
-            return "Мультимедийный проектор"
-
-        # вычистим дубли типа "Panasonic Panasonic"
-        tail = re.sub(r"\s+", " ", tail)
-        tail = re.sub(r"^(panasonic|epson|sanyo|sony|benq|nec|acer|jvc)\s+\\1\\b", r"\\1", tail, flags=re.IGNORECASE)
-
-        # финальный поисковый запрос: "Мультимедийный проектор <tail>"
-        # но если в tail уже есть "ультракороткофокусный" / "короткофокусный" — сохраняем
-        pretty_tail = tail
-        # лёгкая капитализация брендов (модель оставляем как есть)
-        pretty_tail = re.sub(r"\bpanasonic\b", "Panasonic", pretty_tail, flags=re.IGNORECASE)
-        pretty_tail = re.sub(r"\bepson\b", "Epson", pretty_tail, flags=re.IGNORECASE)
-        pretty_tail = re.sub(r"\bsanyo\b", "SANYO", pretty_tail, flags=re.IGNORECASE)
-        pretty_tail = re.sub(r"\bsony\b", "Sony", pretty_tail, flags=re.IGNORECASE)
-        pretty_tail = re.sub(r"\bbenq\b", "BenQ", pretty_tail, flags=re.IGNORECASE)
-        pretty_tail = re.sub(r"\bnec\b", "NEC", pretty_tail, flags=re.IGNORECASE)
-        pretty_tail = re.sub(r"\bacer\b", "Acer", pretty_tail, flags=re.IGNORECASE)
-        pretty_tail = re.sub(r"\bjvc\b", "JVC", pretty_tail, flags=re.IGNORECASE)
-        return f"Мультимедийный проектор {pretty_tail}".strip()
-
-    if "персональн" in low and "компьютер" in low:
-        return "Персональный компьютер"
-    if "компьютер" in low and "преподав" in low:
-        return "Компьютер преподавателя"
-    if low.startswith("ибп") or "ибп" in low:
-        return "ИБП"
-    if "сервер" in low:
-        return "Сервер учебный"
-
-    # --- СЕТЕВОЕ / КАБЕЛИ ---
-    # 1) СНАЧАЛА коммутаторы (важно: DGS = линейка коммутаторов D-Link)
-    if "switch" in low or "коммут" in low or "baseline" in low:
-        return "Коммутатор"
-    if "dgs" in low:   # D-Link DGS-1100-24 и т.п.
-        return "Коммутатор"
-
-    # 2) ПОТОМ маршрутизаторы
-    if ("маршрут" in low) or ("router" in low) or ("routerboard" in low) or ("mikrotik" in low) or ("cisco" in low):
-        return "Маршрутизатор"
-    # d-link иногда встречается и как маршрутизатор, и как коммутатор — DGS уже перехватили выше
-    if "d-link" in low or "dlink" in low:
-        return "Маршрутизатор"
+    # -------- проекторы (покрывает и видеопроектор/диапроектор) --------
+    if "проектор" in low:
+        return _canonicalize_projector(raw, low, no_paren)
 
-    # патч-корды / кабели / тестеры (если появятся в инвентаре)
-    if "патч" in low or "patch" in low or "patchcord" in low or "patch-cord" in low:
-        return "Набор кабелей/патч-кордов"
+    for groups, canonical in _KEYWORD_RULES:
+        for group in groups:
+            if not _has_any(low, group):
+                break
+        else:
+            return canonical
+
+    return no_paren
+
+
+def _canonicalize_projector(raw: str, low: str, no_paren: str) -> str:
+    # диапроекторы оставим как отдельный класс (это не мультимедийный проектор)
+    if "диапроектор" in low:
+        # постараемся сохранить модель/бренд если есть
+        return _WS_RE.sub(" ", raw).strip()
+
+    # аксессуары "для/к проектору" (экран, полотно, столик и т.п.) — это НЕ проектор
+    if _PROJ_FOR_RE.search(low) or _PROJ_ACCESSORY_RE.search(low):
+        return no_paren
+
+    raw_fixed = raw
+    for bad, good in _BRAND_FIXES:
+        raw_fixed = bad.sub(good, raw_fixed)
+
+    # достаём хвост после слова "проектор/видеопроектор" — там обычно бренд/модель
+    m = _PROJ_TAIL_RE.search(raw_fixed)
+    tail = (m.group(1) if m else "").strip(" -–—:,.")
+    tail = _TAIL_PREFIX_RE.sub("", tail).strip(" -–—:,.")
+
+    # если tail пустой — возвращаем единый канон
+    if not tail:
+        return "Мультимедийный проектор"
+
+    # вычистим дубли типа "Panasonic Panasonic"
+    tail = _WS_RE.sub(" ", tail)
+    tail = _DUP_BRAND_RE.sub(r"\\1", tail)
+
+    # финальный поисковый запрос: "Мультимедийный проектор <tail>"
+    # но если в tail уже есть "ультракороткофокусный" / "короткофокусный" — сохраняем
+    pretty_tail = _BRAND_CASE_RE.sub(lambda b: _BRAND_CASE[b.group(1).lower()], tail)
+    return f"Мультимедийный проектор {pretty_tail}".strip()
 
-    if ("тестер" in low or "tester" in low) and ("вит" in low or "twisted" in low or "кабель" in low or "cable" in low):
-        return "Тестер витой пары"
 
-    # --- СМАРТФОНЫ ---
-    if "iphone" in low or "ios" in low:
-        return "Смартфон iOS для тестирования"
-    if "android" in low:
-        return "Смартфон Android для тестирования"
-    
+class CanonEngine:
+    """
+    canonicalize для одного словаря синонимов с ограниченным LRU name -> канон.
+    Повторяющиеся названия (а в инвентаре их большинство) считаются один раз.
+    """
+
+    def __init__(self, syn: Mapping[str, str], cache_size: int = CANON_CACHE_SIZE):
+        self.syn = syn
+        self._cached = lru_cache(maxsize=cache_size)(self._compute)
+
+    def _compute(self, name: str) -> str:
+        return _canonicalize(name, self.syn)
+
+    def __call__(self, name: str) -> str:
+        return self._cached(name if isinstance(name, str) else str(name))
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+
+# движок для последнего использованного словаря: SYNONYMS отдаёт один и тот же mapping,
+# пока файл не поменяется, поэтому кэш живёт до перезагрузки синонимов
+_engine: Optional[CanonEngine] = None
+
 
-    return no_paren
\ No newline at end of file
+def engine_for(syn: Mapping[str, str]) -> CanonEngine:
+    global _engine
+    eng = _engine
+    if eng is None or eng.syn is not syn:
+        eng = _engine = CanonEngine(syn)
+    return eng
+
+
+def canonicalize(name: str, syn: Mapping[str, str]) -> str:
+    """
+    Приводит название к "каноническому" (см. _canonicalize).
+    Результат кэшируется по названию для этого syn — словарь не должен меняться на месте.
+    """
+    return engine_for(syn)(name)
+
+
+def canonical_map(names: Iterable[str], syn: Optional[Mapping[str, str]] = None) -> dict[str, str]:
+    """
+    name -> канон для набора названий (каждое уникальное считается один раз).
+    Пустой результат канонизации заменяется исходным названием.
+    """
+    if syn is None:
+        syn = load_synonyms()
+    return {n: canonicalize(n, syn) or n for n in dict.fromkeys(names)}
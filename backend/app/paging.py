@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+from typing import Any, Callable, Optional, Sequence
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+DIRECTIONS = ("next", "prev")
+
+
+def filters_tag(*filters: Any) -> str:
+    """Короткий хэш набора фильтров запроса: курсор годится только для тех же фильтров."""
+    raw = json.dumps(filters, ensure_ascii=False, default=str).encode()
+    return hashlib.sha256(raw).hexdigest()[:12]
+
+
+def encode_cursor(direction: str, key: Sequence[Any], filters: str = "") -> str:
+    """Непрозрачный курсор: направление + ключ сортировки крайней строки страницы + filters_tag."""
+    raw = json.dumps([direction, list(key), filters], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int, filters: str = "") -> tuple[str, list]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, key, tag = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("bad cursor")
+    if direction not in DIRECTIONS or not isinstance(key, list) or len(key) != size:
+        raise ValueError("bad cursor")
+    if tag != filters:
+        # курсор выдан для других фильтров — страница была бы из другой выборки
+        raise ValueError("cursor does not match filters")
+    return direction, key
+
+
+def keyset_page(
+    q: Query,
+    order_by: Sequence,
+    key_of: Callable[[Any], Sequence[Any]],
+    *,
+    limit: int,
+    cursor: Optional[str] = None,
+    lead=None,
+    filters: str = "",
+) -> tuple[list, Optional[str], Optional[str]]:
+    """
+    Страница q по ключу order_by (уникальному, по возрастанию) после/до строки из cursor:
+    WHERE (ключ) > (курсор) ORDER BY ключ LIMIT — страница N стоит как первая.
+    lead — выражение, по которому дополнительно ограничиваем снизу/сверху первым значением ключа
+    (когда ключ собран из колонок разных таблиц и сравнение кортежей индексом не используется).
+    filters — filters_tag фильтров q: зашивается в курсоры, курсор с другими фильтрами не принимается.
+    Возвращает (строки, next_cursor, prev_cursor); ValueError — плохой курсор.
+    """
+    direction, key = ("next", None) if cursor is None else decode_cursor(cursor, len(order_by), filters)
+    forward = direction == "next"
+    if key is not None:
+        q = q.filter(tuple_(*order_by) > tuple_(*key) if forward else tuple_(*order_by) < tuple_(*key))
+        if lead is not None:
+            q = q.filter(lead >= key[0] if forward else lead <= key[0])
+    q = q.order_by(*[c.asc() if forward else c.desc() for c in order_by])
+
+    # одна лишняя строка — есть ли что-то дальше в этом направлении
+    rows = q.limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+
+    first, last = encode_cursor("prev", key_of(rows[0]), filters), encode_cursor("next", key_of(rows[-1]), filters)
+    if forward:
+        return rows, last if more else None, first if key is not None else None
+    return rows, last, first if more else None
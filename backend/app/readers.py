@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+from typing import IO, Iterator, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+Source = Union[str, Path, IO[bytes]]
+
+# Сколько строк читаем за раз при потоковом импорте
+DEFAULT_CHUNK_ROWS = 50_000
+
+# Поддерживаемые форматы импорта по расширению файла
+FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+
+
+def file_format(name: Union[str, Path]) -> str:
+    fmt = FORMATS.get(Path(str(name)).suffix.lower())
+    if fmt is None:
+        raise ValueError(f"Unsupported file type, expected one of: {', '.join(sorted(FORMATS))}")
+    return fmt
+
+
+def file_sha256(source: Source, block: int = 1 << 20) -> str:
+    """sha256 содержимого файла (по блокам); открытый файл перематывается обратно в начало."""
+    h = hashlib.sha256()
+    if isinstance(source, (str, Path)):
+        with open(source, "rb") as f:
+            for buf in iter(lambda: f.read(block), b""):
+                h.update(buf)
+    else:
+        source.seek(0)
+        for buf in iter(lambda: source.read(block), b""):
+            h.update(buf)
+        source.seek(0)
+    return h.hexdigest()
+
+
+def as_text(s: pd.Series) -> pd.Series:
+    """
+    Строковая колонка без крайних пробелов. Типизированные Arrow-строки (Parquet/IPC)
+    чистятся векторно, без перевода в Python-объекты; пропуски в них -> "".
+    Остальное — как раньше для CSV, через astype(str).
+    """
+    if isinstance(s.dtype, pd.ArrowDtype) and (
+        pa.types.is_string(s.dtype.pyarrow_dtype) or pa.types.is_large_string(s.dtype.pyarrow_dtype)
+    ):
+        return s.str.strip().fillna("")
+    return s.astype(str).str.strip()
+
+
+def iter_csv_chunks(
+    source: Source,
+    chunksize: int = DEFAULT_CHUNK_ROWS,
+    *,
+    columns: set[str] | None = None,
+    dtype: dict | None = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Читает CSV кусками по chunksize строк.
+    columns — какие колонки оставить (остальные даже не парсятся),
+    dtype — компактные типы (например category для часто повторяющихся строк).
+    """
+    usecols = (lambda c: c in columns) if columns else None
+    with pd.read_csv(
+        source,
+        encoding="utf-8-sig",
+        chunksize=chunksize,
+        usecols=usecols,
+        dtype=dtype,
+    ) as reader:
+        yield from reader
+
+
+def _to_frame(batch: Union[pa.RecordBatch, pa.Table]) -> pd.DataFrame:
+    # колонки остаются типизированными Arrow-массивами (string[pyarrow], int64[pyarrow], ...)
+    return batch.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def _pick(names: list[str], columns: set[str] | None) -> Optional[list[str]]:
+    return [c for c in names if c in columns] if columns else None
+
+
+def _open_ipc(source: Source):
+    # .arrow/.feather — формат файла IPC; если это поток IPC, читаем как поток
+    src = pa.memory_map(str(source), "r") if isinstance(source, (str, Path)) else source
+    try:
+        return pa.ipc.open_file(src)
+    except pa.ArrowInvalid:
+        if not isinstance(source, (str, Path)):
+            source.seek(0)
+        return pa.ipc.open_stream(src)
+
+
+def _ipc_batches(reader) -> Iterator[pa.RecordBatch]:
+    if isinstance(reader, pa.ipc.RecordBatchFileReader):
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+    else:
+        yield from reader
+
+
+def iter_chunks(
+    source: Source,
+    fmt: str,
+    chunksize: int = DEFAULT_CHUNK_ROWS,
+    *,
+    columns: set[str] | None = None,
+    dtype: dict | None = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Куски файла любого поддерживаемого формата. Parquet и Arrow IPC читаются
+    с типизированными колонками (без разбора текста) и, если это файл на диске, через mmap.
+    dtype применяется только к CSV.
+    """
+    if fmt == "csv":
+        yield from iter_csv_chunks(source, chunksize, columns=columns, dtype=dtype)
+        return
+
+    if fmt == "parquet":
+        pf = pq.ParquetFile(source, memory_map=isinstance(source, (str, Path)))
+        cols = _pick(pf.schema_arrow.names, columns)
+        for batch in pf.iter_batches(batch_size=chunksize, columns=cols):
+            yield _to_frame(batch)
+        return
+
+    if fmt == "arrow":
+        reader = _open_ipc(source)
+        cols = _pick(reader.schema.names, columns)
+        for batch in _ipc_batches(reader):
+            if cols is not None:
+                batch = batch.select(cols)
+            # срезы record batch — без копирования данных
+            for start in range(0, batch.num_rows, chunksize):
+                yield _to_frame(batch.slice(start, chunksize))
+        return
+
+    raise ValueError(f"Unsupported format: {fmt}")
+
+
+def read_frame(source: Source, fmt: str, *, columns: set[str] | None = None, sep: str = ",") -> pd.DataFrame:
+    """Файл целиком в один DataFrame (для CSV — как раньше, pd.read_csv; sep — разделитель CSV)."""
+    if fmt == "csv":
+        return pd.read_csv(source, encoding="utf-8-sig", sep=sep)
+
+    if fmt == "parquet":
+        pf = pq.ParquetFile(source, memory_map=isinstance(source, (str, Path)))
+        return _to_frame(pf.read(columns=_pick(pf.schema_arrow.names, columns)))
+
+    if fmt == "arrow":
+        reader = _open_ipc(source)
+        table = reader.read_all()
+        cols = _pick(table.schema.names, columns)
+        return _to_frame(table.select(cols) if cols is not None else table)
+
+    raise ValueError(f"Unsupported format: {fmt}")
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import csv
+import io
+import re
+import zipfile
+from typing import Iterator
+from xml.sax.saxutils import escape
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import coverage
+from .db import engine
+
+# Сколько строк читаем из серверного курсора и отдаём клиенту за раз
+REPORT_BATCH_ROWS = 5000
+
+# Отчёты покрытия: вид -> (имя файла, заголовок CSV)
+REPORTS = {
+    "items": ("procurement_plan", ["item_name", "qty_required", "qty_available", "deficit", "mode"]),
+    "software": ("software_coverage", ["software_name", "seats_required", "seats_available", "deficit", "mode"]),
+}
+
+
+def iter_coverage_rows(kind: str, *, mode: str, only_deficit: bool, batch: int = REPORT_BATCH_ROWS) -> Iterator[list]:
+    """
+    Строки покрытия пачками по batch — из серверного (именованного) курсора на отдельном соединении:
+    в памяти не больше одной пачки, сессия запроса к этому моменту уже может быть закрыта.
+    """
+    with engine.connect() as conn:
+        sql, params = coverage.coverage_query(conn, kind, mode=mode, only_deficit=only_deficit)
+        result = conn.execution_options(stream_results=True, max_row_buffer=batch).execute(text(sql), params)
+        for rows in result.partitions(batch):
+            yield rows
+
+
+def iter_report_batches(kind: str, *, mode: str, only_deficit: bool, batch: int = REPORT_BATCH_ROWS) -> Iterator[list[tuple]]:
+    """Строки отчёта в порядке колонок REPORTS[kind] — пачками из курсора."""
+    for rows in iter_coverage_rows(kind, mode=mode, only_deficit=only_deficit, batch=batch):
+        yield [(r.name, int(r.required), int(r.available), int(r.deficit), mode) for r in rows]
+
+
+def _money(value) -> float | None:
+    return None if value is None else round(float(value), 2)
+
+
+def procurement_priced(db: Session, *, mode: str = "max_per_lab") -> dict:
+    """
+    План закупки с ценами: каждый дефицит оборудования — с самым дешёвым предложением
+    по тому же канону (offers, см. /import/offers-from-path). Стоимость строки (цена × дефицит)
+    и итог считаются тем же запросом; для каждого дефицита — один шаг по индексу (канон, цена).
+    """
+    sql, params = coverage.coverage_query(db, "items", mode=mode, only_deficit=True)
+    rows = db.execute(text(f"""
+        SELECT d.name, d.required, d.available, d.deficit,
+               o.price, o.price * d.deficit AS line_cost,
+               o.brand, o.offer_name, o.marketplace, o.link,
+               SUM(o.price * d.deficit) OVER () AS total_cost
+        FROM ({sql}) d
+        LEFT JOIN LATERAL (
+            SELECT price, brand, name AS offer_name, marketplace, link
+            FROM offers
+            WHERE canonical_name = d.name
+            ORDER BY price, id
+            LIMIT 1
+        ) o ON true
+        ORDER BY line_cost DESC NULLS LAST, d.deficit DESC, d.name COLLATE "C"
+    """), params).all()
+
+    priced = sum(1 for r in rows if r.price is not None)
+    return {
+        "mode": mode,
+        "positions": len(rows),
+        "priced_positions": priced,
+        "unpriced_positions": len(rows) - priced,
+        "total_cost": _money(rows[0].total_cost) if rows and rows[0].total_cost is not None else 0.0,
+        "rows": [
+            {
+                "item_name": r.name,
+                "qty_required": int(r.required),
+                "qty_available": int(r.available),
+                "deficit": int(r.deficit),
+                "price": _money(r.price),
+                "line_cost": _money(r.line_cost),
+                "brand": r.brand,
+                "offer_name": r.offer_name,
+                "marketplace": r.marketplace,
+                "link": r.link,
+            }
+            for r in rows
+        ],
+    }
+
+
+def _csv_bytes(rows) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+def iter_coverage_csv(kind: str, *, mode: str, only_deficit: bool, batch: int = REPORT_BATCH_ROWS) -> Iterator[bytes]:
+    """CSV отчёта покрытия кусками: BOM и заголовок — сразу, затем по пачке строк из курсора."""
+    _, header = REPORTS[kind]
+    # BOM для Excel на Windows
+    yield "\ufeff".encode("utf-8") + _csv_bytes([header])
+    for rows in iter_report_batches(kind, mode=mode, only_deficit=only_deficit, batch=batch):
+        yield _csv_bytes(rows)
+
+
+# --- XLSX -------------------------------------------------------------------
+# Книга пишется напрямую как zip из XML-частей (SpreadsheetML): лист — потоком, по пачке строк,
+# строки — inline-строками, без таблицы sharedStrings (её пришлось бы держать целиком до конца).
+
+_XLSX_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{_REL_NS}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{_REL_NS}/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # стиль 1 — жирный шрифт для заголовка
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<styleSheet xmlns="{_XLSX_NS}">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+# символы, недопустимые в XML 1.0 (управляющие, кроме \t \n \r)
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def _xlsx_workbook(sheet: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<workbook xmlns="{_XLSX_NS}" xmlns:r="{_REL_NS}">'
+        f'<sheets><sheet name="{escape(sheet[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def _xlsx_cell(value, style: str = "") -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c{style}><v>{value}</v></c>"
+    text_ = escape(_XML_ILLEGAL.sub("", str(value)))
+    return f'<c{style} t="inlineStr"><is><t xml:space="preserve">{text_}</t></is></c>'
+
+
+def _xlsx_rows(rows, style: str = "") -> bytes:
+    return "".join(
+        "<row>" + "".join(_xlsx_cell(v, style) for v in row) + "</row>" for row in rows
+    ).encode("utf-8")
+
+
+class _Sink:
+    """Файл без seek/tell для ZipFile: записанное забирается кусками (drain) и уходит в ответ."""
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_xlsx(sheet: str, header: list[str], batches: Iterator[list[tuple]], widths: tuple[int, ...] = ()) -> Iterator[bytes]:
+    """
+    XLSX из пачек строк — кусками: числа пишутся числовыми ячейками, заголовок жирный и закреплён.
+    ZipFile пишет в поток без seek (размеры — в дескрипторах данных после каждой части),
+    поэтому в памяти — только текущая пачка и буфер deflate.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        parts = {**_XLSX_PARTS, "xl/workbook.xml": _xlsx_workbook(sheet)}
+        for name, body in parts.items():
+            # фиксированная дата в заголовках zip: одинаковые данные — одинаковые байты
+            zf.writestr(zipfile.ZipInfo(name), body, compress_type=zipfile.ZIP_DEFLATED)
+        yield sink.drain()
+
+        info = zipfile.ZipInfo("xl/worksheets/sheet1.xml")
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with zf.open(info, "w") as ws:
+            cols = "".join(
+                f'<col min="{i}" max="{i}" width="{w}" customWidth="1"/>' for i, w in enumerate(widths, 1)
+            )
+            ws.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                f'<worksheet xmlns="{_XLSX_NS}">'
+                '<sheetViews><sheetView workbookViewId="0">'
+                '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+                '</sheetView></sheetViews>'
+                + (f"<cols>{cols}</cols>" if cols else "")
+                + "<sheetData>"
+            ).encode("utf-8"))
+            ws.write(_xlsx_rows([header], style=' s="1"'))
+            for rows in batches:
+                ws.write(_xlsx_rows(rows))
+                yield sink.drain()
+            ws.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+
+def iter_coverage_xlsx(kind: str, *, mode: str, only_deficit: bool, batch: int = REPORT_BATCH_ROWS) -> Iterator[bytes]:
+    """XLSX отчёта покрытия: те же колонки и строки, что в CSV."""
+    filename, header = REPORTS[kind]
+    batches = iter_report_batches(kind, mode=mode, only_deficit=only_deficit, batch=batch)
+    return iter_xlsx(filename, header, batches, widths=(60, 14, 14, 12, 12))
+
+
+# Форматы отчётов покрытия: расширение -> (генератор тела, Content-Type)
+FORMATS = {
+    "csv": (iter_coverage_csv, "text/csv; charset=utf-8"),
+    "xlsx": (iter_coverage_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .cache import data_generation
+from .coverage import SPECS, _inventory_sql
+
+# Сколько ячеек (сценарии × строки требований) считаем за раз — ограничивает память пакета
+BLOCK_CELLS = 4_000_000
+
+# Режимы, которые считаются по матрицам (peak требует расписания — только /calc/coverage)
+MODES = ("sum", "max_per_lab")
+
+# Погрешность float при умножении на коэффициент: 1.1 * 10 = 11.000000000000002 -> 11, а не 12
+_EPS = 1e-9
+
+
+@dataclass(frozen=True)
+class CoverageMatrix:
+    """
+    Требования и наличие одного вида (items | software) в виде массивов NumPy.
+    Строки требований — группы (канон, lab, исходное название, discipline), отсортированные так,
+    что каждый канон и каждая тройка (канон, lab, исходное название) — непрерывный отрезок:
+    суммы и максимумы по ним — один reduceat сразу для всех сценариев.
+    """
+    kind: str
+    generation: int
+    names: np.ndarray            # (N,) канонические названия, по возрастанию
+    available: np.ndarray        # (N,) сколько есть
+    qty: np.ndarray              # (R,) сколько требует строка
+    lab_codes: np.ndarray        # (R,) индекс в labs
+    discipline_codes: np.ndarray  # (R,) индекс в disciplines
+    labs: dict                   # lab -> код (None — пустая lab)
+    disciplines: dict            # discipline -> код
+    name_starts: np.ndarray      # (N,) начало отрезка канона в строках
+    group_starts: np.ndarray     # (G,) начало отрезка (канон, lab, исходное название) в строках
+    group_name_starts: np.ndarray  # (N,) начало отрезка канона среди групп
+
+
+def _codes(values: pd.Series) -> tuple[np.ndarray, dict]:
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return codes.astype(np.int32), {(None if pd.isna(v) else v): i for i, v in enumerate(uniques)}
+
+
+def load_matrix(db: Session, kind: str, generation: int = 0) -> CoverageMatrix:
+    spec = SPECS[kind]
+    req = pd.read_sql_query(text(f"""
+        SELECT {spec['req_name']} AS name, r.lab AS lab, {spec['req_raw']} AS raw,
+               r.discipline AS discipline, SUM({spec['req_qty']})::bigint AS qty
+        FROM {spec['req_from']}
+        GROUP BY 1, 2, 3, 4
+    """), db.connection())
+    inv = pd.read_sql_query(text(_inventory_sql(spec)), db.connection())
+
+    # порядок названий — по кодовым точкам (как ORDER BY ... COLLATE "C" в coverage)
+    req = req.sort_values(["name", "lab", "raw"], na_position="last", kind="stable", ignore_index=True)
+    name_change = np.ones(len(req), dtype=bool)
+    group_change = np.ones(len(req), dtype=bool)
+    if len(req):
+        same_name = req["name"].to_numpy()[1:] == req["name"].to_numpy()[:-1]
+        same_lab = req["lab"].fillna("\0").to_numpy()[1:] == req["lab"].fillna("\0").to_numpy()[:-1]
+        same_raw = req["raw"].to_numpy()[1:] == req["raw"].to_numpy()[:-1]
+        name_change[1:] = ~same_name
+        group_change[1:] = ~(same_name & same_lab & same_raw)
+
+    name_starts = np.flatnonzero(name_change)
+    group_starts = np.flatnonzero(group_change)
+    names = req["name"].to_numpy()[name_starts]
+    available = (
+        pd.Series(inv["qty"].to_numpy(), index=inv["name"]).reindex(names).fillna(0).to_numpy(np.int64)
+        if len(names) else np.zeros(0, dtype=np.int64)
+    )
+    lab_codes, labs = _codes(req["lab"])
+    discipline_codes, disciplines = _codes(req["discipline"])
+
+    return CoverageMatrix(
+        kind=kind,
+        generation=generation,
+        names=names,
+        available=available,
+        qty=req["qty"].to_numpy(np.int64),
+        lab_codes=lab_codes,
+        discipline_codes=discipline_codes,
+        labs=labs,
+        disciplines=disciplines,
+        name_starts=name_starts,
+        group_starts=group_starts,
+        # номер группы, с которой начинается каждый канон
+        group_name_starts=np.searchsorted(group_starts, name_starts),
+    )
+
+
+_matrices: dict[str, CoverageMatrix] = {}
+_matrices_lock = threading.Lock()
+
+
+def matrix(db: Session, kind: str) -> CoverageMatrix:
+    """Матрица текущего поколения данных: строится один раз после каждого импорта."""
+    generation = data_generation()
+    with _matrices_lock:
+        m = _matrices.get(kind)
+        if m is None or m.generation != generation:
+            m = _matrices[kind] = load_matrix(db, kind, generation)
+    return m
+
+
+def _allowed(codes: dict, selected: Optional[Sequence[str]]) -> np.ndarray:
+    # маска по кодам: None — все значения (включая пустые), иначе только перечисленные
+    ok = np.ones(len(codes), dtype=bool)
+    if selected is not None:
+        ok[:] = False
+        for value in selected:
+            code = codes.get(value)
+            if code is not None:
+                ok[code] = True
+    return ok
+
+
+def _evaluate_block(m: CoverageMatrix, scenarios: list[dict], top: int) -> list[dict]:
+    factors = np.array([s["students_factor"] for s in scenarios], dtype=np.float64)
+    lab_ok = np.stack([_allowed(m.labs, s.get("labs")) for s in scenarios])
+    discipline_ok = np.stack([_allowed(m.disciplines, s.get("disciplines")) for s in scenarios])
+
+    # (S, R): требование строки в каждом сценарии, 0 — строка не входит в сценарий
+    included = lab_ok[:, m.lab_codes] & discipline_ok[:, m.discipline_codes]
+    scaled = np.ceil(factors[:, None] * m.qty[None, :] - _EPS).astype(np.int64)
+    scaled *= included
+
+    present = np.add.reduceat(included, m.name_starts, axis=1) > 0
+    required = {}
+    if any(s["mode"] == "sum" for s in scenarios):
+        required["sum"] = np.add.reduceat(scaled, m.name_starts, axis=1)
+    if any(s["mode"] == "max_per_lab" for s in scenarios):
+        # MAX по дисциплинам внутри (lab, исходное название), затем сумма внутри канона
+        per_group = np.maximum.reduceat(scaled, m.group_starts, axis=1)
+        required["max_per_lab"] = np.add.reduceat(per_group, m.group_name_starts, axis=1)
+
+    spec = SPECS[m.kind]
+    name_key, required_key, available_key = spec["keys"]
+    results = []
+    for i, s in enumerate(scenarios):
+        req = required[s["mode"]][i]
+        deficit = np.maximum(req - m.available, 0) * present[i]
+        required_total = int(req.sum())
+        deficit_total = int(deficit.sum())
+        # дефицит ↓, при равенстве — название (names уже отсортированы)
+        order = np.argsort(-deficit, kind="stable")[:top]
+        rows = [
+            {
+                name_key: m.names[j],
+                required_key: int(req[j]),
+                available_key: int(m.available[j]),
+                "deficit": int(deficit[j]),
+            }
+            for j in order if deficit[j] > 0
+        ]
+        results.append({
+            **s,
+            "positions": int(present[i].sum()),
+            "deficit_positions": int(np.count_nonzero(deficit)),
+            "required_total": required_total,
+            "deficit_total": deficit_total,
+            "coverage_pct": round(100.0 * (1 - deficit_total / required_total), 2) if required_total else 100.0,
+            "top_deficit": rows,
+        })
+    return results
+
+
+def evaluate(db: Session, kind: str, scenarios: list[dict], *, top: int = 10) -> dict:
+    """
+    Покрытие для пакета сценариев "что если" за один проход.
+    Сценарий: students_factor (требования × коэффициент, с округлением вверх), labs / disciplines
+    (None — все), mode (sum | max_per_lab). Наличие общее для всех сценариев.
+    """
+    for s in scenarios:
+        if s["mode"] not in MODES:
+            raise ValueError("mode must be 'sum' or 'max_per_lab'")
+
+    m = matrix(db, kind)
+    block = max(1, BLOCK_CELLS // max(len(m.qty), 1))
+    results = []
+    if len(m.qty):
+        for start in range(0, len(scenarios), block):
+            results.extend(_evaluate_block(m, scenarios[start:start + block], top))
+    else:
+        results = [
+            {**s, "positions": 0, "deficit_positions": 0, "required_total": 0, "deficit_total": 0,
+             "coverage_pct": 100.0, "top_deficit": []}
+            for s in scenarios
+        ]
+    return {"kind": kind, "generation": m.generation, "positions": len(m.names), "scenarios": results}
@@ -0,0 +1,73 @@
+"""
+Скорость normalize_items.canonicalize на корпусе mstuca_items2_normalized.csv (названий в секунду).
+
+    cd backend
+    python -m bench.canonicalize
+    # сравнить с прежней версией модуля — из рабочей копии нужной ревизии целиком
+    # (модуль ищет synonyms.csv относительно себя, как backend/app/ в репо; отдельный файл в /tmp не годится):
+    git worktree add --detach /tmp/mto-baseline <rev>
+    python -m bench.canonicalize --baseline /tmp/mto-baseline/backend/app/normalize_items.py
+    git worktree remove /tmp/mto-baseline
+
+cold — без LRU (каждое название считается заново), warm — через canonicalize с LRU,
+как при импорте и пересчёте канона.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from app import normalize_items
+
+CORPUS = Path(__file__).resolve().parents[2] / "data" / "processed" / "mstuca_items2_normalized.csv"
+
+
+def _rate(fn, names: list[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for n in names:
+            fn(n)
+        best = min(best, time.perf_counter() - t)
+    return len(names) / best
+
+
+def _load_module(path: str):
+    spec = importlib.util.spec_from_file_location("normalize_items_baseline", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--corpus", default=str(CORPUS))
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--baseline", help="путь к прежней версии normalize_items.py")
+    args = ap.parse_args()
+
+    names = pd.read_csv(args.corpus, encoding="utf-8-sig")["item_name"].astype(str).tolist()
+    syn = normalize_items.load_synonyms()
+    print(f"corpus: {len(names)} names, {len(set(names))} unique, {len(syn)} synonyms")
+
+    results = {}
+    if args.baseline:
+        old = _load_module(args.baseline)
+        old_syn = old.load_synonyms()
+        results["baseline"] = _rate(lambda n: old.canonicalize(n, old_syn), names, args.repeat)
+        mismatches = sum(old.canonicalize(n, old_syn) != normalize_items.canonicalize(n, syn) for n in names)
+        print(f"mismatches vs baseline: {mismatches}")
+
+    results["cold"] = _rate(lambda n: normalize_items._canonicalize(n, syn), names, args.repeat)
+    results["warm"] = _rate(lambda n: normalize_items.canonicalize(n, syn), names, args.repeat)
+
+    for label, rate in results.items():
+        print(f"{label:>8}: {rate:12,.0f} names/s")
+
+
+if __name__ == "__main__":
+    main()
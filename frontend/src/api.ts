@@ -14,6 +14,55 @@ async function request<T>(path: string, options?: RequestInit): Promise<T> {
   return res.text() as Promise<T>;
 }
 
+export type CoverageMode = 'sum' | 'max_per_lab' | 'peak';
+export type CoverageSort = 'deficit' | 'required' | 'name';
+
+export type CoverageParams = {
+  only_deficit?: boolean;
+  mode?: CoverageMode;
+  sort?: CoverageSort;
+  q?: string;
+  limit?: number;
+  cursor?: string;
+};
+
+export type CoveragePage<Row> = {
+  only_deficit: boolean;
+  mode: string;
+  rows: Row[];
+  next_cursor?: string | null;
+};
+
+// total — только на первой странице (без cursor)
+export type KeysetPage<Row> = {
+  total: number | null;
+  limit: number;
+  offset: number;
+  rows: Row[];
+  next_cursor: string | null;
+  prev_cursor: string | null;
+};
+
+function coverageQuery(params?: CoverageParams) {
+  const q = new URLSearchParams();
+  if (params?.only_deficit !== undefined) q.set('only_deficit', String(params.only_deficit));
+  if (params?.mode) q.set('mode', params.mode);
+  if (params?.sort) q.set('sort', params.sort);
+  if (params?.q) q.set('q', params.q);
+  if (params?.limit) q.set('limit', String(params.limit));
+  if (params?.cursor) q.set('cursor', params.cursor);
+  return q;
+}
+
+export type ReportFormat = 'csv' | 'xlsx';
+
+function reportUrl(name: string, params?: { mode?: string; only_deficit?: boolean; format?: ReportFormat }) {
+  const q = new URLSearchParams();
+  if (params?.mode) q.set('mode', params.mode);
+  if (params?.only_deficit !== undefined) q.set('only_deficit', String(params.only_deficit));
+  return `${API_BASE}/reports/${name}.${params?.format ?? 'csv'}?${q}`;
+}
+
 export const api = {
   health: () => request<{ status: string; db: string }>('/health'),
   stats: () => request<{
@@ -24,50 +73,36 @@ export const api = {
     requirements_rows: number;
     requirements_sum: number;
   }>('/stats'),
-  inventory: (params?: { item?: string; location?: string; limit?: number; offset?: number }) => {
+  inventory: (params?: { item?: string; location?: string; limit?: number; offset?: number; cursor?: string }) => {
     const q = new URLSearchParams();
     if (params?.item) q.set('item', params.item);
     if (params?.location) q.set('location', params.location);
     if (params?.limit) q.set('limit', String(params.limit));
     if (params?.offset) q.set('offset', String(params.offset));
-    return request<{ total: number; limit: number; offset: number; rows: { item_name: string; location: string; qty_available: number }[] }>(`/inventory?${q}`);
+    if (params?.cursor) q.set('cursor', params.cursor);
+    return request<KeysetPage<{ item_name: string; location: string; qty_available: number }>>(`/inventory?${q}`);
   },
   inventorySummary: () =>
     request<{ rows: { item_name: string; qty_total: number }[] }>('/inventory/summary'),
-  requirements: (params?: { discipline?: string; item?: string; limit?: number; offset?: number }) => {
+  requirements: (params?: { discipline?: string; item?: string; limit?: number; offset?: number; cursor?: string }) => {
     const q = new URLSearchParams();
     if (params?.discipline) q.set('discipline', params.discipline);
     if (params?.item) q.set('item', params.item);
     if (params?.limit) q.set('limit', String(params.limit));
     if (params?.offset) q.set('offset', String(params.offset));
-    return request<{ total: number; limit: number; offset: number; rows: { discipline: string | null; lab: string | null; item_name: string; qty_required: number }[] }>(`/requirements?${q}`);
+    if (params?.cursor) q.set('cursor', params.cursor);
+    return request<KeysetPage<{ discipline: string | null; lab: string | null; item_name: string; qty_required: number }>>(`/requirements?${q}`);
   },
   requirementsSummary: (by: 'item' | 'discipline' = 'item') =>
     request<{ by: string; rows: { item_name?: string; discipline?: string; qty_required: number }[] }>(`/requirements/summary?by=${by}`),
-  coverage: (params?: { only_deficit?: boolean; mode?: 'sum' | 'max_per_lab' }) => {
-    const q = new URLSearchParams();
-    if (params?.only_deficit !== undefined) q.set('only_deficit', String(params.only_deficit));
-    if (params?.mode) q.set('mode', params.mode);
-    return request<{ only_deficit: boolean; mode: string; rows: { item_name: string; qty_required: number; qty_available: number; deficit: number }[] }>(`/calc/coverage?${q}`);
-  },
-  softwareCoverage: (params?: { only_deficit?: boolean; mode?: 'sum' | 'max_per_lab' }) => {
-    const q = new URLSearchParams();
-    if (params?.only_deficit !== undefined) q.set('only_deficit', String(params.only_deficit));
-    if (params?.mode) q.set('mode', params.mode);
-    return request<{ only_deficit: boolean; mode: string; rows: { software_name: string; seats_required: number; seats_available: number; deficit: number }[] }>(`/calc/software-coverage?${q}`);
-  },
-  reportProcurementCsv: (params?: { mode?: string; only_deficit?: boolean }) => {
-    const q = new URLSearchParams();
-    if (params?.mode) q.set('mode', params.mode);
-    if (params?.only_deficit !== undefined) q.set('only_deficit', String(params.only_deficit));
-    return `${API_BASE}/reports/procurement.csv?${q}`;
-  },
-  reportSoftwareCsv: (params?: { mode?: string; only_deficit?: boolean }) => {
-    const q = new URLSearchParams();
-    if (params?.mode) q.set('mode', params.mode);
-    if (params?.only_deficit !== undefined) q.set('only_deficit', String(params.only_deficit));
-    return `${API_BASE}/reports/software_coverage.csv?${q}`;
-  },
+  coverage: (params?: CoverageParams) =>
+    request<CoveragePage<{ item_name: string; qty_required: number; qty_available: number; deficit: number }>>(`/calc/coverage?${coverageQuery(params)}`),
+  softwareCoverage: (params?: CoverageParams) =>
+    request<CoveragePage<{ software_name: string; seats_required: number; seats_available: number; deficit: number }>>(`/calc/software-coverage?${coverageQuery(params)}`),
+  reportProcurementCsv: (params?: { mode?: string; only_deficit?: boolean; format?: ReportFormat }) =>
+    reportUrl('procurement', params),
+  reportSoftwareCsv: (params?: { mode?: string; only_deficit?: boolean; format?: ReportFormat }) =>
+    reportUrl('software_coverage', params),
   aiReport: (params?: { mode?: string; include_software?: boolean; students_factor?: number }) => {
     const q = new URLSearchParams();
     if (params?.mode) q.set('mode', params.mode);
@@ -1,28 +1,43 @@
 import { useEffect, useState } from 'react'
-import { api } from '../api'
+import { api, type CoverageMode, type CoverageSort } from '../api'
 
-type Mode = 'sum' | 'max_per_lab'
+const PAGE = 200
 
 export default function Coverage() {
   const [equipment, setEquipment] = useState<Awaited<ReturnType<typeof api.coverage>> | null>(null)
   const [software, setSoftware] = useState<Awaited<ReturnType<typeof api.softwareCoverage>> | null>(null)
   const [error, setError] = useState<string | null>(null)
   const [onlyDeficit, setOnlyDeficit] = useState(true)
-  const [mode, setMode] = useState<Mode>('max_per_lab')
+  const [mode, setMode] = useState<CoverageMode>('max_per_lab')
+  const [sort, setSort] = useState<CoverageSort>('deficit')
+  const [search, setSearch] = useState('')
+  // фильтр последнего запроса: по нему выдан next_cursor (поле ввода могли поменять без «Обновить»)
+  const [query, setQuery] = useState('')
 
-  const load = () => {
+  // оборудование — постранично (следующая страница по next_cursor), ПО — целиком
+  const load = (q = query) => {
     setError(null)
-    api.coverage({ only_deficit: onlyDeficit, mode }).then(setEquipment).catch((e) => setError(e.message))
-    api.softwareCoverage({ only_deficit: onlyDeficit, mode }).then(setSoftware).catch(() => setSoftware(null))
+    setQuery(q)
+    const params = { only_deficit: onlyDeficit, mode, sort, q: q || undefined }
+    api.coverage({ ...params, limit: PAGE }).then(setEquipment).catch((e) => setError(e.message))
+    api.softwareCoverage(params).then(setSoftware).catch(() => setSoftware(null))
   }
 
-  useEffect(() => { load(); }, [onlyDeficit, mode])
+  const loadMore = () => {
+    if (!equipment?.next_cursor) return
+    api.coverage({ only_deficit: onlyDeficit, mode, sort, q: query || undefined, limit: PAGE, cursor: equipment.next_cursor })
+      .then((page) => setEquipment({ ...page, rows: [...equipment.rows, ...page.rows] }))
+      .catch((e) => setError(e.message))
+  }
+
+  useEffect(() => { load(); }, [onlyDeficit, mode, sort])
+  const onSearch = (e: React.FormEvent) => { e.preventDefault(); load(search); }
 
   return (
     <>
       <h1 style={{ marginTop: 0 }}>Покрытие</h1>
       <p style={{ color: 'var(--text-muted)', marginBottom: 16 }}>
-        Сравнение наличия с требованиями. Режим: <strong>sum</strong> — сумма по дисциплинам; <strong>max_per_lab</strong> — по каждой лаборатории берётся максимум, затем сумма.
+        Сравнение наличия с требованиями. Режим: <strong>sum</strong> — сумма по дисциплинам; <strong>max_per_lab</strong> — по каждой лаборатории берётся максимум, затем сумма; <strong>peak</strong> — пик одновременной потребности по расписанию.
       </p>
       <div style={{ display: 'flex', gap: 16, marginBottom: 24, flexWrap: 'wrap' }}>
         <label style={{ display: 'flex', alignItems: 'center', gap: 8 }}>
@@ -31,12 +46,24 @@ export default function Coverage() {
         </label>
         <label style={{ display: 'flex', alignItems: 'center', gap: 8 }}>
           Режим:
-          <select className="input" value={mode} onChange={(e) => setMode(e.target.value as Mode)} style={{ width: 'auto' }}>
+          <select className="input" value={mode} onChange={(e) => setMode(e.target.value as CoverageMode)} style={{ width: 'auto' }}>
             <option value="sum">sum</option>
             <option value="max_per_lab">max_per_lab</option>
+            <option value="peak">peak</option>
+          </select>
+        </label>
+        <label style={{ display: 'flex', alignItems: 'center', gap: 8 }}>
+          Сортировка:
+          <select className="input" value={sort} onChange={(e) => setSort(e.target.value as CoverageSort)} style={{ width: 'auto' }}>
+            <option value="deficit">по дефициту</option>
+            <option value="required">по потребности</option>
+            <option value="name">по названию</option>
           </select>
         </label>
-        <button className="btn" onClick={load}>Обновить</button>
+        <form onSubmit={onSearch} style={{ display: 'flex', gap: 8 }}>
+          <input className="input" placeholder="Позиция (фильтр)" value={search} onChange={(e) => setSearch(e.target.value)} />
+          <button type="submit" className="btn">Обновить</button>
+        </form>
       </div>
       {error && <div className="error">{error}</div>}
       {equipment && (
@@ -66,6 +93,11 @@ export default function Coverage() {
               </tbody>
             </table>
           </div>
+          {equipment.next_cursor && (
+            <button className="btn" onClick={loadMore} style={{ marginTop: -16, marginBottom: 32 }}>
+              Показать ещё
+            </button>
+          )}
         </>
       )}
       {software && software.rows.length > 0 && (
@@ -8,20 +8,28 @@ export default function Inventory() {
   const [error, setError] = useState<string | null>(null)
   const [item, setItem] = useState('')
   const [location, setLocation] = useState('')
-  const [offset, setOffset] = useState(0)
+  // фильтры последнего «Применить»: курсоры выданы для них (поля могли поменять без отправки)
+  const [filters, setFilters] = useState({ item: '', location: '' })
+  const [cursor, setCursor] = useState<string | undefined>(undefined)
+  const [total, setTotal] = useState<number | null>(null)
   const [file, setFile] = useState<File | null>(null)
   const [importing, setImporting] = useState(false)
   const [importMsg, setImportMsg] = useState<string | null>(null)
 
   const load = () => {
     setError(null)
-    api.inventory({ item: item || undefined, location: location || undefined, limit: LIMIT, offset })
-      .then(setData)
+    api.inventory({ item: filters.item || undefined, location: filters.location || undefined, limit: LIMIT, cursor })
+      .then((page) => {
+        setData(page)
+        // total приходит только с первой страницей
+        if (page.total !== null) setTotal(page.total)
+      })
       .catch((e) => setError(e.message))
   }
 
-  useEffect(() => { load(); }, [offset])
-  const onFilter = (e: React.FormEvent) => { e.preventDefault(); setOffset(0); load(); }
+  // листание — курсорами (keyset): next_cursor / prev_cursor из ответа
+  useEffect(() => { load(); }, [cursor, filters])
+  const onFilter = (e: React.FormEvent) => { e.preventDefault(); setCursor(undefined); setFilters({ item, location }); }
 
   const doImport = async () => {
     if (!file) return
@@ -63,7 +71,7 @@ export default function Inventory() {
       {error && <div className="error">{error}</div>}
       {data && (
         <>
-          <p style={{ color: 'var(--text-muted)' }}>Всего: {data.total}. Показано: {data.rows.length}.</p>
+          <p style={{ color: 'var(--text-muted)' }}>Всего: {total ?? '—'}. Показано: {data.rows.length}.</p>
           <div style={{ overflowX: 'auto' }}>
             <table>
               <thead>
@@ -85,10 +93,10 @@ export default function Inventory() {
             </table>
           </div>
           <div style={{ marginTop: 16, display: 'flex', gap: 8 }}>
-            <button className="btn" onClick={() => setOffset((o) => Math.max(0, o - LIMIT))} disabled={offset === 0}>
+            <button className="btn" onClick={() => setCursor(data.prev_cursor ?? undefined)} disabled={!data.prev_cursor}>
               Назад
             </button>
-            <button className="btn" onClick={() => setOffset((o) => o + LIMIT)} disabled={data.rows.length < LIMIT}>
+            <button className="btn" onClick={() => setCursor(data.next_cursor ?? undefined)} disabled={!data.next_cursor}>
               Вперёд
             </button>
           </div>
@@ -7,12 +7,14 @@ export default function Reports() {
 
   const equipmentUrl = api.reportProcurementCsv({ mode, only_deficit: onlyDeficit })
   const softwareUrl = api.reportSoftwareCsv({ mode, only_deficit: onlyDeficit })
+  const equipmentXlsxUrl = api.reportProcurementCsv({ mode, only_deficit: onlyDeficit, format: 'xlsx' })
+  const softwareXlsxUrl = api.reportSoftwareCsv({ mode, only_deficit: onlyDeficit, format: 'xlsx' })
 
   return (
     <>
       <h1 style={{ marginTop: 0 }}>Отчёты</h1>
       <p style={{ color: 'var(--text-muted)', marginBottom: 24 }}>
-        Скачать CSV для закупок (оборудование) и покрытия ПО.
+        Скачать CSV или Excel (XLSX) для закупок (оборудование) и покрытия ПО.
       </p>
       <div className="card" style={{ marginBottom: 24 }}>
         <h3 style={{ marginTop: 0 }}>Параметры</h3>
@@ -37,6 +39,12 @@ export default function Reports() {
         <a href={softwareUrl} download="software_coverage.csv" className="btn btn-primary">
           Скачать отчёт по ПО (CSV)
         </a>
+        <a href={equipmentXlsxUrl} download="procurement_plan.xlsx" className="btn">
+          Оборудование (Excel)
+        </a>
+        <a href={softwareXlsxUrl} download="software_coverage.xlsx" className="btn">
+          ПО (Excel)
+        </a>
       </div>
     </>
   )
@@ -8,7 +8,10 @@ export default function Requirements() {
   const [error, setError] = useState<string | null>(null)
   const [discipline, setDiscipline] = useState('')
   const [item, setItem] = useState('')
-  const [offset, setOffset] = useState(0)
+  // фильтры последнего «Применить»: курсоры выданы для них (поля могли поменять без отправки)
+  const [filters, setFilters] = useState({ discipline: '', item: '' })
+  const [cursor, setCursor] = useState<string | undefined>(undefined)
+  const [total, setTotal] = useState<number | null>(null)
   const [file, setFile] = useState<File | null>(null)
   const [replace, setReplace] = useState(false)
   const [importing, setImporting] = useState(false)
@@ -16,13 +19,18 @@ export default function Requirements() {
 
   const load = () => {
     setError(null)
-    api.requirements({ discipline: discipline || undefined, item: item || undefined, limit: LIMIT, offset })
-      .then(setData)
+    api.requirements({ discipline: filters.discipline || undefined, item: filters.item || undefined, limit: LIMIT, cursor })
+      .then((page) => {
+        setData(page)
+        // total приходит только с первой страницей
+        if (page.total !== null) setTotal(page.total)
+      })
       .catch((e) => setError(e.message))
   }
 
-  useEffect(() => { load(); }, [offset])
-  const onFilter = (e: React.FormEvent) => { e.preventDefault(); setOffset(0); load(); }
+  // листание — курсорами (keyset): next_cursor / prev_cursor из ответа
+  useEffect(() => { load(); }, [cursor, filters])
+  const onFilter = (e: React.FormEvent) => { e.preventDefault(); setCursor(undefined); setFilters({ discipline, item }); }
 
   const doImport = async () => {
     if (!file) return
@@ -68,7 +76,7 @@ export default function Requirements() {
       {error && <div className="error">{error}</div>}
       {data && (
         <>
-          <p style={{ color: 'var(--text-muted)' }}>Всего: {data.total}. Показано: {data.rows.length}.</p>
+          <p style={{ color: 'var(--text-muted)' }}>Всего: {total ?? '—'}. Показано: {data.rows.length}.</p>
           <div style={{ overflowX: 'auto' }}>
             <table>
               <thead>
@@ -92,10 +100,10 @@ export default function Requirements() {
             </table>
           </div>
           <div style={{ marginTop: 16, display: 'flex', gap: 8 }}>
-            <button className="btn" onClick={() => setOffset((o) => Math.max(0, o - LIMIT))} disabled={offset === 0}>
+            <button className="btn" onClick={() => setCursor(data.prev_cursor ?? undefined)} disabled={!data.prev_cursor}>
               Назад
             </button>
-            <button className="btn" onClick={() => setOffset((o) => o + LIMIT)} disabled={data.rows.length < LIMIT}>
+            <button className="btn" onClick={() => setCursor(data.next_cursor ?? undefined)} disabled={!data.next_cursor}>
               Вперёд
             </button>
           </div>